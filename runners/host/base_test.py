@@ -27,6 +27,7 @@ from vts.runners.host import logger
 from vts.runners.host import records
 from vts.runners.host import signals
 from vts.runners.host import utils
+from vts.runners.host.tcp_client import vts_tcp_client_stats
 from vts.utils.python.controllers import android_device
 from vts.utils.python.common import filter_utils
 from vts.utils.python.common import list_utils
@@ -43,6 +44,7 @@ RESULT_LINE_TEMPLATE = TEST_CASE_TOKEN + " %s %s"
 STR_TEST = "test"
 STR_GENERATE = "generate"
 _REPORT_MESSAGE_FILE_NAME = "report_proto.msg"
+_AGENT_RPC_STATS_FILE_NAME = "agent_rpc_stats.json"
 _BUG_REPORT_FILE_PREFIX = "bugreport"
 _BUG_REPORT_FILE_EXTENSION = ".zip"
 _ANDROID_DEVICES = '_android_devices'
@@ -154,6 +156,9 @@ class BaseTestClass(object):
         self._skip_all_testcases = False
         self._bug_report_on_failure = self.getUserParam(
             keys.ConfigKeys.IKEY_BUG_REPORT_ON_FAILURE, default_value=False)
+        self._upload_agent_rpc_stats = self.getUserParam(
+            keys.ConfigKeys.IKEY_ENABLE_AGENT_RPC_PROFILING,
+            default_value=False)
 
     @property
     def android_devices(self):
@@ -292,6 +297,7 @@ class BaseTestClass(object):
         is called.
         """
         ret = self.tearDownClass()
+        self._ReportAgentRpcStats()
         if self.log_uploading.enabled:
             self.log_uploading.UploadLogs()
         if self.web.enabled:
@@ -311,6 +317,34 @@ class BaseTestClass(object):
 
         return ret
 
+    def GetAgentRpcStats(self):
+        """Returns the statistics of the agent RPCs made by this module.
+
+        Returns:
+            dict, see VtsTcpClientStats.GetSummary.
+        """
+        return vts_tcp_client_stats.GetDefaultStats().GetSummary()
+
+    def _ReportAgentRpcStats(self):
+        """Logs and dumps the agent RPC statistics of this module.
+
+        The latency histograms are uploaded too if enabled in the config.
+        """
+        rpc_stats = vts_tcp_client_stats.GetDefaultStats()
+        if not rpc_stats.GetSummary():
+            return
+        logging.info("Agent RPCs took %.3fs in total.",
+                     rpc_stats.GetTotalSecs())
+        rpc_stats.LogSummary()
+        stats_path = os.path.join(logging.log_path, _AGENT_RPC_STATS_FILE_NAME)
+        try:
+            rpc_stats.Dump(stats_path)
+            logging.info("Agent RPC stats path: %s", stats_path)
+        except IOError as e:
+            logging.error("Failed to dump agent RPC stats: %s", e)
+        if self._upload_agent_rpc_stats:
+            rpc_stats.UploadToWeb(self.web)
+
     def tearDownClass(self):
         """Teardown function that will be called after all the selected test
         cases in the test class have been executed.
@@ -847,6 +881,7 @@ class BaseTestClass(object):
             for test_name in test_names if test_name.startswith(STR_TEST)
         ]
         tests = self._get_test_funcs(test_names)
+        vts_tcp_client_stats.GetDefaultStats().Reset()
         # Setup for the class.
         try:
             if self._setUpClass() is False:
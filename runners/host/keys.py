@@ -83,6 +83,7 @@ class ConfigKeys(object):
     IKEY_PROFILING_TRACING_PATH = "profiling_trace_path"
     IKEY_TRACE_FILE_TOOL_NAME = "trace_file_tool_name"
     IKEY_SAVE_TRACE_FILE_REMOTE = "save_trace_file_remote"
+    IKEY_ENABLE_AGENT_RPC_PROFILING = "enable_agent_rpc_profiling"
 
     # Keys for systrace (for hal tests)
     IKEY_ENABLE_SYSTRACE = "enable_systrace"
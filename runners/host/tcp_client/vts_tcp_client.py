@@ -14,19 +14,25 @@
 # limitations under the License.
 #
 
+import collections
 import json
 import logging
 import os
 import socket
+import threading
 import time
-import types
+import zlib
 
 from vts.proto import AndroidSystemControlMessage_pb2 as SysMsg_pb2
 from vts.proto import ComponentSpecificationMessage_pb2 as CompSpecMsg_pb2
 from vts.runners.host import const
 from vts.runners.host import errors
+from vts.runners.host.tcp_client import vts_tcp_client_stats
+from vts.runners.host.tcp_client import vts_tcp_protocol
+from vts.utils.python.mirror import bulk_vector
 from vts.utils.python.mirror import mirror_object
 
+from google.protobuf import message
 from google.protobuf import text_format
 
 TARGET_IP = os.environ.get("TARGET_IP", None)
@@ -34,9 +40,23 @@ TARGET_PORT = os.environ.get("TARGET_PORT", None)
 _DEFAULT_SOCKET_TIMEOUT_SECS = 1800
 _SOCKET_CONN_TIMEOUT_SECS = 60
 _SOCKET_CONN_RETRY_NUMBER = 5
+# The max number of pipelined commands whose responses are not read yet.
+# Bounded so neither side blocks on a full socket buffer.
+_DEFAULT_MAX_OUTSTANDING_REQUESTS = 32
+# The vts_tcp_protocol.CAPABILITY_* requested by default, a comma-separated
+# list in the environment variable. Empty unless set.
+HOST_CAPABILITIES = [
+    capability
+    for capability in os.environ.get("VTS_AGENT_CAPABILITIES", "").split(",")
+    if capability
+]
+_INITIAL_RECV_BUFFER_SIZE = 64 * 1024
+# A receive buffer grown beyond this size is released after use.
+_MAX_RETAINED_RECV_BUFFER_SIZE = 16 * 1024 * 1024
 COMMAND_TYPE_NAME = {
     1: "LIST_HALS",
     2: "SET_HOST_INFO",
+    3: "PING",
     101: "CHECK_DRIVER_SERVICE",
     102: "LAUNCH_DRIVER_SERVICE",
     103: "VTS_AGENT_COMMAND_READ_SPECIFICATION",
@@ -47,6 +67,93 @@ COMMAND_TYPE_NAME = {
 }
 
 
+def _WrapShellCommandTimeout(command, timeout):
+    """Returns a shell command which is killed after a timeout.
+
+    Args:
+        command: string, the shell command.
+        timeout: int, seconds to wait before sending SIGTERM. SIGKILL is sent
+                 if the command still runs 5 seconds later.
+
+    Returns:
+        string, the command wrapped by toybox timeout.
+    """
+    quoted = "'" + command.replace("'", "'\\''") + "'"
+    return "timeout -k 5 %d sh -c %s" % (timeout, quoted)
+
+
+class VtsTcpPendingResponse(object):
+    """The response of a pipelined command which may not be received yet.
+
+    The agent handles the commands of a session one by one and responds in
+    the order the commands were received, so the responses of pipelined
+    commands are matched to their senders in FIFO order. done() and result()
+    follow concurrent.futures.Future.
+
+    Attributes:
+        seq_id: int, the host-side sequence ID of the command.
+        command_type: int, the type of the command.
+        _client: VtsTcpClient, the client which sent the command.
+        _handler: function, converts the response message to the result.
+        _done: bool, whether the response has been received.
+        _result: the result of the command.
+        _exception: Exception raised while receiving or handling the response.
+    """
+
+    def __init__(self, client, seq_id, command_type, handler=None):
+        self.seq_id = seq_id
+        self.command_type = command_type
+        self._client = client
+        self._handler = handler
+        self._done = False
+        self._result = None
+        self._exception = None
+
+    def done(self):
+        """Returns True iff the response has been received."""
+        return self._done
+
+    def SetResponse(self, response_msg):
+        """Stores a received response message.
+
+        Args:
+            response_msg: AndroidSystemControlResponseMessage or None.
+        """
+        try:
+            if self._handler:
+                self._result = self._handler(response_msg)
+            else:
+                self._result = response_msg
+        except Exception as e:
+            self._exception = e
+        self._done = True
+
+    def SetException(self, exception):
+        """Marks the command as failed.
+
+        Args:
+            exception: Exception, the error to raise from result().
+        """
+        self._exception = exception
+        self._done = True
+
+    def result(self):
+        """Waits for the response and returns the result of the command.
+
+        Returns:
+            the result of the handler if given, the response message otherwise.
+
+        Raises:
+            the exception which occurred while receiving or handling the
+            response.
+        """
+        if not self._done:
+            self._client.WaitForResponse(self)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+
 class VtsTcpClient(object):
     """VTS TCP Client class.
 
@@ -54,18 +161,56 @@ class VtsTcpClient(object):
         connection: a TCP socket instance.
         channel: a file to write and read data.
         _mode: the connection mode (adb_forwarding or ssh_tunnel)
+        _max_outstanding: int, the max number of pipelined commands whose
+                          responses are not received yet.
+        _pending: deque of VtsTcpPendingResponse, the pipelined commands
+                  waiting for their responses, in the order they were sent.
+        _next_seq_id: int, the sequence ID of the next pipelined command.
+        _lock: RLock, serializes the use of the channel.
+        _agent_capabilities: set of string, the capabilities the agent
+                             accepted at SET_HOST_INFO.
+        _recv_buffer: bytearray, reused to receive binary framed responses.
+        compression_stats: dict, the numbers of bytes before (raw) and after
+                           (wire) compression for the sent and received
+                           messages.
+        spec_cache: VtsSpecCache, caches the specifications read by
+                    ReadSpecification. None to always read them from the
+                    agent.
+        _inflight: deque of (string, int, float, float), the statistics key,
+                   request bytes, serialize seconds and send time of each
+                   command whose response is not received yet.
+        rpc_stats: VtsTcpClientStats, where the RPCs are recorded. None to
+                   disable recording.
     """
 
-    def __init__(self, mode="adb_forwarding"):
+    def __init__(self,
+                 mode="adb_forwarding",
+                 max_outstanding=_DEFAULT_MAX_OUTSTANDING_REQUESTS):
         self.connection = None
         self.channel = None
         self._mode = mode
+        self._max_outstanding = max(1, max_outstanding)
+        self._pending = collections.deque()
+        self._next_seq_id = 0
+        self._lock = threading.RLock()
+        self._agent_capabilities = set()
+        self._recv_buffer = bytearray(_INITIAL_RECV_BUFFER_SIZE)
+        self.compression_stats = {
+            "sent_raw_bytes": 0,
+            "sent_wire_bytes": 0,
+            "recv_raw_bytes": 0,
+            "recv_wire_bytes": 0
+        }
+        self.spec_cache = None
+        self._inflight = collections.deque()
+        self.rpc_stats = vts_tcp_client_stats.GetDefaultStats()
 
     def Connect(self,
                 ip=TARGET_IP,
                 command_port=TARGET_PORT,
                 callback_port=None,
-                retry=_SOCKET_CONN_RETRY_NUMBER):
+                retry=_SOCKET_CONN_RETRY_NUMBER,
+                capabilities=None):
         """Connects to a target device.
 
         Args:
@@ -76,6 +221,10 @@ class VtsTcpClient(object):
                            server.
             retry: int, the number of times to retry connecting before giving
                    up.
+            capabilities: list of string, the capabilities to request from
+                          the agent. The ones the agent does not accept fall
+                          back to the default behavior. None to request
+                          HOST_CAPABILITIES.
 
         Returns:
             True if success, False otherwise
@@ -102,12 +251,156 @@ class VtsTcpClient(object):
                         "Couldn't connect to %s:%s" % (ip, command_port))
         self.channel = self.connection.makefile(mode="brw")
 
-        if callback_port is not None:
+        if capabilities is None:
+            capabilities = HOST_CAPABILITIES
+        self._agent_capabilities = set()
+        # SET_HOST_INFO costs a round trip, so it is sent only if needed.
+        if callback_port is not None or capabilities:
             self.SendCommand(
-                SysMsg_pb2.SET_HOST_INFO, callback_port=callback_port)
+                SysMsg_pb2.SET_HOST_INFO,
+                callback_port=callback_port,
+                paths=capabilities)
             resp = self.RecvResponse()
             if (resp.response_code != SysMsg_pb2.SUCCESS):
                 return False
+            self._UpdateAgentCapabilities(capabilities, resp)
+        return True
+
+    def _UpdateAgentCapabilities(self, capabilities, resp):
+        """Stores the capabilities accepted in a SET_HOST_INFO response.
+
+        Args:
+            capabilities: list of string, the requested capabilities.
+            resp: AndroidSystemControlResponseMessage of SET_HOST_INFO.
+        """
+        # An agent which does not know a capability doesn't echo it.
+        if capabilities:
+            self._agent_capabilities = (set(resp.file_names) &
+                                        set(capabilities))
+        logging.info("agent capabilities: %s", self._agent_capabilities)
+
+    def HasCapability(self, capability):
+        """Returns whether the agent accepted a capability.
+
+        Args:
+            capability: string, the capability name.
+
+        Returns:
+            True if the capability is enabled for this session.
+        """
+        return capability in self._agent_capabilities
+
+    def GetCompressedBytesSaved(self):
+        """Returns the number of bytes compression kept off the wire."""
+        stats = self.compression_stats
+        return (stats["sent_raw_bytes"] - stats["sent_wire_bytes"] +
+                stats["recv_raw_bytes"] - stats["recv_wire_bytes"])
+
+    def _CompressMessage(self, message):
+        """Prepends the codec byte and compresses a large message.
+
+        Args:
+            message: bytes, a serialized message.
+
+        Returns:
+            bytes, the message to put in a frame.
+        """
+        if not self.HasCapability(vts_tcp_protocol.CAPABILITY_ZLIB_COMPRESSION):
+            return message
+        if len(message) > vts_tcp_protocol.COMPRESSION_THRESHOLD_BYTES:
+            compressed = zlib.compress(message,
+                                       vts_tcp_protocol.COMPRESSION_LEVEL)
+            if len(compressed) < len(message):
+                result = vts_tcp_protocol.CODEC_ZLIB + compressed
+            else:
+                result = vts_tcp_protocol.CODEC_RAW + message
+        else:
+            result = vts_tcp_protocol.CODEC_RAW + message
+        self.compression_stats["sent_raw_bytes"] += len(message)
+        self.compression_stats["sent_wire_bytes"] += len(result)
+        return result
+
+    def _DecompressMessage(self, data):
+        """Strips the codec byte and decompresses a received message.
+
+        Args:
+            data: bytes or memoryview, the content of a frame.
+
+        Returns:
+            bytes or memoryview, the serialized message.
+
+        Raises:
+            errors.VtsTcpCommunicationError if the codec is unknown.
+        """
+        if not self.HasCapability(vts_tcp_protocol.CAPABILITY_ZLIB_COMPRESSION):
+            return data
+        codec = data[:1]
+        if isinstance(codec, memoryview):
+            # bytes(memoryview) is the repr of the view on Python 2.
+            codec = codec.tobytes()
+        payload = data[1:]
+        if codec == vts_tcp_protocol.CODEC_ZLIB:
+            try:
+                message = zlib.decompress(payload)
+            except TypeError:
+                message = zlib.decompress(payload.tobytes())
+        elif codec == vts_tcp_protocol.CODEC_RAW:
+            message = payload
+        else:
+            raise errors.VtsTcpCommunicationError(
+                "unknown message codec %r" % codec)
+        self.compression_stats["recv_raw_bytes"] += len(message)
+        self.compression_stats["recv_wire_bytes"] += len(data)
+        return message
+
+    def SerializePayload(self, payload):
+        """Serializes a message for the arg field of a command.
+
+        Args:
+            payload: a protobuf message, or a string which is sent as is.
+
+        Returns:
+            string, binary serialized if CAPABILITY_BINARY_PAYLOAD is
+            enabled, text format otherwise.
+        """
+        if not isinstance(payload, message.Message):
+            return payload
+        if self.HasCapability(vts_tcp_protocol.CAPABILITY_BINARY_PAYLOAD):
+            return payload.SerializeToString()
+        return text_format.MessageToString(payload)
+
+    def ParsePayload(self, payload, result):
+        """Parses a result or spec payload received from the agent.
+
+        Args:
+            payload: string, the result or spec field of a response.
+            result: a protobuf message where the parsed payload is merged.
+
+        Returns:
+            the result message.
+        """
+        self._TryParsePayload(payload, result)
+        return result
+
+    def _TryParsePayload(self, payload, result):
+        """Parses a payload like ParsePayload.
+
+        Args:
+            payload: string, the result or spec field of a response.
+            result: a protobuf message where the parsed payload is merged.
+
+        Returns:
+            True if the payload is parsed, False if it is malformed.
+        """
+        try:
+            if self.HasCapability(vts_tcp_protocol.CAPABILITY_BINARY_PAYLOAD):
+                result.MergeFromString(payload)
+            else:
+                text_format.Merge(payload, result)
+        except (text_format.ParseError, message.DecodeError) as e:
+            logging.exception(e)
+            logging.error("Paring error\n%s", payload)
+            return False
         return True
 
     def Disconnect(self):
@@ -116,10 +409,16 @@ class VtsTcpClient(object):
         TODO(yim): Send a msg to the target side to teardown handler session
         and release memory before closing the socket.
         """
-        if self.connection is not None:
-            self.channel = None
-            self.connection.close()
-            self.connection = None
+        with self._lock:
+            while self._pending:
+                self._pending.popleft().SetException(
+                    errors.VtsTcpCommunicationError(
+                        "disconnected before the response was received."))
+            self._inflight.clear()
+            if self.connection is not None:
+                self.channel = None
+                self.connection.close()
+                self.connection = None
 
     def ListHals(self, base_paths):
         """RPC to LIST_HALS."""
@@ -177,7 +476,12 @@ class VtsTcpClient(object):
             return (resp.response_code == SysMsg_pb2.SUCCESS)
 
     def ListApis(self):
-        """RPC to LIST_APIS."""
+        """RPC to LIST_APIS.
+
+        Returns:
+            string, the ComponentSpecificationMessage payload which can be
+            parsed by ParsePayload. None if the request failed.
+        """
         self.SendCommand(SysMsg_pb2.LIST_APIS)
         resp = self.RecvResponse()
         logging.info("resp for LIST_APIS: %s", resp)
@@ -185,14 +489,24 @@ class VtsTcpClient(object):
             return resp.spec
         return None
 
-    def GetPythonDataOfVariableSpecMsg(self, var_spec_msg):
+    def GetPythonDataOfVariableSpecMsg(self,
+                                       var_spec_msg,
+                                       vector_mode=bulk_vector.VECTOR_MODE_LIST,
+                                       spec_msg=None):
         """Returns the python native data structure for a given message.
 
         Args:
             var_spec_msg: VariableSpecificationMessage
+            vector_mode: string, bulk_vector.VECTOR_MODE_*, how the vectors
+                         and arrays of scalars are returned.
+            spec_msg: VariableSpecificationMessage, the spec of var_spec_msg,
+                      e.g., the return type of the called API, which gives the
+                      element type of an empty vector. None if unknown.
 
         Returns:
-            python native data structure (e.g., string, integer, list).
+            python native data structure (e.g., string, integer, list). A
+            vector of scalars is bytes, array.array or numpy.ndarray if so
+            requested by vector_mode.
 
         Raises:
             VtsUnsupportedTypeError if unsupported type is specified.
@@ -220,11 +534,11 @@ class VtsTcpClient(object):
                 if len(struct_value.name) > 0:
                     result[struct_value.
                            name] = self.GetPythonDataOfVariableSpecMsg(
-                               struct_value)
+                               struct_value, vector_mode)
                 else:
                     result["attribute%d" %
                            index] = self.GetPythonDataOfVariableSpecMsg(
-                               struct_value)
+                               struct_value, vector_mode)
                 index += 1
             return result
         elif var_spec_msg.type == CompSpecMsg_pb2.TYPE_UNION:
@@ -234,19 +548,27 @@ class VtsTcpClient(object):
                 if len(union_value.name) > 0:
                     result[union_value.
                            name] = self.GetPythonDataOfVariableSpecMsg(
-                               union_value)
+                               union_value, vector_mode)
                 else:
                     result["attribute%d" %
                            index] = self.GetPythonDataOfVariableSpecMsg(
-                               union_value)
+                               union_value, vector_mode)
                 index += 1
             return result
         elif (var_spec_msg.type == CompSpecMsg_pb2.TYPE_VECTOR or
               var_spec_msg.type == CompSpecMsg_pb2.TYPE_ARRAY):
+            result = bulk_vector.PbVector2PyBulk(var_spec_msg, vector_mode,
+                                                 spec_msg)
+            if result is not None:
+                return result
+            element_spec = None
+            if spec_msg is not None and spec_msg.vector_value:
+                element_spec = spec_msg.vector_value[0]
             result = []
             for vector_value in var_spec_msg.vector_value:
                 result.append(
-                    self.GetPythonDataOfVariableSpecMsg(vector_value))
+                    self.GetPythonDataOfVariableSpecMsg(
+                        vector_value, vector_mode, element_spec))
             return result
         elif (var_spec_msg.type == CompSpecMsg_pb2.TYPE_HIDL_INTERFACE):
             logging.debug("var_spec_msg: %s", var_spec_msg)
@@ -255,36 +577,101 @@ class VtsTcpClient(object):
         raise errors.VtsUnsupportedTypeError("unsupported type %s" %
                                              var_spec_msg.type)
 
-    def CallApi(self, arg, caller_uid=None):
-        """RPC to CALL_API."""
+    def CallApi(self,
+                arg,
+                caller_uid=None,
+                vector_mode=bulk_vector.VECTOR_MODE_LIST):
+        """RPC to CALL_API.
+
+        Args:
+            arg: FunctionCallMessage, or a string already serialized by
+                 SerializePayload.
+            caller_uid: string, the caller's UID if not None.
+            vector_mode: string, bulk_vector.VECTOR_MODE_*, how the returned
+                         vectors and arrays of scalars are converted.
+        """
         self.SendCommand(SysMsg_pb2.CALL_API, arg=arg, caller_uid=caller_uid)
         resp = self.RecvResponse()
+        return self._GetCallApiResult(arg, resp, vector_mode)
+
+    def CallApiAsync(self,
+                     arg,
+                     caller_uid=None,
+                     handler=None,
+                     vector_mode=bulk_vector.VECTOR_MODE_LIST):
+        """Pipelined RPC to CALL_API.
+
+        Args:
+            arg: FunctionCallMessage, or a serialized string. See CallApi.
+            caller_uid: string, the caller's UID if not None.
+            handler: function, applied to the value CallApi would return.
+            vector_mode: string, see CallApi.
+
+        Returns:
+            VtsTcpPendingResponse whose result() is CallApi's return value,
+            or the return value of handler if given.
+        """
+
+        def HandleResponse(resp):
+            result = self._GetCallApiResult(arg, resp, vector_mode)
+            return handler(result) if handler else result
+
+        return self.SendCommandAsync(
+            SysMsg_pb2.CALL_API,
+            handler=HandleResponse,
+            arg=arg,
+            caller_uid=caller_uid)
+
+    def _GetCallApiResult(self,
+                          arg,
+                          resp,
+                          vector_mode=bulk_vector.VECTOR_MODE_LIST):
+        """Converts a CALL_API response to the API's return value.
+
+        Args:
+            arg: FunctionCallMessage or string, the call sent to the agent.
+            resp: AndroidSystemControlResponseMessage.
+            vector_mode: string, see CallApi.
+
+        Returns:
+            see CallApi.
+
+        Raises:
+            errors.VtsTcpCommunicationError if the call failed.
+        """
+        if resp is None:
+            raise errors.VtsTcpCommunicationError(
+                "No response for CALL_API %s" % arg)
         resp_code = resp.response_code
         if (resp_code == SysMsg_pb2.SUCCESS):
             result = CompSpecMsg_pb2.FunctionSpecificationMessage()
             if resp.result == "error":
                 raise errors.VtsTcpCommunicationError(
                     "API call error by the VTS driver.")
-            try:
-                text_format.Merge(resp.result, result)
-            except text_format.ParseError as e:
-                logging.exception(e)
-                logging.error("Paring error\n%s", resp.result)
+            self.ParsePayload(resp.result, result)
             if result.return_type.type == CompSpecMsg_pb2.TYPE_SUBMODULE:
                 logging.info("returned a submodule spec")
                 logging.info("spec: %s", result.return_type_submodule_spec)
                 return mirror_object.MirrorObject(
                     self, result.return_type_submodule_spec, None)
 
-            logging.info("result: %s", result.return_type_hidl)
+            logging.debug("result: %s", result.return_type_hidl)
+            # The return types in the spec of the called API.
+            return_specs = []
+            if isinstance(arg, CompSpecMsg_pb2.FunctionCallMessage):
+                return_specs = arg.api.return_type_hidl
+            if len(return_specs) != len(result.return_type_hidl):
+                return_specs = [None] * len(result.return_type_hidl)
             if len(result.return_type_hidl) == 1:
                 result_value = self.GetPythonDataOfVariableSpecMsg(
-                    result.return_type_hidl[0])
+                    result.return_type_hidl[0], vector_mode, return_specs[0])
             elif len(result.return_type_hidl) > 1:
                 result_value = []
-                for return_type_hidl in result.return_type_hidl:
+                for return_type_hidl, return_spec in zip(
+                        result.return_type_hidl, return_specs):
                     result_value.append(
-                        self.GetPythonDataOfVariableSpecMsg(return_type_hidl))
+                        self.GetPythonDataOfVariableSpecMsg(
+                            return_type_hidl, vector_mode, return_spec))
             else:  # For non-HIDL return value
                 if hasattr(result, "return_type"):
                     result_value = result
@@ -305,17 +692,43 @@ class VtsTcpClient(object):
         """RPC to VTS_AGENT_COMMAND_GET_ATTRIBUTE."""
         self.SendCommand(SysMsg_pb2.VTS_AGENT_COMMAND_GET_ATTRIBUTE, arg=arg)
         resp = self.RecvResponse()
+        return self._GetAttributeResult(arg, resp)
+
+    def GetAttributeAsync(self, arg):
+        """Pipelined RPC to VTS_AGENT_COMMAND_GET_ATTRIBUTE.
+
+        Returns:
+            VtsTcpPendingResponse whose result() is the same as
+            GetAttribute's return value.
+        """
+        return self.SendCommandAsync(
+            SysMsg_pb2.VTS_AGENT_COMMAND_GET_ATTRIBUTE,
+            handler=lambda resp: self._GetAttributeResult(arg, resp),
+            arg=arg)
+
+    def _GetAttributeResult(self, arg, resp):
+        """Converts a VTS_AGENT_COMMAND_GET_ATTRIBUTE response to a value.
+
+        Args:
+            arg: string, the FunctionSpecificationMessage sent to the agent.
+            resp: AndroidSystemControlResponseMessage.
+
+        Returns:
+            see GetAttribute.
+
+        Raises:
+            errors.VtsTcpCommunicationError if the request failed.
+        """
+        if resp is None:
+            raise errors.VtsTcpCommunicationError(
+                "No response for GET_ATTRIBUTE %s" % arg)
         resp_code = resp.response_code
         if (resp_code == SysMsg_pb2.SUCCESS):
             result = CompSpecMsg_pb2.FunctionSpecificationMessage()
             if resp.result == "error":
                 raise errors.VtsTcpCommunicationError(
                     "Get attribute request failed on target.")
-            try:
-                text_format.Merge(resp.result, result)
-            except text_format.ParseError as e:
-                logging.exception(e)
-                logging.error("Paring error\n%s", resp.result)
+            self.ParsePayload(resp.result, result)
             if result.return_type.type == CompSpecMsg_pb2.TYPE_SUBMODULE:
                 logging.info("returned a submodule spec")
                 logging.info("spec: %s", result.return_type_submodule_spec)
@@ -351,11 +764,24 @@ class VtsTcpClient(object):
             return self.__ExecuteShellCommand(command)
         except Exception as e:
             logging.exception(e)
-            return {
-                const.STDOUT: [""] * len(command),
-                const.STDERR: [str(e)] * len(command),
-                const.EXIT_CODE: [-1] * len(command)
-            }
+            return self.GetShellCommandErrorResult(command, e)
+
+    def GetShellCommandErrorResult(self, command, error):
+        """Returns the shell command results reporting an exception.
+
+        Args:
+            command: string or list of string, the commands.
+            error: Exception, the error which occurred.
+
+        Returns:
+            dictionary of list, with the same length as command, where
+            exit_code is -1 and stderr is str(error).
+        """
+        return {
+            const.STDOUT: [""] * len(command),
+            const.STDERR: [str(error)] * len(command),
+            const.EXIT_CODE: [-1] * len(command)
+        }
 
     def __ExecuteShellCommand(self, command):
         """RPC to VTS_AGENT_COMMAND_EXECUTE_SHELL_COMMAND.
@@ -371,6 +797,139 @@ class VtsTcpClient(object):
             SysMsg_pb2.VTS_AGENT_COMMAND_EXECUTE_SHELL_COMMAND,
             shell_command=command)
         resp = self.RecvResponse(retries=2)
+        return self._GetShellCommandResult(resp)
+
+    def ExecuteShellCommandAsync(self, command):
+        """Pipelined RPC to VTS_AGENT_COMMAND_EXECUTE_SHELL_COMMAND.
+
+        Args:
+            command: string or list of string, command to execute on device
+
+        Returns:
+            VtsTcpPendingResponse whose result() is a dictionary of list
+            containing stdout, stderr, and exit_code.
+        """
+        return self.SendCommandAsync(
+            SysMsg_pb2.VTS_AGENT_COMMAND_EXECUTE_SHELL_COMMAND,
+            handler=self._GetShellCommandResult,
+            shell_command=command)
+
+    def ExecuteShellCommandStreaming(self,
+                                     command,
+                                     output_handler,
+                                     timeout=None):
+        """RPC to VTS_AGENT_COMMAND_EXECUTE_SHELL_COMMAND which passes the
+        output to a handler as it arrives instead of buffering it.
+
+        If the agent accepted CAPABILITY_STREAMING_SHELL, it sends chunks of
+        the output while the commands run. Otherwise the commands are sent
+        one by one and the output of each is passed on when it completes.
+
+        Args:
+            command: string or list of string, command to execute on device
+            output_handler: function(index, stdout, stderr), called with each
+                            chunk of output of the index-th command. If it
+                            raises an exception, the commands not started
+                            yet are skipped and the exception is re-raised.
+            timeout: int, seconds after which each command is killed on the
+                     device, with exit code 124. None for no limit.
+
+        Returns:
+            dictionary of list, command results that contains stdout,
+            stderr, and exit_code. stdout and stderr are empty strings as
+            the output was passed to output_handler.
+
+        Raises:
+            errors.VtsTcpCommunicationError if the agent fails the command.
+        """
+        commands = list(command) if isinstance(command, list) else [command]
+        if not commands:
+            return {const.STDOUT: [], const.STDERR: [], const.EXIT_CODE: []}
+        if timeout:
+            commands = [
+                _WrapShellCommandTimeout(cmd, timeout) for cmd in commands
+            ]
+
+        if self.HasCapability(vts_tcp_protocol.CAPABILITY_STREAMING_SHELL):
+            exit_codes = self._StreamShellCommands(commands, output_handler)
+        else:
+            exit_codes = []
+            for index, cmd in enumerate(commands):
+                result = self.__ExecuteShellCommand(cmd)
+                if result[const.EXIT_CODE] is None:
+                    raise errors.VtsTcpCommunicationError(
+                        "Failed to execute shell command: %s" % cmd)
+                output_handler(index, result[const.STDOUT][0],
+                               result[const.STDERR][0])
+                exit_codes.append(result[const.EXIT_CODE][0])
+
+        return {
+            const.STDOUT: [""] * len(exit_codes),
+            const.STDERR: [""] * len(exit_codes),
+            const.EXIT_CODE: exit_codes
+        }
+
+    def _StreamShellCommands(self, commands, output_handler):
+        """Executes shell commands whose output is streamed by the agent.
+
+        An interim response has the index of the command in result and one
+        chunk in stdout and stderr. The final response has
+        STREAMING_SHELL_FINAL_RESULT in result and the exit codes.
+
+        Args:
+            commands: list of string, the commands to execute.
+            output_handler: see ExecuteShellCommandStreaming.
+
+        Returns:
+            list of int, the exit code of each command.
+
+        Raises:
+            errors.VtsTcpCommunicationError if the agent fails the command.
+        """
+        handler_error = None
+        with self._lock:
+            self.SendCommand(
+                SysMsg_pb2.VTS_AGENT_COMMAND_EXECUTE_SHELL_COMMAND,
+                shell_command=commands,
+                paths=[vts_tcp_protocol.CAPABILITY_STREAMING_SHELL])
+            while True:
+                resp = self.RecvResponse()
+                if not resp or resp.response_code != SysMsg_pb2.SUCCESS:
+                    raise errors.VtsTcpCommunicationError(
+                        "Failed to execute shell commands: %s" % commands)
+                if resp.result == vts_tcp_protocol.STREAMING_SHELL_FINAL_RESULT:
+                    break
+                if handler_error is not None:
+                    # Drains the output to keep the session usable.
+                    continue
+                try:
+                    output_handler(
+                        int(resp.result), resp.stdout[0]
+                        if resp.stdout else "", resp.stderr[0]
+                        if resp.stderr else "")
+                except Exception as e:
+                    handler_error = e
+
+        if handler_error is not None:
+            raise handler_error
+        # Any output not streamed yet comes with the exit codes.
+        for index in xrange(len(resp.exit_code)):
+            stdout = resp.stdout[index] if index < len(resp.stdout) else ""
+            stderr = resp.stderr[index] if index < len(resp.stderr) else ""
+            if stdout or stderr:
+                output_handler(index, stdout, stderr)
+        return list(resp.exit_code)
+
+    def _GetShellCommandResult(self, resp):
+        """Converts a VTS_AGENT_COMMAND_EXECUTE_SHELL_COMMAND response.
+
+        Args:
+            resp: AndroidSystemControlResponseMessage.
+
+        Returns:
+            dictionary of list, command results that contains stdout,
+            stderr, and exit_code.
+        """
         logging.info("resp for VTS_AGENT_COMMAND_EXECUTE_SHELL_COMMAND: %s",
                      resp)
 
@@ -416,11 +975,39 @@ class VtsTcpClient(object):
                           recursive=False):
         """RPC to VTS_AGENT_COMMAND_READ_SPECIFICATION.
 
+        The result is looked up in spec_cache if set, and added to it if
+        the agent returns a valid, non-empty specification.
+
         Args:
             other args: see SendCommand
             recursive: boolean, set to recursively read the imported
                        specification(s) and return the merged one.
+
+        Returns:
+            ComponentSpecificationMessage.
+        """
+        return self._ReadSpecification(interface_name, target_class,
+                                       target_type, target_version,
+                                       target_package, recursive)[0]
+
+    def _ReadSpecification(self, interface_name, target_class, target_type,
+                           target_version, target_package, recursive):
+        """Reads a specification like ReadSpecification.
+
+        Args:
+            see ReadSpecification.
+
+        Returns:
+            a tuple of the ComponentSpecificationMessage and whether it and
+            all the specifications it imports were read successfully.
         """
+        if self.spec_cache:
+            cache_key = self.spec_cache.GetKey(interface_name, target_version,
+                                               target_package, recursive)
+            cached = self.spec_cache.Get(cache_key)
+            if cached is not None:
+                return cached, True
+
         self.SendCommand(
             SysMsg_pb2.VTS_AGENT_COMMAND_READ_SPECIFICATION,
             service_name=interface_name,
@@ -431,34 +1018,36 @@ class VtsTcpClient(object):
         resp = self.RecvResponse(retries=2)
         logging.info("resp for VTS_AGENT_COMMAND_EXECUTE_READ_INTERFACE: %s",
                      resp)
-        logging.info("proto: %s", resp.result)
-        result = CompSpecMsg_pb2.ComponentSpecificationMessage()
-        if resp.result == "error":
+        if resp is None or resp.result == "error":
             raise errors.VtsTcpCommunicationError(
                 "API call error by the VTS driver.")
-        try:
-            text_format.Merge(resp.result, result)
-        except text_format.ParseError as e:
-            logging.exception(e)
-            logging.error("Paring error\n%s", resp.result)
+        logging.info("proto: %s", resp.result)
+        result = CompSpecMsg_pb2.ComponentSpecificationMessage()
+        valid = (resp.response_code == SysMsg_pb2.SUCCESS and
+                 self._TryParsePayload(resp.result, result) and
+                 result.ByteSize() > 0)
 
         if recursive and hasattr(result, "import"):
             for imported_interface in getattr(result, "import"):
                 if imported_interface == "android.hidl.base@1.0::types":
                     logging.warn("import android.hidl.base@1.0::types skipped")
                     continue
-                imported_result = self.ReadSpecification(
+                imported_result, imported_valid = self._ReadSpecification(
                     imported_interface.split("::")[1],
                     # TODO(yim): derive target_class and
                     # target_type from package path or remove them
-                    msg.component_class
+                    result.component_class
                     if target_class is None else target_class,
-                    msg.component_type if target_type is None else target_type,
+                    result.component_type
+                    if target_type is None else target_type,
                     float(imported_interface.split("@")[1].split("::")[0]),
-                    imported_interface.split("@")[0])
+                    imported_interface.split("@")[0], False)
                 result.MergeFrom(imported_result)
+                valid = valid and imported_valid
 
-        return result
+        if self.spec_cache and valid:
+            self.spec_cache.Put(cache_key, result)
+        return result, valid
 
     def SendCommand(self,
                     command_type,
@@ -480,6 +1069,9 @@ class VtsTcpClient(object):
                     arg=None):
         """Sends a command.
 
+        The responses of all the pipelined commands are received first so
+        that the next RecvResponse returns the response of this command.
+
         Args:
             command_type: integer, the command type.
             each of the other args are to fill in a field in
@@ -489,12 +1081,139 @@ class VtsTcpClient(object):
             raise errors.VtsTcpCommunicationError(
                 "channel is None, unable to send command.")
 
+        start_time = time.time()
+        command_msg = self._CreateCommandMessage(
+            command_type,
+            paths=paths,
+            file_path=file_path,
+            bits=bits,
+            target_class=target_class,
+            target_type=target_type,
+            target_version=target_version,
+            target_package=target_package,
+            target_component_name=target_component_name,
+            hw_binder_service_name=hw_binder_service_name,
+            module_name=module_name,
+            service_name=service_name,
+            callback_port=callback_port,
+            driver_type=driver_type,
+            shell_command=shell_command,
+            caller_uid=caller_uid,
+            arg=arg)
+        with self._lock:
+            self.FlushPendingResponses()
+            self._WriteCommandMessage(
+                command_msg, self._GetRpcStatsKey(command_type, arg),
+                start_time)
+
+    def SendCommandAsync(self, command_type, handler=None, **kwargs):
+        """Sends a command without waiting for the responses of the previous
+        commands.
+
+        At most _max_outstanding commands are kept in flight; the oldest
+        response is received first if the limit is reached.
+
+        Args:
+            command_type: integer, the command type.
+            handler: function, converts the response message to the result
+                     of the returned object. None to return the message.
+            kwargs: see SendCommand.
+
+        Returns:
+            VtsTcpPendingResponse of the command.
+        """
+        if not self.channel:
+            raise errors.VtsTcpCommunicationError(
+                "channel is None, unable to send command.")
+
+        start_time = time.time()
+        command_msg = self._CreateCommandMessage(command_type, **kwargs)
+        stats_key = self._GetRpcStatsKey(command_type, kwargs.get("arg"))
+        with self._lock:
+            while len(self._pending) >= self._max_outstanding:
+                self._RecvPendingResponse()
+            pending = VtsTcpPendingResponse(self, self._next_seq_id,
+                                            command_type, handler)
+            self._next_seq_id += 1
+            logging.debug("pipelined command seq_id %s", pending.seq_id)
+            self._WriteCommandMessage(command_msg, stats_key, start_time)
+            self._pending.append(pending)
+        return pending
+
+    def WaitForResponse(self, pending):
+        """Receives responses until the given pipelined command's arrives.
+
+        Args:
+            pending: VtsTcpPendingResponse, returned by SendCommandAsync.
+        """
+        with self._lock:
+            while not pending.done():
+                if not self._pending:
+                    pending.SetException(errors.VtsTcpCommunicationError(
+                        "seq_id %s is not pending." % pending.seq_id))
+                    break
+                self._RecvPendingResponse()
+
+    def FlushPendingResponses(self):
+        """Receives the responses of all the pipelined commands."""
+        with self._lock:
+            while self._pending:
+                self._RecvPendingResponse()
+
+    def _RecvPendingResponse(self):
+        """Receives the response of the oldest pipelined command.
+
+        If the response cannot be received, the session is out of sync, so
+        all the pipelined commands fail.
+        """
+        pending = self._pending.popleft()
+        try:
+            resp = self.RecvResponse()
+        except (socket.error, IOError, ValueError) as e:
+            pending.SetException(errors.VtsTcpCommunicationError(
+                "Failed to receive response of seq_id %s: %s" %
+                (pending.seq_id, e)))
+            while self._pending:
+                lost = self._pending.popleft()
+                lost.SetException(errors.VtsTcpCommunicationError(
+                    "Failed to receive response of seq_id %s: an earlier "
+                    "response (seq_id %s) was lost: %s" %
+                    (lost.seq_id, pending.seq_id, e)))
+            return
+        pending.SetResponse(resp)
+
+    def _CreateCommandMessage(self,
+                              command_type,
+                              paths=None,
+                              file_path=None,
+                              bits=None,
+                              target_class=None,
+                              target_type=None,
+                              target_version=None,
+                              target_package=None,
+                              target_component_name=None,
+                              hw_binder_service_name=None,
+                              module_name=None,
+                              service_name=None,
+                              callback_port=None,
+                              driver_type=None,
+                              shell_command=None,
+                              caller_uid=None,
+                              arg=None):
+        """Creates a command message.
+
+        Args:
+            see SendCommand.
+
+        Returns:
+            AndroidSystemControlCommandMessage.
+        """
         command_msg = SysMsg_pb2.AndroidSystemControlCommandMessage()
         command_msg.command_type = command_type
-        logging.info("sending a command (type %s)",
-                     COMMAND_TYPE_NAME[command_type])
+        logging.debug("sending a command (type %s)",
+                      COMMAND_TYPE_NAME[command_type])
         if command_type == 202:
-            logging.info("target API: %s", arg)
+            logging.debug("target API: %s", arg)
 
         if target_class is not None:
             command_msg.target_class = target_class
@@ -539,22 +1258,135 @@ class VtsTcpClient(object):
             command_msg.driver_caller_uid = caller_uid
 
         if arg is not None:
-            command_msg.arg = arg
+            command_msg.arg = self.SerializePayload(arg)
 
         if shell_command is not None:
-            if isinstance(shell_command, types.ListType):
+            if isinstance(shell_command, list):
                 command_msg.shell_command.extend(shell_command)
             else:
                 command_msg.shell_command.append(shell_command)
 
-        logging.info("command %s" % command_msg)
-        message = command_msg.SerializeToString()
+        return command_msg
+
+    def _GetRpcStatsKey(self, command_type, arg):
+        """Returns the key which groups a command in rpc_stats.
+
+        Args:
+            command_type: integer, the command type.
+            arg: the arg of a CALL_API command.
+
+        Returns:
+            string, the command type name followed by the API name if the
+            command is CALL_API.
+        """
+        key = COMMAND_TYPE_NAME.get(command_type, str(command_type))
+        if (command_type == SysMsg_pb2.CALL_API and
+                isinstance(arg, message.Message) and getattr(arg, "name", "")):
+            key += ":" + arg.name
+        return key
+
+    def _WriteCommandMessage(self, command_msg, stats_key=None,
+                             start_time=None):
+        """Serializes and writes a command message to the channel.
+
+        Args:
+            command_msg: AndroidSystemControlCommandMessage.
+            stats_key: string, groups the command in rpc_stats.
+            start_time: float, the time the command message started to be
+                        built.
+        """
+        logging.debug("command %s", command_msg)
+        message = self._CompressMessage(command_msg.SerializeToString())
         message_len = len(message)
+        sent_time = time.time()
+        self._inflight.append(
+            (stats_key or COMMAND_TYPE_NAME.get(command_msg.command_type),
+             message_len, sent_time - (start_time or sent_time), sent_time))
         logging.debug("sending %d bytes", message_len)
+        if self.HasCapability(vts_tcp_protocol.CAPABILITY_BINARY_FRAMING):
+            self.connection.sendall(
+                vts_tcp_protocol.BINARY_FRAME_HEADER.pack(message_len) +
+                message)
+            return
         self.channel.write(str(message_len) + b'\n')
         self.channel.write(message)
         self.channel.flush()
 
+    def _RecvBinaryFrame(self):
+        """Receives a binary framed message into the reused receive buffer.
+
+        The socket is read directly since no buffered data is left in the
+        channel once the framing is switched right after SET_HOST_INFO.
+
+        Returns:
+            memoryview of the message, valid until the next receive.
+
+        Raises:
+            socket.error if the connection is closed.
+        """
+        header = bytearray(vts_tcp_protocol.BINARY_FRAME_HEADER.size)
+        self._RecvInto(memoryview(header))
+        length = vts_tcp_protocol.BINARY_FRAME_HEADER.unpack(bytes(header))[0]
+        logging.debug("resp %d bytes", length)
+        if length > len(self._recv_buffer):
+            self._recv_buffer = bytearray(
+                max(length, 2 * len(self._recv_buffer)))
+        view = memoryview(self._recv_buffer)[:length]
+        self._RecvInto(view)
+        return view
+
+    def _RecvInto(self, view):
+        """Fills a buffer from the socket.
+
+        Args:
+            view: memoryview, the buffer to fill.
+
+        Raises:
+            socket.error if the connection is closed.
+        """
+        received = 0
+        while received < len(view):
+            n = self.connection.recv_into(view[received:])
+            if not n:
+                raise socket.error("connection closed by the agent.")
+            received += n
+
+    def _ParseResponse(self, data):
+        """Parses a response message.
+
+        Args:
+            data: bytes or memoryview, the serialized message.
+
+        Returns:
+            AndroidSystemControlResponseMessage.
+        """
+        response_msg = SysMsg_pb2.AndroidSystemControlResponseMessage()
+        if isinstance(data, memoryview):
+            try:
+                # Parses in place if the protobuf runtime takes buffers.
+                response_msg.ParseFromString(data)
+            except TypeError:
+                response_msg.ParseFromString(data.tobytes())
+        else:
+            response_msg.ParseFromString(data)
+        return response_msg
+
+    def _RecordRpc(self, response_bytes, received_time):
+        """Records the oldest in-flight command whose response is parsed.
+
+        Args:
+            response_bytes: int, the size of the response on the wire.
+            received_time: float, the time the response was read.
+        """
+        if not self._inflight:
+            return
+        key, request_bytes, serialize_secs, sent_time = (
+            self._inflight.popleft())
+        if self.rpc_stats is not None:
+            self.rpc_stats.Record(key, request_bytes, response_bytes,
+                                  serialize_secs, received_time - sent_time,
+                                  time.time() - received_time)
+
     def RecvResponse(self, retries=0):
         """Receives and parses the response, and returns the relevant ResponseMessage.
 
@@ -566,12 +1398,23 @@ class VtsTcpClient(object):
             try:
                 if index != 0:
                     logging.info("retrying...")
-                header = self.channel.readline().strip("\n")
-                length = int(header) if header else 0
-                logging.info("resp %d bytes", length)
-                data = self.channel.read(length)
-                response_msg = SysMsg_pb2.AndroidSystemControlResponseMessage()
-                response_msg.ParseFromString(data)
+                if self.HasCapability(
+                        vts_tcp_protocol.CAPABILITY_BINARY_FRAMING):
+                    data = self._RecvBinaryFrame()
+                else:
+                    header = self.channel.readline()
+                    if not header:
+                        raise socket.error("connection closed by the agent.")
+                    header = header.strip("\n")
+                    length = int(header) if header else 0
+                    logging.debug("resp %d bytes", length)
+                    data = self.channel.read(length)
+                received_time = time.time()
+                response_msg = self._ParseResponse(
+                    self._DecompressMessage(data))
+                self._RecordRpc(len(data), received_time)
+                if len(self._recv_buffer) > _MAX_RETAINED_RECV_BUFFER_SIZE:
+                    self._recv_buffer = bytearray(_INITIAL_RECV_BUFFER_SIZE)
                 logging.debug("Response %s", "success" if
                               response_msg.response_code == SysMsg_pb2.SUCCESS
                               else "fail")
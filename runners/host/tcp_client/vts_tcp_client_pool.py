@@ -0,0 +1,173 @@
+#
+# Copyright (C) 2017 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import collections
+import logging
+import socket
+import threading
+import time
+
+from vts.runners.host import errors
+from vts.runners.host.tcp_client import vts_tcp_client
+
+_DEFAULT_MAX_POOL_SIZE = 32
+_DEFAULT_MAX_IDLE_SECS = 300
+_DEFAULT_ACQUIRE_TIMEOUT_SECS = 60
+
+
+class VtsTcpClientPool(object):
+    """A pool of agent sessions of a device.
+
+    HalMirror, LibMirror and ShellMirror acquire a connected VtsTcpClient
+    from the pool instead of connecting one per mirror object. A released
+    session is kept open and handed out again after a successful PING, so it
+    does not pay the TCP connect and SET_HOST_INFO handshake again.
+
+    The agent binds one driver per session, and nothing unbinds it, so a
+    released session keeps the driver its previous owner launched. An owner
+    must launch the driver it needs after Acquire; LAUNCH_DRIVER_SERVICE
+    rebinds the session to the new driver. The mirrors always do so.
+
+    Attributes:
+        _host_command_port: int, the host-side port for command-response
+                            sessions.
+        _host_callback_port: int, the host-side port for callback sessions.
+        _max_size: int, the max number of sessions, idle or in use.
+        _max_idle_secs: float, idle sessions older than this are closed.
+        _idle: deque of (VtsTcpClient, float), the idle sessions and the
+               time they were released. The most recent is at the right.
+        _in_use: int, the number of acquired sessions.
+        _cond: Condition, guards the attributes above.
+        _spec_cache: VtsSpecCache, shared by the sessions of the pool.
+        created_count: int, the number of sessions connected.
+        reused_count: int, the number of acquisitions served by an idle
+                      session.
+    """
+
+    def __init__(self,
+                 host_command_port,
+                 host_callback_port=None,
+                 max_size=_DEFAULT_MAX_POOL_SIZE,
+                 max_idle_secs=_DEFAULT_MAX_IDLE_SECS,
+                 spec_cache=None):
+        self._host_command_port = host_command_port
+        self._host_callback_port = host_callback_port
+        self._max_size = max_size
+        self._max_idle_secs = max_idle_secs
+        self._idle = collections.deque()
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._spec_cache = spec_cache
+        self.created_count = 0
+        self.reused_count = 0
+
+    def Acquire(self, timeout=_DEFAULT_ACQUIRE_TIMEOUT_SECS):
+        """Gets a connected session.
+
+        Args:
+            timeout: float, seconds to wait for a session to be released if
+                     the pool is full.
+
+        Returns:
+            VtsTcpClient, a connected session owned by the caller until it
+            is released. A reused session is still bound to the driver its
+            previous owner launched, if any.
+
+        Raises:
+            errors.VtsTcpClientCreationError if no session is available in
+            time or connecting fails.
+        """
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                self._EvictIdle()
+                while self._idle:
+                    client, _ = self._idle.pop()
+                    if self._IsHealthy(client):
+                        self._in_use += 1
+                        self.reused_count += 1
+                        return client
+                    client.Disconnect()
+                if self._in_use < self._max_size:
+                    # Reserve the slot while connecting outside the lock.
+                    self._in_use += 1
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise errors.VtsTcpClientCreationError(
+                        "All %d sessions to port %s are in use." %
+                        (self._max_size, self._host_command_port))
+                self._cond.wait(remaining)
+
+        try:
+            client = vts_tcp_client.VtsTcpClient()
+            client.spec_cache = self._spec_cache
+            if not client.Connect(
+                    command_port=self._host_command_port,
+                    callback_port=self._host_callback_port):
+                client.Disconnect()
+                raise errors.VtsTcpClientCreationError(
+                    "Failed to set up a session to port %s." %
+                    self._host_command_port)
+        except:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self.created_count += 1
+        return client
+
+    def Release(self, client, reusable=True):
+        """Returns a session to the pool.
+
+        Args:
+            client: VtsTcpClient, a session returned by Acquire.
+            reusable: bool, False to close the session, e.g., after a
+                      communication error.
+        """
+        with self._cond:
+            self._in_use -= 1
+            if reusable and client.connection is not None:
+                client.FlushPendingResponses()
+                self._idle.append((client, time.time()))
+            else:
+                client.Disconnect()
+            self._cond.notify()
+
+    def Clear(self):
+        """Closes all the idle sessions."""
+        with self._cond:
+            while self._idle:
+                client, _ = self._idle.popleft()
+                client.Disconnect()
+
+    def _EvictIdle(self):
+        """Closes the sessions which have been idle too long."""
+        now = time.time()
+        while self._idle and now - self._idle[0][1] > self._max_idle_secs:
+            client, _ = self._idle.popleft()
+            logging.debug("closing an idle agent session.")
+            client.Disconnect()
+
+    @staticmethod
+    def _IsHealthy(client):
+        """Returns whether an idle session still reaches the agent."""
+        try:
+            return client.Ping()
+        except (socket.error, IOError, errors.VtsError) as e:
+            logging.info("dropping a broken agent session: %s", e)
+            return False
@@ -0,0 +1,153 @@
+#
+# Copyright (C) 2017 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import socket
+import threading
+import time
+import unittest
+
+from vts.proto import AndroidSystemControlMessage_pb2 as SysMsg_pb2
+from vts.proto import ComponentSpecificationMessage_pb2 as CompSpecMsg
+from vts.runners.host import errors
+from vts.runners.host.tcp_client import vts_tcp_client_pool
+from vts.runners.host.tcp_server import fake_agent
+
+
+def _CreateSpec(component_name):
+    """Returns the spec of a HAL with one API."""
+    spec = CompSpecMsg.ComponentSpecificationMessage()
+    spec.package = "android.hardware.fake"
+    spec.component_type_version = 1.0
+    spec.component_name = component_name
+    spec.interface.api.add().name = "get%s" % component_name
+    return spec
+
+
+class VtsTcpClientPoolTest(unittest.TestCase):
+    """Tests VtsTcpClientPool against FakeAgent.
+
+    Attributes:
+        _agent: FakeAgent, started for each test.
+    """
+
+    def setUp(self):
+        self._agent = fake_agent.FakeAgent()
+        self._agent.AddSpec(_CreateSpec("IFoo"))
+        self._agent.AddSpec(_CreateSpec("IBar"))
+        self._agent.Start()
+
+    def tearDown(self):
+        self._agent.Stop()
+
+    def _LaunchDriver(self, client, component_name):
+        """Launches the HAL driver of a spec added in setUp."""
+        return client.LaunchDriverService(
+            driver_type=SysMsg_pb2.VTS_DRIVER_TYPE_HAL_HIDL,
+            service_name="vts_driver_%s" % component_name,
+            bits=64,
+            target_version=1.0,
+            target_package="android.hardware.fake",
+            target_component_name=component_name)
+
+    def _GetBoundComponent(self, client):
+        """Returns the component name of the driver a session is bound to."""
+        spec = CompSpecMsg.ComponentSpecificationMessage()
+        client.ParsePayload(client.ListApis(), spec)
+        return spec.component_name
+
+    def testReuse(self):
+        """Tests that a released session is handed out again."""
+        pool = vts_tcp_client_pool.VtsTcpClientPool(self._agent.port)
+        try:
+            client = pool.Acquire()
+            pool.Release(client)
+            self.assertIs(pool.Acquire(), client)
+            other = pool.Acquire()
+            self.assertIsNot(other, client)
+            self.assertEqual(pool.created_count, 2)
+            self.assertEqual(pool.reused_count, 1)
+            pool.Release(client, reusable=False)
+            self.assertIsNone(client.connection)
+            pool.Release(other)
+        finally:
+            pool.Clear()
+
+    def testDeadSessionEvicted(self):
+        """Tests that an idle session which fails PING is replaced."""
+        pool = vts_tcp_client_pool.VtsTcpClientPool(self._agent.port)
+        try:
+            client = pool.Acquire()
+            pool.Release(client)
+            client.connection.shutdown(socket.SHUT_RDWR)
+            replacement = pool.Acquire()
+            self.assertIsNot(replacement, client)
+            self.assertIsNone(client.connection)
+            self.assertEqual(pool.reused_count, 0)
+            self.assertTrue(replacement.Ping())
+            pool.Release(replacement)
+        finally:
+            pool.Clear()
+
+    def testIdleEviction(self):
+        """Tests that a session idle for too long is closed."""
+        pool = vts_tcp_client_pool.VtsTcpClientPool(
+            self._agent.port, max_idle_secs=0)
+        try:
+            client = pool.Acquire()
+            pool.Release(client)
+            time.sleep(0.01)
+            self.assertIsNot(pool.Acquire(), client)
+            self.assertIsNone(client.connection)
+            self.assertNotIn(SysMsg_pb2.PING, self._agent.command_counts)
+        finally:
+            pool.Clear()
+
+    def testMaxSize(self):
+        """Tests that Acquire waits for a release when the pool is full."""
+        pool = vts_tcp_client_pool.VtsTcpClientPool(
+            self._agent.port, max_size=1)
+        try:
+            client = pool.Acquire()
+            with self.assertRaises(errors.VtsTcpClientCreationError):
+                pool.Acquire(timeout=0.1)
+            timer = threading.Timer(0.1, pool.Release, (client, ))
+            timer.start()
+            self.assertIs(pool.Acquire(timeout=5), client)
+            timer.join()
+            self.assertEqual(pool.created_count, 1)
+            pool.Release(client)
+        finally:
+            pool.Clear()
+
+    def testDriverKeptOnRelease(self):
+        """Tests that a reused session keeps its driver until relaunched."""
+        pool = vts_tcp_client_pool.VtsTcpClientPool(self._agent.port)
+        try:
+            client = pool.Acquire()
+            self.assertNotEqual(self._LaunchDriver(client, "IFoo"), -1)
+            pool.Release(client)
+
+            client = pool.Acquire()
+            self.assertEqual(self._GetBoundComponent(client), "IFoo")
+            self.assertNotEqual(self._LaunchDriver(client, "IBar"), -1)
+            self.assertEqual(self._GetBoundComponent(client), "IBar")
+            pool.Release(client)
+        finally:
+            pool.Clear()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,182 @@
+#
+# Copyright (C) 2017 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import bisect
+import json
+import logging
+import threading
+
+# Upper bounds (exclusive) of the latency histogram buckets. The last bucket
+# holds the latencies of at least the last bound.
+LATENCY_BUCKET_BOUNDS_MSECS = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200,
+                               500, 1000, 2000, 5000)
+_PROFILING_POINT_PREFIX = "agent_rpc_"
+
+
+class VtsTcpClientStats(object):
+    """Collects the statistics of the commands sent to the agent.
+
+    The commands are grouped by key, i.e., the command type name, followed by
+    the API name for CALL_API. Each RPC is split into:
+        serialize: building, serializing and compressing the command.
+        wire: from writing the command until its response is read, i.e.,
+              the network round trip and the time the agent takes.
+        parse: decompressing and parsing the response.
+
+    Attributes:
+        _entries: dict of string to dict, the statistics of each key.
+        _lock: Lock, guards _entries as sessions run on many threads.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def Record(self, key, request_bytes, response_bytes, serialize_secs,
+               wire_secs, parse_secs):
+        """Adds an RPC.
+
+        Args:
+            key: string, the command type name and the API name if any.
+            request_bytes: int, the size of the command on the wire.
+            response_bytes: int, the size of the response on the wire.
+            serialize_secs: float, seconds to build the command message.
+            wire_secs: float, seconds to wait for the response.
+            parse_secs: float, seconds to parse the response.
+        """
+        latency_msecs = (serialize_secs + wire_secs + parse_secs) * 1000
+        bucket = bisect.bisect_right(LATENCY_BUCKET_BOUNDS_MSECS,
+                                     latency_msecs)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = {
+                    "count": 0,
+                    "request_bytes": 0,
+                    "response_bytes": 0,
+                    "serialize_secs": 0.0,
+                    "wire_secs": 0.0,
+                    "parse_secs": 0.0,
+                    "max_latency_msecs": 0.0,
+                    "latency_histogram":
+                    [0] * (len(LATENCY_BUCKET_BOUNDS_MSECS) + 1)
+                }
+                self._entries[key] = entry
+            entry["count"] += 1
+            entry["request_bytes"] += request_bytes
+            entry["response_bytes"] += response_bytes
+            entry["serialize_secs"] += serialize_secs
+            entry["wire_secs"] += wire_secs
+            entry["parse_secs"] += parse_secs
+            entry["max_latency_msecs"] = max(entry["max_latency_msecs"],
+                                             latency_msecs)
+            entry["latency_histogram"][bucket] += 1
+
+    def GetSummary(self):
+        """Returns a copy of the statistics.
+
+        Returns:
+            dict of string to dict, the key of the commands to their count,
+            request_bytes, response_bytes, serialize_secs, wire_secs,
+            parse_secs, max_latency_msecs and latency_histogram. The
+            histogram is a list of counts, one per bucket of
+            GetHistogramLabels().
+        """
+        with self._lock:
+            summary = {}
+            for key, entry in self._entries.items():
+                summary[key] = dict(entry)
+                summary[key]["latency_histogram"] = list(
+                    entry["latency_histogram"])
+            return summary
+
+    def GetTotalSecs(self):
+        """Returns the total time spent on the RPCs in seconds."""
+        with self._lock:
+            return sum(entry["serialize_secs"] + entry["wire_secs"] +
+                       entry["parse_secs"]
+                       for entry in self._entries.values())
+
+    def Reset(self):
+        """Drops all the statistics."""
+        with self._lock:
+            self._entries.clear()
+
+    def Dump(self, path):
+        """Writes the statistics to a JSON file.
+
+        Args:
+            path: string, the path of the file.
+        """
+        with open(path, "w") as dump_file:
+            json.dump(
+                {
+                    "latency_bucket_labels": GetHistogramLabels(),
+                    "commands": self.GetSummary()
+                },
+                dump_file,
+                indent=2,
+                sort_keys=True)
+
+    def LogSummary(self):
+        """Logs one line per key, the slowest in total first."""
+        summary = self.GetSummary()
+        total = lambda entry: (entry["serialize_secs"] + entry["wire_secs"] +
+                               entry["parse_secs"])
+        for key in sorted(summary, key=lambda k: -total(summary[k])):
+            entry = summary[key]
+            logging.info(
+                "agent rpc %s: count %d, total %.3fs (serialize %.3fs, "
+                "wire %.3fs, parse %.3fs), max %.1fms, sent %d bytes, "
+                "received %d bytes", key, entry["count"], total(entry),
+                entry["serialize_secs"], entry["wire_secs"],
+                entry["parse_secs"], entry["max_latency_msecs"],
+                entry["request_bytes"], entry["response_bytes"])
+
+    def UploadToWeb(self, web):
+        """Adds the latency histogram of each key as a profiling point.
+
+        Args:
+            web: WebFeature, a no-op if it is not enabled.
+        """
+        labels = GetHistogramLabels()
+        summary = self.GetSummary()
+        for key in sorted(summary):
+            web.AddProfilingDataLabeledVector(
+                _PROFILING_POINT_PREFIX + key,
+                labels,
+                summary[key]["latency_histogram"],
+                x_axis_label="Agent RPC latency (msecs)",
+                y_axis_label="Frequency")
+
+
+def GetHistogramLabels():
+    """Returns the labels of the latency histogram buckets."""
+    labels = []
+    lower = 0
+    for upper in LATENCY_BUCKET_BOUNDS_MSECS:
+        labels.append("%s-%s" % (lower, upper))
+        lower = upper
+    labels.append("%s+" % lower)
+    return labels
+
+
+_default_stats = VtsTcpClientStats()
+
+
+def GetDefaultStats():
+    """Returns the statistics the clients of this process record to."""
+    return _default_stats
@@ -0,0 +1,56 @@
+#
+# Copyright (C) 2017 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Constants of the protocol between the host and the agent.
+
+They are shared by VtsTcpClient, CallbackServer and FakeAgent.
+"""
+
+import struct
+
+# Capability names negotiated with the agent at SET_HOST_INFO. The
+# negotiation is host-only on purpose: the agent on the device implements
+# none of them and echoes none, so every session with a device uses the
+# legacy text format, ASCII framed, uncompressed protocol, which is the
+# production default. The capabilities are only requested when listed in
+# vts_tcp_client.HOST_CAPABILITIES or passed to Connect, e.g., with an agent
+# such as FakeAgent which echoes the ones it accepts.
+# CALL_API, GET_ATTRIBUTE, READ_SPECIFICATION and LIST_APIS payloads are
+# binary serialized protobuf messages instead of text format messages.
+CAPABILITY_BINARY_PAYLOAD = "binary_payload"
+# Messages after SET_HOST_INFO are framed by BINARY_FRAME_HEADER instead of
+# an ASCII length line.
+CAPABILITY_BINARY_FRAMING = "binary_framing"
+# Messages after SET_HOST_INFO start with a codec byte (CODEC_*) and
+# messages larger than COMPRESSION_THRESHOLD_BYTES are zlib compressed.
+CAPABILITY_ZLIB_COMPRESSION = "zlib_compression"
+# A VTS_AGENT_COMMAND_EXECUTE_SHELL_COMMAND command whose paths include this
+# name is answered by a response per chunk of output as the commands run,
+# followed by a final response with the exit codes, whose result is
+# STREAMING_SHELL_FINAL_RESULT.
+CAPABILITY_STREAMING_SHELL = "streaming_shell"
+STREAMING_SHELL_FINAL_RESULT = "final"
+SUPPORTED_CAPABILITIES = [
+    CAPABILITY_BINARY_PAYLOAD, CAPABILITY_BINARY_FRAMING,
+    CAPABILITY_ZLIB_COMPRESSION, CAPABILITY_STREAMING_SHELL
+]
+
+# A 4-byte big-endian length.
+BINARY_FRAME_HEADER = struct.Struct(">I")
+CODEC_RAW = b"\x00"
+CODEC_ZLIB = b"\x01"
+COMPRESSION_THRESHOLD_BYTES = 4096
+# Favors speed; the payloads are mostly text and compress well anyway.
+COMPRESSION_LEVEL = 1
@@ -14,25 +14,262 @@
 # limitations under the License.
 #
 
+import collections
+import concurrent.futures
 import logging
 import socket
 import socketserver
 import threading
+import time
 
 from vts.runners.host import errors
 from vts.proto import AndroidSystemControlMessage_pb2 as SysMsg
 from vts.proto import ComponentSpecificationMessage_pb2 as CompSpecMsg
+from vts.runners.host.tcp_client import vts_tcp_protocol
 from vts.utils.python.mirror import pb2py
 
-_functions = dict()  # Dictionary to hold function pointers
+# Policies applied when the queue of a callback is full.
+# Waits for the handler, which pushes back on the target.
+POLICY_BLOCK = "block"
+# Discards the oldest queued call.
+POLICY_DROP_OLDEST = "drop_oldest"
+# Replaces the arguments of the newest queued call with the new ones.
+POLICY_COALESCE = "coalesce"
+_POLICIES = (POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_COALESCE)
+_DEFAULT_MAX_QUEUE_SIZE = 1024
+# A connection whose first byte is not an ASCII digit frames its messages by
+# vts_tcp_protocol.BINARY_FRAME_HEADER, and so are the responses on it.
+_ASCII_DIGITS = b"0123456789"
 
 
 class VtsCallbackServerError(errors.VtsError):
     """Raised when an error occurs in VTS TCP server."""
 
 
+class CallbackQueue(object):
+    """The calls of a callback function waiting for its worker thread.
+
+    The calls of a callback run one by one in the order they were received,
+    while different callbacks run concurrently on their own workers.
+
+    Attributes:
+        func_id: string, the ID of the callback.
+        _func: function, the callback function.
+        _policy: string, POLICY_*, applied when the queue is full.
+        _max_size: int, the max number of queued calls.
+        _calls: deque of [args, Future], the queued calls.
+        _cond: Condition, guards the attributes.
+        _worker: Thread, runs the calls. Started by the first call.
+        _closed: bool, whether the queue accepts no more calls.
+        _stats: dict, the counters returned by GetStats.
+        _arg_converters: list of (int, function), the type of each argument
+                         and its converter compiled by pb2py.
+    """
+
+    def __init__(self, func_id, func, policy, max_size):
+        if policy not in _POLICIES:
+            raise VtsCallbackServerError("Unknown queue policy '%s'" % policy)
+        self.func_id = func_id
+        self._func = func
+        self._policy = policy
+        self._max_size = max(1, max_size)
+        self._calls = collections.deque()
+        self._cond = threading.Condition()
+        self._worker = None
+        self._closed = False
+        self._stats = {
+            "received": 0,
+            "handled": 0,
+            "failed": 0,
+            "dropped": 0,
+            "coalesced": 0,
+            "max_depth": 0,
+            "handler_secs": 0.0,
+            "max_handler_secs": 0.0
+        }
+        self._arg_converters = []
+
+    def ConvertArgs(self, arg_msgs):
+        """Converts the argument messages of a call to Python values.
+
+        A callback receives arguments of the same types on every call, so
+        the converters are compiled once from the first call's arguments.
+        They are recompiled if the types change.
+
+        Args:
+            arg_msgs: list of VariableSpecificationMessage, the arguments.
+
+        Returns:
+            tuple, the converted arguments.
+        """
+        converters = self._arg_converters
+        if (len(converters) != len(arg_msgs) or
+                any(arg_type != arg_msg.type
+                    for (arg_type, _), arg_msg in zip(converters, arg_msgs))):
+            converters = [(arg_msg.type, pb2py.CompileConverter(arg_msg))
+                          for arg_msg in arg_msgs]
+            self._arg_converters = converters
+        return tuple(convert(arg_msg)
+                     for (_, convert), arg_msg in zip(converters, arg_msgs))
+
+    def Put(self, args):
+        """Queues a call.
+
+        Args:
+            args: tuple, the arguments of the callback.
+
+        Returns:
+            concurrent.futures.Future, done when the call returns or is
+            discarded by the policy, with result None in the latter case.
+
+        Raises:
+            VtsCallbackServerError if the queue is closed.
+        """
+        future = concurrent.futures.Future()
+        with self._cond:
+            if self._closed:
+                raise VtsCallbackServerError(
+                    "Callback '%s' is unregistered." % self.func_id)
+            self._stats["received"] += 1
+            if len(self._calls) >= self._max_size:
+                if self._policy == POLICY_COALESCE:
+                    call = self._calls[-1]
+                    call[0] = args
+                    self._stats["coalesced"] += 1
+                    return call[1]
+                if self._policy == POLICY_DROP_OLDEST:
+                    _, dropped = self._calls.popleft()
+                    dropped.set_result(None)
+                    self._stats["dropped"] += 1
+                else:
+                    while len(self._calls) >= self._max_size:
+                        self._cond.wait()
+                        if self._closed:
+                            raise VtsCallbackServerError(
+                                "Callback '%s' is unregistered." %
+                                self.func_id)
+            self._calls.append([args, future])
+            self._stats["max_depth"] = max(self._stats["max_depth"],
+                                           len(self._calls))
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._Work, name="callback_%s" % self.func_id)
+                self._worker.daemon = True
+                self._worker.start()
+            self._cond.notify_all()
+        return future
+
+    def _Work(self):
+        """Runs the queued calls until the queue is closed and empty."""
+        while True:
+            with self._cond:
+                while not self._calls and not self._closed:
+                    self._cond.wait()
+                if not self._calls:
+                    return
+                args, future = self._calls.popleft()
+                # Wakes up a blocked Put.
+                self._cond.notify_all()
+            start_time = time.time()
+            try:
+                future.set_result(self._func(*args))
+                failed = False
+            except Exception as e:
+                logging.exception("Callback %s failed: %s", self.func_id, e)
+                future.set_exception(e)
+                failed = True
+            handler_secs = time.time() - start_time
+            with self._cond:
+                self._stats["failed" if failed else "handled"] += 1
+                self._stats["handler_secs"] += handler_secs
+                self._stats["max_handler_secs"] = max(
+                    self._stats["max_handler_secs"], handler_secs)
+
+    def Close(self):
+        """Stops accepting calls. The queued calls still run."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def GetStats(self):
+        """Returns the counters of the queue.
+
+        Returns:
+            dict with the number of received, handled, failed, dropped and
+            coalesced calls, the current depth and max_depth of the queue,
+            and the total and max seconds the handler took.
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats["depth"] = len(self._calls)
+            return stats
+
+
+class CallbackRegistry(object):
+    """The callbacks registered to a CallbackServer.
+
+    Attributes:
+        _queues: dict, key is the ID of a callback, value is its
+                 CallbackQueue.
+        _lock: Lock, guards _queues.
+        _policy: string, the default POLICY_* of the queues.
+        _max_queue_size: int, the default max size of the queues.
+    """
+
+    def __init__(self, policy=POLICY_BLOCK,
+                 max_queue_size=_DEFAULT_MAX_QUEUE_SIZE):
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._policy = policy
+        self._max_queue_size = max_queue_size
+
+    def Register(self, func_id, func, policy=None, max_queue_size=None):
+        """Adds a callback. See CallbackServer.RegisterCallback."""
+        queue = CallbackQueue(func_id, func, policy or self._policy,
+                              max_queue_size or self._max_queue_size)
+        with self._lock:
+            if func_id in self._queues:
+                raise VtsCallbackServerError(
+                    "Function ID '%s' is already registered" % func_id)
+            self._queues[func_id] = queue
+
+    def Unregister(self, func_id):
+        """Removes a callback. See CallbackServer.UnregisterCallback."""
+        with self._lock:
+            queue = self._queues.pop(func_id, None)
+        if queue is None:
+            raise VtsCallbackServerError(
+                "Can't remove function ID '%s', which is not registered." %
+                func_id)
+        queue.Close()
+
+    def Get(self, func_id):
+        """Returns the CallbackQueue of a callback, None if not registered."""
+        with self._lock:
+            return self._queues.get(func_id)
+
+    def GetStats(self):
+        """Returns a dict of the callback IDs to their queue counters."""
+        with self._lock:
+            queues = list(self._queues.values())
+        return dict((queue.func_id, queue.GetStats()) for queue in queues)
+
+    def Close(self):
+        """Closes all the queues."""
+        with self._lock:
+            queues = list(self._queues.values())
+        for queue in queues:
+            queue.Close()
+
+
 class CallbackRequestHandler(socketserver.StreamRequestHandler):
-    """The request handler class for our server."""
+    """The request handler class for our server.
+
+    A connection may carry any number of request messages. Each is framed
+    by an ASCII length line, or a 4-byte big-endian length if the first byte
+    of the connection is not a digit. A response is sent per request; in the
+    binary mode it is framed the same way.
+    """
 
     def handle(self):
         """Receives requests from clients.
@@ -41,7 +278,42 @@ class CallbackRequestHandler(socketserver.StreamRequestHandler):
         to the host side and is handled here. The message is parsed and the
         appropriate callback function on the host side is called.
         """
-        header = self.rfile.readline().strip()
+        # Read, not peeked, since the rfile of Python 2 cannot peek. It is
+        # the start of the first frame's header.
+        prefix = self.rfile.read(1)
+        if not prefix:
+            return
+        binary_framing = prefix not in _ASCII_DIGITS
+        while True:
+            if binary_framing:
+                received_data = self._ReadBinaryFrame(prefix)
+            else:
+                received_data = self._ReadAsciiFrame(prefix)
+            prefix = b""
+            if received_data is None:
+                return
+            response_message = self._HandleMessage(received_data,
+                                                   not binary_framing)
+            # send the response back to client
+            message = response_message.SerializeToString()
+            # self.request is the TCP socket connected to the client
+            if binary_framing:
+                self.request.sendall(
+                    vts_tcp_protocol.BINARY_FRAME_HEADER.pack(len(message)) +
+                    message)
+            else:
+                self.request.sendall(message)
+
+    def _ReadAsciiFrame(self, prefix=b""):
+        """Reads a message framed by an ASCII length line.
+
+        Args:
+            prefix: bytes, the start of the length line if already read.
+
+        Returns:
+            bytes, the message. None at the end of the connection.
+        """
+        header = (prefix + self.rfile.readline()).strip()
         try:
             len = int(header)
         except ValueError:
@@ -51,10 +323,40 @@ class CallbackRequestHandler(socketserver.StreamRequestHandler):
                                   header)
                 raise
             else:
-                logging.error('CallbackRequestHandler received empty message header. Skipping...')
-                return
+                logging.debug('CallbackRequestHandler reached the end of the '
+                              'connection.')
+                return None
         # Read the request message.
-        received_data = self.rfile.read(len)
+        return self.rfile.read(len)
+
+    def _ReadBinaryFrame(self, prefix=b""):
+        """Reads a message framed by a 4-byte big-endian length.
+
+        Args:
+            prefix: bytes, the start of the length if already read.
+
+        Returns:
+            bytes, the message. None at the end of the connection.
+        """
+        header = prefix + self.rfile.read(
+            vts_tcp_protocol.BINARY_FRAME_HEADER.size - len(prefix))
+        if len(header) < vts_tcp_protocol.BINARY_FRAME_HEADER.size:
+            return None
+        return self.rfile.read(
+            vts_tcp_protocol.BINARY_FRAME_HEADER.unpack(header)[0])
+
+    def _HandleMessage(self, received_data, wait):
+        """Dispatches a request message to the registered callback.
+
+        Args:
+            received_data: bytes, the serialized request message.
+            wait: bool, whether to wait for the callback to return. The
+                  legacy one-message connections expect the callback to have
+                  run when the response arrives.
+
+        Returns:
+            AndroidSystemCallbackResponseMessage.
+        """
         logging.debug("Received callback message: %s", received_data)
         request_message = SysMsg.AndroidSystemCallbackRequestMessage()
         request_message.ParseFromString(received_data)
@@ -62,71 +364,110 @@ class CallbackRequestHandler(socketserver.StreamRequestHandler):
         response_message = SysMsg.AndroidSystemCallbackResponseMessage()
         # Call the appropriate callback function and construct the response
         # message.
-        if request_message.id in _functions:
-            callback_args = []
-            for arg in request_message.arg:
-                callback_args.append(pb2py.Convert(arg))
-            args = tuple(callback_args)
-            _functions[request_message.id](*args)
+        queue = self.server.registry.Get(request_message.id)
+        if queue is not None:
             response_message.response_code = SysMsg.SUCCESS
+            try:
+                args = queue.ConvertArgs(request_message.arg)
+                future = queue.Put(args)
+                if wait and future.exception() is not None:
+                    response_message.response_code = SysMsg.FAIL
+            except errors.VtsError as e:
+                logging.error(e)
+                response_message.response_code = SysMsg.FAIL
         else:
             logging.error("Callback function ID %s is not registered!",
                           request_message.id)
             response_message.response_code = SysMsg.FAIL
+        return response_message
+
 
-        # send the response back to client
-        message = response_message.SerializeToString()
-        # self.request is the TCP socket connected to the client
-        self.request.sendall(message)
+class ThreadedCallbackServer(socketserver.ThreadingMixIn,
+                             socketserver.TCPServer):
+    """Serves each connection on a thread.
+
+    Attributes:
+        registry: CallbackRegistry, the callbacks to dispatch to.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, server_address, handler_class, registry):
+        socketserver.TCPServer.__init__(self, server_address, handler_class)
+        self.registry = registry
 
 
 class CallbackServer(object):
     """This class creates TCPServer in separate thread.
 
     Attributes:
-        _server: an instance of socketserver.TCPServer.
+        _server: an instance of ThreadedCallbackServer.
         _port: this variable maintains the port number used in creating
                the server connection.
         _ip: variable to hold the IP Address of the host.
         _hostname: IP Address to which initial connection is made.
+        _registry: CallbackRegistry, the callbacks of this server.
     """
 
-    def __init__(self):
+    def __init__(self, policy=POLICY_BLOCK,
+                 max_queue_size=_DEFAULT_MAX_QUEUE_SIZE):
+        """Initializes the server.
+
+        Args:
+            policy: string, POLICY_*, the default policy applied when the
+                    queue of a callback is full.
+            max_queue_size: int, the default max number of queued calls of
+                            a callback.
+        """
         self._server = None
         self._port = 0  # Port 0 means to select an arbitrary unused port
         self._ip = ""  # Used to store the IP address for the server
         self._hostname = "localhost"  # IP address to which initial connection is made
+        self._registry = CallbackRegistry(policy, max_queue_size)
 
-    def RegisterCallback(self, func_id, callback_func):
+    def RegisterCallback(self,
+                         func_id,
+                         callback_func,
+                         policy=None,
+                         max_queue_size=None):
         """Registers a callback function.
 
         Args:
             func_id: The ID of the callback function.
             callback_func: The function to register.
+            policy: string, POLICY_*, overrides the server's default policy
+                    for this callback.
+            max_queue_size: int, overrides the server's default queue size
+                            for this callback.
 
         Raises:
-            CallbackServerError is raised if the func_id is already registered.
+            VtsCallbackServerError is raised if the func_id is already
+            registered or the policy is unknown.
         """
-        if func_id in _functions:
-            raise CallbackServerError(
-                "Function ID '%s' is already registered" % func_id)
-        _functions[func_id] = callback_func
+        self._registry.Register(func_id, callback_func, policy,
+                                max_queue_size)
 
     def UnregisterCallback(self, func_id):
         """Removes a callback function from the registry.
 
+        The calls already queued still run.
+
         Args:
             func_id: The ID of the callback function to remove.
 
         Raises:
-            CallbackServerError is raised if the func_id is not registered.
+            VtsCallbackServerError is raised if the func_id is not registered.
         """
-        try:
-            _functions.pop(func_id)
-        except KeyError:
-            raise CallbackServerError(
-                "Can't remove function ID '%s', which is not registered." %
-                func_id)
+        self._registry.Unregister(func_id)
+
+    def GetCallbackStats(self):
+        """Returns the queue counters of the registered callbacks.
+
+        Returns:
+            dict, key is a callback ID, value is the dict returned by
+            CallbackQueue.GetStats.
+        """
+        return self._registry.GetStats()
 
     def Start(self, port=0):
         """Starts the server.
@@ -139,15 +480,15 @@ class CallbackServer(object):
             IP Address, port number
 
         Raises:
-            CallbackServerError is raised if the server fails to start.
+            VtsCallbackServerError is raised if the server fails to start.
         """
         try:
-            self._server = socketserver.TCPServer(
-                (self._hostname, port), CallbackRequestHandler)
+            self._server = ThreadedCallbackServer(
+                (self._hostname, port), CallbackRequestHandler, self._registry)
             self._ip, self._port = self._server.server_address
 
             # Start a thread with the server.
-            # Each request will be handled in a child thread.
+            # Each connection will be handled in a child thread.
             server_thread = threading.Thread(target=self._server.serve_forever)
             server_thread.daemon = True
             server_thread.start()
@@ -156,7 +497,7 @@ class CallbackServer(object):
             return self._ip, self._port
         except (RuntimeError, IOError, socket.error) as e:
             logging.exception(e)
-            raise CallbackServerError(
+            raise VtsCallbackServerError(
                 'Failed to start CallbackServer on (%s:%s).' %
                 (self._hostname, port))
 
@@ -165,6 +506,7 @@ class CallbackServer(object):
         """
         self._server.shutdown()
         self._server.server_close()
+        self._registry.Close()
 
     @property
     def ip(self):
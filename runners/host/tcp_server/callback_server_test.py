@@ -15,6 +15,9 @@
 #
 
 import socket
+import struct
+import threading
+import time
 import unittest
 import logging
 import errno
@@ -223,5 +226,93 @@ class TestMethods(unittest.TestCase):
         # also confirm the error message
         self.assertEqual(response_message.response_code, SysMsg_pb2.FAIL)
 
+    def testPersistentConnection(self):
+        """Tests many binary framed callbacks on one connection.
+
+        The callbacks of an ID must run one by one.
+        """
+        func_id = "21"
+        running = []
+        overlapped = []
+        done = threading.Event()
+        calls = []
+
+        def callback_func(*args):
+            if running:
+                overlapped.append(True)
+            running.append(True)
+            time.sleep(0.01)
+            running.pop()
+            calls.append(True)
+            if len(calls) == 10:
+                done.set()
+
+        self._callback_server.RegisterCallback(func_id, callback_func)
+
+        sock = socket.create_connection((self._callback_server.ip,
+                                         self._callback_server.port))
+        try:
+            request_message = SysMsg_pb2.AndroidSystemCallbackRequestMessage()
+            request_message.id = func_id
+            message = request_message.SerializeToString()
+            sock.sendall((struct.pack(">I", len(message)) + message) * 10)
+
+            rfile = sock.makefile("rb")
+            for _ in range(10):
+                length = struct.unpack(">I", rfile.read(4))[0]
+                response_message = (
+                    SysMsg_pb2.AndroidSystemCallbackResponseMessage())
+                response_message.ParseFromString(rfile.read(length))
+                self.assertEqual(response_message.response_code,
+                                 SysMsg_pb2.SUCCESS)
+        finally:
+            sock.close()
+
+        self.assertTrue(done.wait(10))
+        self.assertFalse(overlapped)
+        self._callback_server.UnregisterCallback(func_id)
+
+    def testDropOldestPolicy(self):
+        """Tests that a full queue drops the oldest calls and counts them."""
+        func_id = "31"
+        release = threading.Event()
+        handled = threading.Event()
+        calls = []
+
+        def callback_func(*args):
+            release.wait(10)
+            calls.append(True)
+            if len(calls) == 2:
+                handled.set()
+
+        self._callback_server.RegisterCallback(
+            func_id,
+            callback_func,
+            policy=callback_server.POLICY_DROP_OLDEST,
+            max_queue_size=1)
+
+        sock = socket.create_connection((self._callback_server.ip,
+                                         self._callback_server.port))
+        try:
+            request_message = SysMsg_pb2.AndroidSystemCallbackRequestMessage()
+            request_message.id = func_id
+            message = request_message.SerializeToString()
+            rfile = sock.makefile("rb")
+            for _ in range(5):
+                sock.sendall(struct.pack(">I", len(message)) + message)
+                length = struct.unpack(">I", rfile.read(4))[0]
+                rfile.read(length)
+                # Lets the worker take the first call before queueing more.
+                time.sleep(0.1)
+        finally:
+            sock.close()
+
+        release.set()
+        self.assertTrue(handled.wait(10))
+        stats = self._callback_server.GetCallbackStats()[func_id]
+        self.assertEqual(stats["received"], 5)
+        self.assertEqual(stats["dropped"], 3)
+        self.assertEqual(stats["max_depth"], 1)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,546 @@
+#
+# Copyright (C) 2017 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""A host-side stand-in for the VTS agent.
+
+FakeAgent speaks the same protocol as the agent on a device, so that the host
+stack (VtsTcpClient, HalMirror, ShellMirror and CallbackServer) can be
+benchmarked and regression tested without a device. For example:
+
+    agent = fake_agent.FakeAgent(latency_secs=0.001)
+    agent.AddSpec(spec)
+    port = agent.Start()
+    hal = hal_mirror.HalMirror(port, callback_port)
+    hal.InitHidlHal(...)
+"""
+
+import logging
+import socket
+import socketserver
+import subprocess
+import threading
+import time
+import zlib
+
+from google.protobuf import message
+from google.protobuf import text_format
+from vts.proto import AndroidSystemControlMessage_pb2 as SysMsg
+from vts.proto import ComponentSpecificationMessage_pb2 as CompSpecMsg
+from vts.runners.host import errors
+from vts.runners.host.tcp_client import vts_tcp_protocol
+from vts.utils.python.common import vts_spec_cache
+
+_HAL_DRIVER_TYPES = (SysMsg.VTS_DRIVER_TYPE_HAL_CONVENTIONAL,
+                     SysMsg.VTS_DRIVER_TYPE_HAL_LEGACY,
+                     SysMsg.VTS_DRIVER_TYPE_HAL_HIDL)
+_SUPPORTED_CAPABILITIES = (vts_tcp_protocol.CAPABILITY_BINARY_PAYLOAD,
+                           vts_tcp_protocol.CAPABILITY_BINARY_FRAMING,
+                           vts_tcp_protocol.CAPABILITY_ZLIB_COMPRESSION,
+                           vts_tcp_protocol.CAPABILITY_STREAMING_SHELL)
+
+
+class FakeAgentError(errors.VtsError):
+    """Raised when the fake agent fails to start or to send a callback."""
+
+
+def EchoShellHandler(command):
+    """Returns the output of a shell command without running it.
+
+    Args:
+        command: string, the shell command.
+
+    Returns:
+        tuple of (stdout, stderr, exit_code), stdout is the command itself.
+    """
+    return command + "\n", "", 0
+
+
+def LocalShellHandler(command):
+    """Runs a shell command on the host.
+
+    Args:
+        command: string, the shell command.
+
+    Returns:
+        tuple of (stdout, stderr, exit_code).
+    """
+    process = subprocess.Popen(
+        command,
+        shell=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    return stdout, stderr, process.returncode
+
+
+class _Session(object):
+    """The state of a command session, which the agent forks a driver for.
+
+    Attributes:
+        capabilities: set of string, the capabilities accepted at
+                      SET_HOST_INFO.
+        spec: ComponentSpecificationMessage of the launched HAL driver.
+    """
+
+    def __init__(self):
+        self.capabilities = set()
+        self.spec = None
+
+
+class _SessionHandler(socketserver.StreamRequestHandler):
+    """Handles the commands of a session in order."""
+
+    def handle(self):
+        agent = self.server.agent
+        session = _Session()
+        try:
+            while True:
+                data = self._ReadFrame(session)
+                if data is None:
+                    return
+                if vts_tcp_protocol.CAPABILITY_ZLIB_COMPRESSION in (
+                        session.capabilities):
+                    data = _Decompress(data)
+                command_msg = SysMsg.AndroidSystemControlCommandMessage()
+                command_msg.ParseFromString(data)
+                # The capabilities take effect after the SET_HOST_INFO
+                # response, which is framed the same as the command.
+                capabilities = set(session.capabilities)
+                for response_msg in agent._HandleCommand(session,
+                                                         command_msg):
+                    self._WriteFrame(capabilities,
+                                     response_msg.SerializeToString())
+        except (socket.error, IOError, ValueError) as e:
+            logging.info("fake agent session closed: %s", e)
+
+    def _ReadFrame(self, session):
+        """Reads a command message.
+
+        Returns:
+            bytes, the message. None at the end of the session.
+        """
+        if vts_tcp_protocol.CAPABILITY_BINARY_FRAMING in session.capabilities:
+            header = self.rfile.read(vts_tcp_protocol.BINARY_FRAME_HEADER.size)
+            if len(header) < vts_tcp_protocol.BINARY_FRAME_HEADER.size:
+                return None
+            length = vts_tcp_protocol.BINARY_FRAME_HEADER.unpack(header)[0]
+        else:
+            header = self.rfile.readline()
+            if not header:
+                return None
+            length = int(header.strip())
+        return self.rfile.read(length)
+
+    def _WriteFrame(self, capabilities, data):
+        """Writes a response message.
+
+        Args:
+            capabilities: set of string, the capabilities in effect.
+            data: bytes, the serialized response message.
+        """
+        if vts_tcp_protocol.CAPABILITY_ZLIB_COMPRESSION in capabilities:
+            data = _Compress(data)
+        if vts_tcp_protocol.CAPABILITY_BINARY_FRAMING in capabilities:
+            self.wfile.write(
+                vts_tcp_protocol.BINARY_FRAME_HEADER.pack(len(data)) + data)
+        else:
+            self.wfile.write(str(len(data)).encode("ascii") + b"\n" + data)
+        self.wfile.flush()
+
+
+def _Compress(data):
+    """Prepends the codec byte the same as VtsTcpClient."""
+    if len(data) > vts_tcp_protocol.COMPRESSION_THRESHOLD_BYTES:
+        compressed = zlib.compress(data, vts_tcp_protocol.COMPRESSION_LEVEL)
+        if len(compressed) < len(data):
+            return vts_tcp_protocol.CODEC_ZLIB + compressed
+    return vts_tcp_protocol.CODEC_RAW + data
+
+
+def _Decompress(data):
+    """Strips the codec byte and decompresses a message."""
+    if data[:1] == vts_tcp_protocol.CODEC_ZLIB:
+        return zlib.decompress(data[1:])
+    return data[1:]
+
+
+class _ThreadedAgentServer(socketserver.ThreadingMixIn,
+                           socketserver.TCPServer):
+    """Serves each session on its own thread."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeAgent(object):
+    """Serves the agent's commands from canned or spec-driven responses.
+
+    Each response is delayed by the injected latency to model the transport
+    and the driver on a device.
+
+    Attributes:
+        latency_secs: float, the delay of every response, or dict of command
+                      type to the delay of its responses.
+        payload_bytes: int, the number of elements of each vector of scalars
+                       returned by CALL_API, and the min size of the stdout
+                       of a shell command. 0 to keep them as they are.
+        hals: list of string, the HAL file names LIST_HALS returns.
+        call_handler: function(session_spec, FunctionCallMessage), returns
+                      the FunctionSpecificationMessage of the result. None to
+                      return the API's spec with default return values.
+        shell_handler: function(command), returns (stdout, stderr,
+                       exit_code). Defaults to EchoShellHandler.
+        capabilities: list of string, the capabilities the agent accepts.
+        callback_port: int, the host's callback port from SET_HOST_INFO.
+        command_counts: dict of int to int, the number of commands received
+                        by type.
+        _specs: dict of string to ComponentSpecificationMessage, the specs
+                by VtsSpecCache.GetKey.
+        _server: _ThreadedAgentServer, None if stopped.
+        _next_driver_id: int, the ID of the next launched HAL driver.
+        _callback_socket: socket connected to the callback server.
+        _lock: Lock, guards the driver IDs, the counts and callbacks.
+    """
+
+    def __init__(self,
+                 latency_secs=0,
+                 payload_bytes=0,
+                 hals=None,
+                 call_handler=None,
+                 shell_handler=EchoShellHandler,
+                 capabilities=_SUPPORTED_CAPABILITIES):
+        self.latency_secs = latency_secs
+        self.payload_bytes = payload_bytes
+        self.hals = list(hals or [])
+        self.call_handler = call_handler
+        self.shell_handler = shell_handler
+        self.capabilities = list(capabilities)
+        self.callback_port = None
+        self.command_counts = {}
+        self._specs = {}
+        self._server = None
+        self._next_driver_id = 1
+        self._callback_socket = None
+        self._lock = threading.Lock()
+
+    def AddSpec(self, spec):
+        """Adds the spec of a HAL which can be launched.
+
+        Args:
+            spec: ComponentSpecificationMessage, e.g., parsed from a .vts file
+                  by VtsSpecParser.
+        """
+        key = vts_spec_cache.VtsSpecCache.GetKey(
+            spec.component_name, spec.component_type_version, spec.package,
+            False)
+        self._specs[key] = spec
+
+    def Start(self, port=0):
+        """Starts serving on localhost.
+
+        Args:
+            port: int, the port to listen on. 0 to pick a free one.
+
+        Returns:
+            int, the port.
+
+        Raises:
+            FakeAgentError if the port cannot be bound.
+        """
+        try:
+            self._server = _ThreadedAgentServer(("localhost", port),
+                                                _SessionHandler)
+        except socket.error as e:
+            raise FakeAgentError("Cannot start fake agent: %s" % e)
+        self._server.agent = self
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        logging.info("fake agent listening on port %s", self.port)
+        return self.port
+
+    def Stop(self):
+        """Stops serving and closes the callback connection."""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        with self._lock:
+            if self._callback_socket:
+                self._callback_socket.close()
+                self._callback_socket = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1] if self._server else None
+
+    def SendCallback(self, callback_id, args=()):
+        """Calls a callback registered on the host's callback server.
+
+        The requests are framed by a 4-byte length on a persistent
+        connection, which the callback server detects.
+
+        Args:
+            callback_id: string, the ID of the callback.
+            args: list of VariableSpecificationMessage, the arguments.
+
+        Returns:
+            bool, whether the callback server accepted the call.
+
+        Raises:
+            FakeAgentError if the host has not sent its callback port.
+        """
+        if not self.callback_port:
+            raise FakeAgentError("No callback port from SET_HOST_INFO.")
+        request_msg = SysMsg.AndroidSystemCallbackRequestMessage()
+        request_msg.id = callback_id
+        request_msg.arg.extend(args)
+        data = request_msg.SerializeToString()
+        with self._lock:
+            if self._callback_socket is None:
+                self._callback_socket = socket.create_connection(
+                    ("localhost", self.callback_port))
+            sock = self._callback_socket
+            frame_header = vts_tcp_protocol.BINARY_FRAME_HEADER
+            sock.sendall(frame_header.pack(len(data)) + data)
+            header = _RecvAll(sock, frame_header.size)
+            response = _RecvAll(sock, frame_header.unpack(header)[0])
+        response_msg = SysMsg.AndroidSystemCallbackResponseMessage()
+        response_msg.ParseFromString(response)
+        return response_msg.response_code == SysMsg.SUCCESS
+
+    def _HandleCommand(self, session, command_msg):
+        """Handles a command.
+
+        Args:
+            session: _Session, the state of the command's session.
+            command_msg: AndroidSystemControlCommandMessage.
+
+        Yields:
+            AndroidSystemControlResponseMessage, more than one if the output
+            of shell commands is streamed.
+        """
+        command_type = command_msg.command_type
+        with self._lock:
+            self.command_counts[command_type] = (
+                self.command_counts.get(command_type, 0) + 1)
+        latency = self.latency_secs
+        if isinstance(latency, dict):
+            latency = latency.get(command_type, 0)
+        if latency:
+            time.sleep(latency)
+
+        if (command_type == SysMsg.VTS_AGENT_COMMAND_EXECUTE_SHELL_COMMAND
+                and vts_tcp_protocol.CAPABILITY_STREAMING_SHELL in
+                command_msg.paths and
+                vts_tcp_protocol.CAPABILITY_STREAMING_SHELL in
+                session.capabilities):
+            for response_msg in self._StreamShellCommands(command_msg):
+                yield response_msg
+            return
+
+        response_msg = SysMsg.AndroidSystemControlResponseMessage()
+        response_msg.response_code = SysMsg.SUCCESS
+        if command_type == SysMsg.SET_HOST_INFO:
+            if command_msg.HasField("callback_port"):
+                self.callback_port = command_msg.callback_port
+            accepted = [
+                capability for capability in command_msg.paths
+                if capability in self.capabilities
+            ]
+            response_msg.file_names.extend(accepted)
+            session.capabilities = set(accepted)
+        elif command_type == SysMsg.PING:
+            pass
+        elif command_type == SysMsg.LIST_HALS:
+            response_msg.file_names.extend(self.hals)
+        elif command_type == SysMsg.CHECK_DRIVER_SERVICE:
+            if session.spec is None:
+                response_msg.response_code = SysMsg.FAIL
+        elif command_type == SysMsg.LAUNCH_DRIVER_SERVICE:
+            self._LaunchDriver(session, command_msg, response_msg)
+        elif command_type == SysMsg.VTS_AGENT_COMMAND_READ_SPECIFICATION:
+            spec = self._FindSpec(command_msg.service_name,
+                                  command_msg.target_version,
+                                  command_msg.target_package)
+            if spec is None:
+                response_msg.result = "error"
+            else:
+                response_msg.result = self._SerializePayload(session, spec)
+        elif command_type == SysMsg.LIST_APIS:
+            if session.spec is None:
+                response_msg.response_code = SysMsg.FAIL
+            else:
+                response_msg.spec = self._SerializePayload(
+                    session, session.spec)
+        elif command_type == SysMsg.CALL_API:
+            self._CallApi(session, command_msg, response_msg)
+        elif command_type == SysMsg.VTS_AGENT_COMMAND_GET_ATTRIBUTE:
+            response_msg.result = self._SerializePayload(
+                session, CompSpecMsg.FunctionSpecificationMessage())
+        elif command_type == SysMsg.VTS_AGENT_COMMAND_EXECUTE_SHELL_COMMAND:
+            for command in command_msg.shell_command:
+                stdout, stderr, exit_code = self._RunShellCommand(command)
+                response_msg.stdout.append(stdout)
+                response_msg.stderr.append(stderr)
+                response_msg.exit_code.append(exit_code)
+        else:
+            logging.error("fake agent: unknown command type %s",
+                          command_type)
+            response_msg.response_code = SysMsg.FAIL
+        yield response_msg
+
+    def _FindSpec(self, component_name, target_version, target_package):
+        """Returns the spec of a HAL, None if not added.
+
+        Args:
+            component_name: string, the interface name, e.g., INfc.
+            target_version: int, the version times 100 as on the wire.
+            target_package: string, the package name.
+        """
+        key = vts_spec_cache.VtsSpecCache.GetKey(
+            component_name, target_version / 100.0, target_package, False)
+        return self._specs.get(key)
+
+    def _LaunchDriver(self, session, command_msg, response_msg):
+        """Launches a driver in a session.
+
+        A HAL driver is launched if its spec is added, or if only one spec is
+        added, and gets a new driver ID. Other drivers always launch.
+        """
+        if command_msg.driver_type not in _HAL_DRIVER_TYPES:
+            return
+        spec = self._FindSpec(command_msg.target_component_name,
+                              command_msg.target_version,
+                              command_msg.target_package)
+        if spec is None and len(self._specs) == 1:
+            spec = list(self._specs.values())[0]
+        if spec is None:
+            logging.error("fake agent: no spec for %s@%s::%s",
+                          command_msg.target_package,
+                          command_msg.target_version,
+                          command_msg.target_component_name)
+            response_msg.response_code = SysMsg.FAIL
+            return
+        session.spec = spec
+        with self._lock:
+            driver_id = self._next_driver_id
+            self._next_driver_id += 1
+        response_msg.result = str(driver_id)
+
+    def _CallApi(self, session, command_msg, response_msg):
+        """Answers CALL_API with the result of call_handler or with the API's
+        spec whose vectors are filled with payload_bytes elements."""
+        call_msg = CompSpecMsg.FunctionCallMessage()
+        self._ParsePayload(session, command_msg.arg, call_msg)
+        if self.call_handler:
+            result = self.call_handler(session.spec, call_msg)
+        else:
+            result = CompSpecMsg.FunctionSpecificationMessage()
+            result.CopyFrom(call_msg.api)
+            del result.return_type_hidl[:]
+            if session.spec is not None:
+                for api in session.spec.interface.api:
+                    if api.name == call_msg.api.name:
+                        result.return_type_hidl.extend(api.return_type_hidl)
+                        break
+            if self.payload_bytes:
+                for return_value in result.return_type_hidl:
+                    self._FillVector(return_value)
+        if result is None:
+            response_msg.response_code = SysMsg.FAIL
+            return
+        response_msg.result = self._SerializePayload(session, result)
+
+    def _FillVector(self, var_spec_msg):
+        """Fills a vector of scalars with payload_bytes elements."""
+        if (var_spec_msg.type not in (CompSpecMsg.TYPE_VECTOR,
+                                      CompSpecMsg.TYPE_ARRAY) or
+                not var_spec_msg.vector_value or
+                var_spec_msg.vector_value[0].type != CompSpecMsg.TYPE_SCALAR):
+            return
+        template = CompSpecMsg.VariableSpecificationMessage()
+        template.CopyFrom(var_spec_msg.vector_value[0])
+        scalar_type = template.scalar_type
+        del var_spec_msg.vector_value[:]
+        for index in xrange(self.payload_bytes):
+            element = var_spec_msg.vector_value.add()
+            element.CopyFrom(template)
+            if scalar_type:
+                # Keeps the value in range of the narrowest scalar types.
+                setattr(element.scalar_value, scalar_type, index % 100)
+        var_spec_msg.vector_size = self.payload_bytes
+
+    def _RunShellCommand(self, command):
+        """Runs a shell command with the handler and pads its stdout."""
+        stdout, stderr, exit_code = self.shell_handler(command)
+        if len(stdout) < self.payload_bytes:
+            stdout += "x" * (self.payload_bytes - len(stdout))
+        return stdout, stderr, exit_code
+
+    def _StreamShellCommands(self, command_msg):
+        """Yields a response per command's output and then the exit codes.
+
+        Args:
+            command_msg: AndroidSystemControlCommandMessage.
+        """
+        exit_codes = []
+        for index, command in enumerate(command_msg.shell_command):
+            stdout, stderr, exit_code = self._RunShellCommand(command)
+            response_msg = SysMsg.AndroidSystemControlResponseMessage()
+            response_msg.response_code = SysMsg.SUCCESS
+            response_msg.result = str(index)
+            response_msg.stdout.append(stdout)
+            response_msg.stderr.append(stderr)
+            yield response_msg
+            exit_codes.append(exit_code)
+        response_msg = SysMsg.AndroidSystemControlResponseMessage()
+        response_msg.response_code = SysMsg.SUCCESS
+        response_msg.result = vts_tcp_protocol.STREAMING_SHELL_FINAL_RESULT
+        response_msg.exit_code.extend(exit_codes)
+        yield response_msg
+
+    def _SerializePayload(self, session, payload):
+        """Serializes a message the way the session negotiated."""
+        if vts_tcp_protocol.CAPABILITY_BINARY_PAYLOAD in session.capabilities:
+            return payload.SerializeToString()
+        return text_format.MessageToString(payload)
+
+    def _ParsePayload(self, session, payload, result):
+        """Parses a message the way the session negotiated."""
+        try:
+            if vts_tcp_protocol.CAPABILITY_BINARY_PAYLOAD in (
+                    session.capabilities):
+                result.MergeFromString(payload)
+            else:
+                text_format.Merge(payload, result)
+        except (text_format.ParseError, message.DecodeError) as e:
+            logging.error("fake agent: cannot parse payload: %s", e)
+        return result
+
+
+def _RecvAll(sock, length):
+    """Receives exactly length bytes.
+
+    Raises:
+        FakeAgentError if the connection is closed.
+    """
+    chunks = []
+    while length > 0:
+        chunk = sock.recv(length)
+        if not chunk:
+            raise FakeAgentError("callback connection closed.")
+        chunks.append(chunk)
+        length -= len(chunk)
+    return b"".join(chunks)
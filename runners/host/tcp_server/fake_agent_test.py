@@ -0,0 +1,270 @@
+#
+# Copyright (C) 2017 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import threading
+import unittest
+
+from vts.proto import AndroidSystemControlMessage_pb2 as SysMsg_pb2
+from vts.proto import ComponentSpecificationMessage_pb2 as CompSpecMsg
+from vts.runners.host import const
+from vts.runners.host import errors
+from vts.runners.host.tcp_client import vts_tcp_client
+from vts.runners.host.tcp_client import vts_tcp_protocol
+from vts.runners.host.tcp_server import callback_server
+from vts.runners.host.tcp_server import fake_agent
+from vts.utils.python.common import vts_spec_cache
+from vts.utils.python.mirror import bulk_vector
+
+
+def _EchoArgHandler(session_spec, call_msg):
+    """Returns the first argument of a call as the API's return value."""
+    result = CompSpecMsg.FunctionSpecificationMessage()
+    result.name = call_msg.api.name
+    return_value = result.return_type_hidl.add()
+    return_value.type = CompSpecMsg.TYPE_SCALAR
+    return_value.scalar_type = "int32_t"
+    return_value.scalar_value.int32_t = (
+        call_msg.api.arg[0].scalar_value.int32_t)
+    return result
+
+
+def _DroppingShellHandler(command):
+    """Echoes a shell command, and closes the session on "drop"."""
+    if command == "drop":
+        raise IOError("session dropped")
+    return fake_agent.EchoShellHandler(command)
+
+
+def _CreateCallMessage(value):
+    """Returns a call of getData with an int32_t argument."""
+    call_msg = CompSpecMsg.FunctionCallMessage()
+    call_msg.api.name = "getData"
+    arg = call_msg.api.arg.add()
+    arg.type = CompSpecMsg.TYPE_SCALAR
+    arg.scalar_type = "int32_t"
+    arg.scalar_value.int32_t = value
+    return call_msg
+
+
+class FakeAgentTest(unittest.TestCase):
+    """Tests VtsTcpClient against FakeAgent.
+
+    Attributes:
+        _agent: FakeAgent, started for each test.
+        _client: VtsTcpClient, connected to _agent.
+        _spec: ComponentSpecificationMessage, the spec of the HAL added to
+               _agent.
+    """
+
+    def setUp(self):
+        self._agent = fake_agent.FakeAgent()
+        spec = CompSpecMsg.ComponentSpecificationMessage()
+        spec.package = "android.hardware.fake"
+        spec.component_type_version = 1.0
+        spec.component_name = "IFake"
+        api = spec.interface.api.add()
+        api.name = "getData"
+        ret = api.return_type_hidl.add()
+        ret.type = CompSpecMsg.TYPE_VECTOR
+        element = ret.vector_value.add()
+        element.type = CompSpecMsg.TYPE_SCALAR
+        element.scalar_type = "uint8_t"
+        self._agent.AddSpec(spec)
+        self._agent.Start()
+        self._spec = spec
+        self._client = vts_tcp_client.VtsTcpClient()
+
+    def tearDown(self):
+        self._client.Disconnect()
+        self._agent.Stop()
+
+    def testCapabilities(self):
+        """Tests that every capability is negotiated."""
+        self.assertTrue(
+            self._client.Connect(
+                command_port=self._agent.port,
+                capabilities=vts_tcp_protocol.SUPPORTED_CAPABILITIES))
+        for capability in fake_agent._SUPPORTED_CAPABILITIES:
+            self.assertTrue(self._client.HasCapability(capability))
+        self.assertTrue(self._client.Ping())
+
+    def testLegacyProtocol(self):
+        """Tests a session which negotiates no capability."""
+        self.assertTrue(self._client.Connect(command_port=self._agent.port))
+        self.assertTrue(self._client.Ping())
+        self.assertNotIn(SysMsg_pb2.SET_HOST_INFO, self._agent.command_counts)
+        results = self._client.ExecuteShellCommand(["echo a", "echo b"])
+        self.assertEqual(list(results[const.STDOUT]), ["echo a\n", "echo b\n"])
+        self.assertEqual(list(results[const.EXIT_CODE]), [0, 0])
+
+    def testCallApi(self):
+        """Tests launching a HAL driver and calling its API."""
+        self._agent.payload_bytes = 10000
+        self._client.Connect(
+            command_port=self._agent.port,
+            capabilities=vts_tcp_protocol.SUPPORTED_CAPABILITIES)
+        driver_id = self._client.LaunchDriverService(
+            driver_type=SysMsg_pb2.VTS_DRIVER_TYPE_HAL_HIDL,
+            service_name="vts_driver_fake",
+            bits=64,
+            target_version=1.0,
+            target_package="android.hardware.fake",
+            target_component_name="IFake")
+        self.assertEqual(driver_id, 1)
+        if_spec_msg = CompSpecMsg.ComponentSpecificationMessage()
+        self._client.ParsePayload(self._client.ListApis(), if_spec_msg)
+        self.assertEqual(if_spec_msg.interface.api[0].name, "getData")
+
+        call_msg = CompSpecMsg.FunctionCallMessage()
+        call_msg.api.name = "getData"
+        result, _ = self._client.CallApi(call_msg)
+        self.assertEqual(len(result), 10000)
+        self.assertEqual(
+            self._agent.command_counts[SysMsg_pb2.CALL_API], 1)
+
+    def testCallApiEmptyVector(self):
+        """Tests that an empty vector is returned in the vector mode, with
+        the element type from the spec of the called API."""
+
+        def EmptyVectorHandler(session_spec, call_msg):
+            result = CompSpecMsg.FunctionSpecificationMessage()
+            result.name = call_msg.api.name
+            result.return_type_hidl.add().type = CompSpecMsg.TYPE_VECTOR
+            return result
+
+        self._agent.call_handler = EmptyVectorHandler
+        self._client.Connect(command_port=self._agent.port)
+        call_msg = CompSpecMsg.FunctionCallMessage()
+        call_msg.api.CopyFrom(self._spec.interface.api[0])
+        result, _ = self._client.CallApi(
+            call_msg, vector_mode=bulk_vector.VECTOR_MODE_BYTES)
+        self.assertEqual(result, b"")
+        result, _ = self._client.CallApi(
+            call_msg.SerializeToString(),
+            vector_mode=bulk_vector.VECTOR_MODE_BYTES)
+        self.assertEqual(result, [])
+
+    def testPipelinedResponses(self):
+        """Tests that interleaved pipelined commands get their own
+        responses, with and without the capabilities."""
+        self._agent.call_handler = _EchoArgHandler
+        for capabilities in (None, vts_tcp_protocol.SUPPORTED_CAPABILITIES):
+            client = vts_tcp_client.VtsTcpClient(max_outstanding=4)
+            try:
+                client.Connect(
+                    command_port=self._agent.port, capabilities=capabilities)
+                pending = []
+                for index in range(20):
+                    pending.append(
+                        client.CallApiAsync(_CreateCallMessage(index)))
+                    pending.append(
+                        client.ExecuteShellCommandAsync("echo %d" % index))
+                    if index == 10:
+                        self.assertTrue(client.Ping())
+                for index in reversed(range(20)):
+                    shell_results = pending[2 * index + 1].result()
+                    self.assertEqual(shell_results[const.STDOUT],
+                                     ["echo %d\n" % index])
+                    call_result = pending[2 * index].result()
+                    self.assertEqual(call_result[0], index)
+                self.assertTrue(all(p.done() for p in pending))
+                self.assertEqual([p.seq_id for p in pending],
+                                 sorted(p.seq_id for p in pending))
+            finally:
+                client.Disconnect()
+
+    def testPipelineConnectionError(self):
+        """Tests that the commands pipelined after a lost response fail."""
+        self._agent.shell_handler = _DroppingShellHandler
+        for capabilities in (None, vts_tcp_protocol.SUPPORTED_CAPABILITIES):
+            client = vts_tcp_client.VtsTcpClient()
+            try:
+                client.Connect(
+                    command_port=self._agent.port, capabilities=capabilities)
+                pending = [
+                    client.ExecuteShellCommandAsync(command)
+                    for command in ("echo a", "echo b", "drop", "echo c")
+                ]
+                self.assertEqual(pending[0].result()[const.STDOUT],
+                                 ["echo a\n"])
+                self.assertEqual(pending[1].result()[const.STDOUT],
+                                 ["echo b\n"])
+                for lost in pending[2:]:
+                    with self.assertRaises(
+                            errors.VtsTcpCommunicationError):
+                        lost.result()
+            finally:
+                client.Disconnect()
+
+    def testReadSpecificationCache(self):
+        """Tests that only valid specifications are cached."""
+        self._client.Connect(command_port=self._agent.port)
+        self._client.spec_cache = vts_spec_cache.VtsSpecCache(
+            "fingerprint", cache_dir=None)
+        read_args = ("IFake", None, None, 1.0, "android.hardware.fake")
+        for _ in range(2):
+            spec = self._client.ReadSpecification(*read_args)
+            self.assertEqual(spec.component_name, "IFake")
+        self.assertEqual(self._agent.command_counts[
+            SysMsg_pb2.VTS_AGENT_COMMAND_READ_SPECIFICATION], 1)
+
+        self._agent._FindSpec = (
+            lambda *args: CompSpecMsg.ComponentSpecificationMessage())
+        empty_args = ("IEmpty", None, None, 1.0, "android.hardware.fake")
+        for _ in range(2):
+            spec = self._client.ReadSpecification(*empty_args)
+            self.assertEqual(spec.ByteSize(), 0)
+        self.assertEqual(self._agent.command_counts[
+            SysMsg_pb2.VTS_AGENT_COMMAND_READ_SPECIFICATION], 3)
+
+    def testStreamingShell(self):
+        """Tests that streamed output arrives per command."""
+        self._client.Connect(
+            command_port=self._agent.port,
+            capabilities=vts_tcp_protocol.SUPPORTED_CAPABILITIES)
+        chunks = []
+        results = self._client.ExecuteShellCommandStreaming(
+            ["echo a", "echo b"],
+            lambda index, stdout, stderr: chunks.append((index, stdout)))
+        self.assertEqual(chunks, [(0, "echo a\n"), (1, "echo b\n")])
+        self.assertEqual(results[const.EXIT_CODE], [0, 0])
+
+        results = self._client.ExecuteShellCommandStreaming(
+            [], lambda index, stdout, stderr: chunks.append(index))
+        self.assertEqual(results[const.EXIT_CODE], [])
+        self.assertEqual(len(chunks), 2)
+        self.assertTrue(self._client.Ping())
+
+    def testCallback(self):
+        """Tests that a callback sent by the agent reaches the host."""
+        server = callback_server.CallbackServer()
+        _, port = server.Start()
+        try:
+            called = threading.Event()
+            server.RegisterCallback("1", lambda *args: called.set())
+            self._client.Connect(
+                command_port=self._agent.port,
+                callback_port=port,
+                capabilities=vts_tcp_protocol.SUPPORTED_CAPABILITIES)
+            self.assertTrue(self._agent.SendCallback("1"))
+            self.assertTrue(called.wait(5))
+        finally:
+            self._agent.Stop()
+            server.Stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -25,6 +25,7 @@ from vts.runners.host import const
 from vts.runners.host import keys
 from vts.runners.host import test_runner
 from vts.utils.python.common import list_utils
+from vts.utils.python.file import file_sync
 from vts.utils.python.os import path_utils
 from vts.utils.python.precondition import precondition_utils
 from vts.utils.python.web import feature_utils
@@ -186,7 +187,7 @@ class BinaryTest(base_test.BaseTestClass):
         cmd = list(
             set('chmod 755 %s' % test_case.path
                 for test_case in self.testcases))
-        cmd_results = self.shell.Execute(cmd)
+        cmd_results = self.shell.ExecuteInParallel(cmd)
         if any(cmd_results[const.EXIT_CODE]):
             logging.error('Failed to set permission to some of the binaries:\n'
                           '%s\n%s', cmd, cmd_results)
@@ -232,13 +233,17 @@ class BinaryTest(base_test.BaseTestClass):
         source_list = filter(bool, source_list)
         logging.info('Parsed test sources: %s', source_list)
 
-        # Push source files first
+        # Push source files first, skipping the ones the device already has.
+        push_list = []
         for src, dst, tag in source_list:
             if src:
                 if os.path.isdir(src):
                     src = os.path.join(src, '.')
                 logging.info('Pushing from %s to %s.', src, dst)
-                self._dut.adb.push('{src} {dst}'.format(src=src, dst=dst))
+                push_list.append((src, dst))
+        if push_list:
+            file_sync.FileSync(self._dut.adb).Push(push_list)
+            for src, dst in push_list:
                 self.shell.Execute('ls %s' % dst)
 
         # Then create test cases
@@ -324,7 +329,8 @@ class BinaryTest(base_test.BaseTestClass):
         sources = set(filter(bool, sources))
         paths = [dst for src, dst, tag in sources if src and dst]
         cmd = ['rm -rf %s' % dst for dst in paths]
-        cmd_results = self.shell.Execute(cmd, no_except=True)
+        cmd_results = self.shell.ExecuteInParallel(cmd, no_except=True)
+        self.shell.RemoveDefaultPool()
         if not cmd_results or any(cmd_results[const.EXIT_CODE]):
             logging.warning('Failed to clean up test class: %s', cmd_results)
 
@@ -25,6 +25,7 @@ from vts.runners.host import test_runner
 from vts.utils.python.controllers import adb
 
 from vts.utils.python.common import list_utils
+from vts.utils.python.file import file_sync
 from vts.utils.python.os import path_utils
 
 from vts.testcases.template.llvmfuzzer_test import llvmfuzzer_test_config as config
@@ -69,7 +70,9 @@ class LLVMFuzzerTest(base_test.BaseTestClass):
         """
         push_src = os.path.join(self.data_file_path, config.FUZZER_SRC_DIR,
                                 testcase)
-        self._dut.adb.push("%s %s" % (push_src, config.FUZZER_TEST_DIR))
+        # The directory is created by setUpClass.
+        file_sync.FileSync(self._dut.adb).Push(
+            [(push_src, config.FUZZER_TEST_DIR + "/")])
         logging.info("Adb pushed: %s", testcase)
 
     def CreateFuzzerFlags(self, fuzzer_config):
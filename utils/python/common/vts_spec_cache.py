@@ -0,0 +1,217 @@
+#
+# Copyright (C) 2017 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import collections
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+from vts.proto import ComponentSpecificationMessage_pb2 as CompSpecMsg
+
+from google.protobuf import message
+
+_DEFAULT_CACHE_DIR = os.environ.get(
+    "VTS_SPEC_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "vts_spec_cache"))
+_DEFAULT_MAX_ENTRIES = 256
+_SPEC_FILE_SUFFIX = ".pb"
+
+
+class VtsSpecCache(object):
+    """Caches the component specifications read from a device's agent.
+
+    The specifications only change when the build changes, so they are kept
+    per build fingerprint both in an in-process LRU and on disk as binary
+    serialized ComponentSpecificationMessage files which later test runs on
+    the same build reuse.
+
+    Attributes:
+        _build_fingerprint: string, the fingerprint of the device build.
+        _cache_dir: string, the directory of the build's spec files. None
+                    if the disk cache is disabled.
+        _max_entries: int, the max number of specs kept in memory.
+        _entries: OrderedDict of string to ComponentSpecificationMessage,
+                  the least recently used is first.
+        _lock: Lock, guards _entries and the counters.
+        hit_count: int, the number of specs found in memory or on disk.
+        miss_count: int, the number of specs not in the cache.
+    """
+
+    def __init__(self,
+                 build_fingerprint,
+                 cache_dir=_DEFAULT_CACHE_DIR,
+                 max_entries=_DEFAULT_MAX_ENTRIES):
+        """Initializes the cache.
+
+        Args:
+            build_fingerprint: string, ro.build.fingerprint of the device.
+                               The disk cache is disabled if empty, as
+                               specs of an unknown build cannot be shared.
+            cache_dir: string, the root directory of the disk cache. None to
+                       disable the disk cache.
+            max_entries: int, the max number of specs kept in memory.
+        """
+        self._build_fingerprint = build_fingerprint
+        self._cache_dir = None
+        if cache_dir and build_fingerprint:
+            self._cache_dir = os.path.join(
+                cache_dir,
+                hashlib.sha1(build_fingerprint.encode("utf-8")).hexdigest())
+        self._max_entries = max(1, max_entries)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hit_count = 0
+        self.miss_count = 0
+
+    @staticmethod
+    def GetKey(interface_name, target_version, target_package, recursive):
+        """Returns the cache key of a specification.
+
+        Args:
+            interface_name: string, the name of the interface.
+            target_version: float, the HAL version.
+            target_package: string, the HAL package name.
+            recursive: bool, whether the imported specifications are merged.
+
+        Returns:
+            string, e.g., android.hardware.nfc@1.0::INfc
+        """
+        key = "%s@%s::%s" % (target_package, target_version, interface_name)
+        if recursive:
+            key += "+imports"
+        return key
+
+    def Get(self, key):
+        """Looks up a specification.
+
+        Args:
+            key: string, returned by GetKey.
+
+        Returns:
+            ComponentSpecificationMessage, a copy the caller may modify. None
+            if not cached.
+        """
+        with self._lock:
+            spec = self._entries.pop(key, None)
+            if spec is not None:
+                self._entries[key] = spec
+                self.hit_count += 1
+                return self._Copy(spec)
+
+        spec = self._Load(key)
+        with self._lock:
+            if spec is None:
+                self.miss_count += 1
+                return None
+            self.hit_count += 1
+            self._Insert(key, spec)
+        return self._Copy(spec)
+
+    def Put(self, key, spec):
+        """Caches a specification.
+
+        Args:
+            key: string, returned by GetKey.
+            spec: ComponentSpecificationMessage, the specification. It is
+                  copied so the caller may keep modifying it.
+        """
+        spec = self._Copy(spec)
+        with self._lock:
+            self._Insert(key, spec)
+        self._Store(key, spec)
+
+    def Clear(self):
+        """Drops the in-memory specifications."""
+        with self._lock:
+            self._entries.clear()
+
+    def _Insert(self, key, spec):
+        """Adds a spec to the LRU and evicts the least recently used one.
+
+        The caller must hold _lock.
+        """
+        self._entries.pop(key, None)
+        self._entries[key] = spec
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def _GetPath(self, key):
+        """Returns the path of the spec file of a key."""
+        return os.path.join(
+            self._cache_dir,
+            hashlib.sha1(key.encode("utf-8")).hexdigest() + _SPEC_FILE_SUFFIX)
+
+    def _Load(self, key):
+        """Reads a specification from the disk cache.
+
+        Returns:
+            ComponentSpecificationMessage, None if not found or corrupted.
+        """
+        if not self._cache_dir:
+            return None
+        path = self._GetPath(key)
+        try:
+            with open(path, "rb") as spec_file:
+                data = spec_file.read()
+        except IOError:
+            return None
+        spec = CompSpecMsg.ComponentSpecificationMessage()
+        try:
+            spec.ParseFromString(data)
+        except message.DecodeError as e:
+            logging.warning("Removing corrupted spec cache file %s: %s", path,
+                            e)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return spec
+
+    def _Store(self, key, spec):
+        """Writes a specification to the disk cache.
+
+        The file is renamed into place so concurrent readers, including other
+        test processes, never see a partial file.
+        """
+        if not self._cache_dir:
+            return
+        try:
+            if not os.path.isdir(self._cache_dir):
+                os.makedirs(self._cache_dir)
+        except OSError:
+            # Another process may have created it in the meantime.
+            if not os.path.isdir(self._cache_dir):
+                logging.exception("Cannot create spec cache directory %s",
+                                  self._cache_dir)
+                return
+        path = self._GetPath(key)
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self._cache_dir)
+            with os.fdopen(fd, "wb") as spec_file:
+                spec_file.write(spec.SerializeToString())
+            os.rename(temp_path, path)
+        except (IOError, OSError):
+            logging.exception("Cannot write spec cache file %s", path)
+
+    @staticmethod
+    def _Copy(spec):
+        """Returns a copy of a ComponentSpecificationMessage."""
+        result = CompSpecMsg.ComponentSpecificationMessage()
+        result.CopyFrom(spec)
+        return result
@@ -17,11 +17,19 @@ from builtins import str
 
 import logging
 import random
+import shlex
 import socket
 import subprocess
+import threading
 import time
 
 from vts.runners.host import const
+from vts.utils.python.controllers import adb_socket
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
 
 
 class AdbError(Exception):
@@ -43,6 +51,11 @@ SL4A_LAUNCH_CMD = (
     "--ei com.googlecode.android_scripting.extra.USE_SERVICE_PORT {} "
     "com.googlecode.android_scripting/.activity.ScriptingLayerServiceLauncher")
 
+# The ports returned by get_available_host_port, which are not handed out
+# again until released, even if adb has not started using them yet.
+_reserved_host_ports = set()
+_reserved_host_ports_lock = threading.Lock()
+
 
 def get_available_host_port():
     """Gets a host port number available for adb forward.
@@ -53,8 +66,26 @@ def get_available_host_port():
     """
     while True:
         port = random.randint(1024, 9900)
+        with _reserved_host_ports_lock:
+            if port in _reserved_host_ports:
+                continue
+            _reserved_host_ports.add(port)
         if is_port_available(port):
             return port
+        release_host_port(port)
+
+
+def release_host_port(port):
+    """Lets get_available_host_port hand out a port again.
+
+    A port is released once something on the host uses it, e.g., adb has
+    bound it for a forward, since is_port_available then rejects it anyway.
+
+    Args:
+        port: int, a port returned by get_available_host_port.
+    """
+    with _reserved_host_ports_lock:
+        _reserved_host_ports.discard(port)
 
 
 def is_port_available(port):
@@ -105,6 +136,69 @@ def list_occupied_adb_ports():
     return used_ports
 
 
+# The characters which the host shell interprets in the arguments of an adb
+# command, e.g., the redirection in adb.bugreport(" > file").
+_HOST_SHELL_SPECIAL_CHARS = "|&;<>()$`\\*?~"
+
+
+class _ProcessStream(object):
+    """The stdout of a process, which is waited on when closed.
+
+    Attributes:
+        _proc: subprocess.Popen whose stdout is a pipe.
+    """
+
+    def __init__(self, proc):
+        self._proc = proc
+
+    def close(self):
+        """Closes the pipe and reaps the process."""
+        self._proc.stdout.close()
+        self._proc.wait()
+
+    def __getattr__(self, name):
+        return getattr(self._proc.stdout, name)
+
+
+def _has_host_shell_syntax(arg_str):
+    """Checks if the host shell would do more than split an argument string.
+
+    Args:
+        arg_str: string, the arguments of an adb command.
+
+    Returns:
+        True if arg_str has an unquoted special character or a variable
+        expansion.
+    """
+    quote = None
+    for char in arg_str:
+        if quote == "'":
+            if char == "'":
+                quote = None
+        elif quote == '"':
+            if char == '"':
+                quote = None
+            elif char in "$`\\":
+                return True
+        elif char in "'\"":
+            quote = char
+        elif char in _HOST_SHELL_SPECIAL_CHARS:
+            return True
+    return False
+
+
+def _split_option(args, option):
+    """Removes an option from a list of arguments.
+
+    Returns:
+        True if the option was in the list.
+    """
+    if option in args:
+        args.remove(option)
+        return True
+    return False
+
+
 class AdbProxy():
     """Proxy class for ADB.
 
@@ -113,15 +207,140 @@ class AdbProxy():
     >> adb = AdbProxy(<serial>)
     >> adb.start_server()
     >> adb.devices() # will return the console output of "adb devices".
+
+    shell, exec-out, forward, reverse, push, pull and get-state are sent to
+    the adb server over its socket protocol instead of forking an adb client.
+    The other commands, the ones whose arguments use the host shell, and all
+    commands when the adb server is not running, are run by the adb binary.
     """
 
-    def __init__(self, serial="", log=None):
+    def __init__(self, serial="", log=None, use_server_socket=True):
         self.serial = serial
         if serial:
             self.adb_str = "adb -s {}".format(serial)
         else:
             self.adb_str = "adb"
         self.log = log
+        if use_server_socket:
+            self._server_client = adb_socket.AdbServerClient(serial)
+        else:
+            self._server_client = None
+
+    def _get_result(self, cmd, out, err, ret, no_except):
+        """Returns the result of an adb command.
+
+        Args:
+            cmd: string, the adb command.
+            out: bytes, the stdout.
+            err: bytes, the stderr.
+            ret: int, the exit code.
+            no_except: bool, controls whether exception can be thrown.
+
+        Returns:
+            the same as _exec_cmd.
+
+        Raises:
+            AdbError if the exit code is not 0 and exceptions are allowed.
+        """
+        logging.debug("cmd: %s, stdout: %s, stderr: %s, ret: %s", cmd, out,
+                      err, ret)
+        if no_except:
+            return {
+                const.STDOUT: out,
+                const.STDERR: err,
+                const.EXIT_CODE: ret,
+            }
+        else:
+            if ret == 0:
+                return out
+            else:
+                raise AdbError(cmd=cmd, stdout=out, stderr=err, ret_code=ret)
+
+    def _exec_server_cmd(self, name, arg_str, no_except=False):
+        """Executes an adb command through the adb server.
+
+        Args:
+            name: string, the adb command, e.g., shell.
+            arg_str: string, the arguments of the command.
+            no_except: bool, controls whether exception can be thrown.
+
+        Returns:
+            the same as _exec_cmd.
+
+        Raises:
+            AdbError if the adb command fails and exceptions are allowed.
+            adb_socket.AdbSocketUnsupportedError if the command has to be run
+            by the adb binary.
+        """
+        handler = self._SERVER_COMMANDS.get(name)
+        if not handler or _has_host_shell_syntax(arg_str):
+            raise adb_socket.AdbSocketUnsupportedError(name)
+        cmd = " ".join((self.adb_str, name, arg_str))
+        try:
+            out, err, ret = handler(self, shlex.split(arg_str))
+        except (adb_socket.AdbSocketError, IOError, OSError) as e:
+            out, err, ret = b"", str(e).encode("utf-8"), 1
+        return self._get_result(cmd, out, err, ret, no_except)
+
+    def _server_shell(self, args):
+        if not args or args[0].startswith("-"):
+            raise adb_socket.AdbSocketUnsupportedError("shell options")
+        return self._server_client.shell(" ".join(args))
+
+    def _server_exec_out(self, args):
+        if not args:
+            raise adb_socket.AdbSocketUnsupportedError("exec-out")
+        return self._server_client.exec_out(" ".join(args)), b"", 0
+
+    def _server_forward(self, args, reverse=False):
+        client = self._server_client
+        no_rebind = _split_option(args, "--no-rebind")
+        if args == ["--list"]:
+            if reverse:
+                return client.list_reverse(), b"", 0
+            return client.list_forward(), b"", 0
+        if args == ["--remove-all"]:
+            (client.kill_reverse if reverse else client.kill_forward)()
+        elif len(args) == 2 and args[0] == "--remove":
+            (client.kill_reverse if reverse else client.kill_forward)(args[1])
+        elif len(args) == 2 and not args[0].startswith("-"):
+            (client.reverse if reverse else client.forward)(
+                args[0], args[1], no_rebind=no_rebind)
+        else:
+            raise adb_socket.AdbSocketUnsupportedError("forward options")
+        return b"", b"", 0
+
+    def _server_reverse(self, args):
+        return self._server_forward(args, reverse=True)
+
+    def _server_push(self, args):
+        if len(args) < 2 or any(arg.startswith("-") for arg in args):
+            raise adb_socket.AdbSocketUnsupportedError("push options")
+        count = self._server_client.push(args[:-1], args[-1])
+        return ("%d file(s) pushed.\n" % count).encode("utf-8"), b"", 0
+
+    def _server_pull(self, args):
+        if not args or any(arg.startswith("-") for arg in args):
+            raise adb_socket.AdbSocketUnsupportedError("pull options")
+        if len(args) == 1:
+            args.append(".")
+        count = self._server_client.pull(args[:-1], args[-1])
+        return ("%d file(s) pulled.\n" % count).encode("utf-8"), b"", 0
+
+    def _server_get_state(self, args):
+        if args:
+            raise adb_socket.AdbSocketUnsupportedError("get-state")
+        return (self._server_client.get_state() + "\n").encode("utf-8"), b"", 0
+
+    _SERVER_COMMANDS = {
+        "shell": _server_shell,
+        "exec-out": _server_exec_out,
+        "forward": _server_forward,
+        "reverse": _server_reverse,
+        "push": _server_push,
+        "pull": _server_pull,
+        "get-state": _server_get_state,
+    }
 
     def _exec_cmd(self, cmd, no_except=False):
         """Executes adb commands in a new shell.
@@ -147,20 +366,57 @@ class AdbProxy():
                                 stderr=subprocess.PIPE,
                                 shell=True)
         (out, err) = proc.communicate()
-        ret = proc.returncode
-        logging.debug("cmd: %s, stdout: %s, stderr: %s, ret: %s", cmd, out,
-                      err, ret)
-        if no_except:
-            return {
-                const.STDOUT: out,
-                const.STDERR: err,
-                const.EXIT_CODE: ret,
-            }
-        else:
-            if ret == 0:
-                return out
-            else:
-                raise AdbError(cmd=cmd, stdout=out, stderr=err, ret_code=ret)
+        return self._get_result(cmd, out, err, proc.returncode, no_except)
+
+    def push_files(self, file_pairs):
+        """Pushes files to exact device paths.
+
+        The files are streamed over one sync connection to the adb server, or
+        pushed one at a time by the adb binary if the server cannot be used.
+
+        Args:
+            file_pairs: list of (host file, device file) tuples.
+
+        Raises:
+            AdbError if a push fails.
+        """
+        if self._server_client:
+            try:
+                self._server_client.push_files(file_pairs)
+                return
+            except adb_socket.AdbSocketUnsupportedError as e:
+                logging.debug("files are pushed by the adb binary: %s", e)
+            except (adb_socket.AdbSocketError, IOError, OSError) as e:
+                raise AdbError(cmd="%s push" % self.adb_str, stdout=b"",
+                               stderr=str(e).encode("utf-8"), ret_code=1)
+        for local_path, remote_path in file_pairs:
+            self._exec_cmd(" ".join((self.adb_str, "push", quote(local_path),
+                                     quote(remote_path))))
+
+    def open_exec_out(self, command):
+        """Runs a device command and streams its raw stdout.
+
+        Args:
+            command: string, the device shell command line.
+
+        Returns:
+            a binary file object, which the caller reads as the command
+            writes and closes when done.
+        """
+        if self._server_client:
+            try:
+                return self._server_client.open_exec_out(command)
+            except adb_socket.AdbSocketUnsupportedError as e:
+                logging.debug("exec-out is run by the adb binary: %s", e)
+            except adb_socket.AdbSocketError as e:
+                raise AdbError(cmd="%s exec-out %s" % (self.adb_str, command),
+                               stdout=b"", stderr=str(e).encode("utf-8"),
+                               ret_code=1)
+        proc = subprocess.Popen(
+            " ".join((self.adb_str, "exec-out", quote(command))),
+            stdout=subprocess.PIPE,
+            shell=True)
+        return _ProcessStream(proc)
 
     def tcp_forward(self, host_port, device_port):
         """Starts TCP forwarding.
@@ -169,7 +425,10 @@ class AdbProxy():
             host_port: Port number to use on the computer.
             device_port: Port number to use on the android device.
         """
-        self.forward("tcp:{} tcp:{}".format(host_port, device_port))
+        try:
+            self.forward("tcp:{} tcp:{}".format(host_port, device_port))
+        finally:
+            release_host_port(host_port)
 
     def reverse_tcp_forward(self, device_port, host_port):
         """Starts reverse TCP forwarding.
@@ -185,6 +444,12 @@ class AdbProxy():
         def adb_call(*args, **kwargs):
             clean_name = name.replace('_', '-')
             arg_str = ' '.join(str(elem) for elem in args)
+            if self._server_client:
+                try:
+                    return self._exec_server_cmd(clean_name, arg_str, kwargs)
+                except adb_socket.AdbSocketUnsupportedError as e:
+                    logging.debug("adb %s is run by the adb binary: %s",
+                                  clean_name, e)
             return self._exec_cmd(' '.join((self.adb_str, clean_name, arg_str)),
                                   kwargs)
 
@@ -0,0 +1,538 @@
+#
+#   Copyright 2017 - The Android Open Source Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+"""Client of the adb server's smart-socket protocol.
+
+Instead of forking an adb client per command, the requests are sent to the
+adb server, which listens on localhost:5037 by default:
+
+    <4 hex digits of the length><request>
+
+and replies with OKAY, or FAIL followed by a length-prefixed message. A
+host:transport:<serial> request switches the connection to a device, whose
+services are then requested the same way, e.g., shell,v2,raw:<command>,
+exec:<command> or sync:.
+
+The server closes a connection after most requests, so a new one is opened
+per command. The sync connection stays open across pushes and pulls.
+"""
+
+import logging
+import os
+import posixpath
+import socket
+import stat
+import struct
+import threading
+import time
+
+ADB_SERVER_HOST = "127.0.0.1"
+ADB_SERVER_PORT = int(os.environ.get("ANDROID_ADB_SERVER_PORT", 5037))
+
+# The IDs of the shell protocol v2 packets.
+_SHELL_ID_STDIN = 0
+_SHELL_ID_STDOUT = 1
+_SHELL_ID_STDERR = 2
+_SHELL_ID_EXIT = 3
+_SHELL_ID_CLOSE_STDIN = 4
+
+# The maximum size of a sync DATA packet.
+_SYNC_DATA_MAX = 64 * 1024
+# The maximum length of a request, whose length is sent as 4 hex digits.
+_MAX_REQUEST_LENGTH = 0xffff
+
+
+class AdbSocketError(Exception):
+    """Raised when the adb server or the device fails a request."""
+
+
+class AdbSocketUnsupportedError(Exception):
+    """Raised when a command cannot be run through the adb server.
+
+    Nothing has been run on the device, so the command can be run by the
+    adb binary instead.
+    """
+
+
+def _recv_exactly(sock, size):
+    """Receives exactly size bytes.
+
+    Raises:
+        AdbSocketError if the connection is closed first.
+    """
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1024 * 1024))
+        if not chunk:
+            raise AdbSocketError("connection closed by the adb server")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _recv_until_closed(sock):
+    """Receives until the other end closes the connection."""
+    chunks = []
+    while True:
+        chunk = sock.recv(1024 * 1024)
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+
+def _to_str(data):
+    """Decodes bytes received from the adb server."""
+    return data.decode("utf-8", "replace")
+
+
+class AdbServerClient(object):
+    """Runs the commands of one device through the adb server.
+
+    Attributes:
+        serial: string, the serial of the device. Any device if empty.
+        _address: tuple of the host and the port of the adb server.
+        _features: list of strings, the features the device and the server
+                   support. Read by the first shell command.
+        _sync_sock: socket, the open sync connection, None if there is none.
+        _sync_lock: Lock, guards _sync_sock.
+    """
+
+    def __init__(self, serial="", host=ADB_SERVER_HOST, port=ADB_SERVER_PORT):
+        self.serial = serial
+        self._address = (host, port)
+        self._features = None
+        self._sync_sock = None
+        self._sync_lock = threading.Lock()
+
+    def _connect(self):
+        """Opens a connection to the adb server.
+
+        Raises:
+            AdbSocketUnsupportedError if the server is not running; the adb
+            binary starts it.
+        """
+        try:
+            return socket.create_connection(self._address)
+        except socket.error as e:
+            raise AdbSocketUnsupportedError("adb server at %s:%s: %s" %
+                                            (self._address + (e, )))
+
+    @staticmethod
+    def _send_request(sock, request):
+        """Sends a request and reads its status.
+
+        Raises:
+            AdbSocketError if the request is too long or fails.
+        """
+        request = request.encode("utf-8")
+        if len(request) > _MAX_REQUEST_LENGTH:
+            raise AdbSocketError("adb request of %d bytes exceeds %d bytes" %
+                                 (len(request), _MAX_REQUEST_LENGTH))
+        sock.sendall(("%04x" % len(request)).encode("ascii") + request)
+        AdbServerClient._read_status(sock)
+
+    @staticmethod
+    def _read_status(sock):
+        """Reads OKAY, or raises AdbSocketError with the FAIL message."""
+        status = _recv_exactly(sock, 4)
+        if status == b"OKAY":
+            return
+        if status == b"FAIL":
+            raise AdbSocketError(_to_str(AdbServerClient._read_payload(sock)))
+        raise AdbSocketError("unexpected adb status %r" % status)
+
+    @staticmethod
+    def _read_payload(sock):
+        """Reads a payload prefixed by 4 hex digits of its length."""
+        return _recv_exactly(sock, int(_recv_exactly(sock, 4), 16))
+
+    def _host_prefix(self):
+        """Returns the prefix of the host requests about the device."""
+        if self.serial:
+            return "host-serial:%s:" % self.serial
+        return "host:"
+
+    def _host_query(self, query):
+        """Sends a host request which returns a payload.
+
+        Args:
+            query: string, e.g., features.
+
+        Returns:
+            bytes, the payload.
+        """
+        sock = self._connect()
+        try:
+            self._send_request(sock, self._host_prefix() + query)
+            return self._read_payload(sock)
+        finally:
+            sock.close()
+
+    def _host_command(self, command):
+        """Sends a host request which replies a second status when done,
+        e.g., forward:tcp:1;tcp:2."""
+        sock = self._connect()
+        try:
+            self._send_request(sock, self._host_prefix() + command)
+            self._read_status(sock)
+        finally:
+            sock.close()
+
+    def _open_service(self, service):
+        """Opens a connection to a device service.
+
+        Args:
+            service: string, e.g., exec:ls.
+
+        Returns:
+            socket, connected to the service.
+        """
+        sock = self._connect()
+        try:
+            if self.serial:
+                self._send_request(sock, "host:transport:%s" % self.serial)
+            else:
+                self._send_request(sock, "host:transport-any")
+            self._send_request(sock, service)
+        except:
+            sock.close()
+            raise
+        return sock
+
+    def get_features(self):
+        """Returns the features shared by the device and the server."""
+        if self._features is None:
+            self._features = _to_str(self._host_query("features")).split(",")
+        return self._features
+
+    def get_state(self):
+        """Returns the state of the device, e.g., device."""
+        return _to_str(self._host_query("get-state"))
+
+    def shell(self, command):
+        """Runs a shell command on the device.
+
+        Args:
+            command: string, the command line.
+
+        Returns:
+            a tuple of the stdout, the stderr and the exit code.
+
+        Raises:
+            AdbSocketUnsupportedError if the device does not support the
+            shell protocol, which reports the exit code.
+        """
+        if "shell_v2" not in self.get_features():
+            raise AdbSocketUnsupportedError("shell_v2 is not supported")
+        sock = self._open_service("shell,v2,raw:%s" % command)
+        try:
+            sock.sendall(struct.pack("<BI", _SHELL_ID_CLOSE_STDIN, 0))
+            stdout = []
+            stderr = []
+            exit_code = None
+            while exit_code is None:
+                header = sock.recv(5)
+                if not header:
+                    raise AdbSocketError("shell closed without exit code")
+                if len(header) < 5:
+                    header += _recv_exactly(sock, 5 - len(header))
+                packet_id, length = struct.unpack("<BI", header)
+                data = _recv_exactly(sock, length)
+                if packet_id == _SHELL_ID_STDOUT:
+                    stdout.append(data)
+                elif packet_id == _SHELL_ID_STDERR:
+                    stderr.append(data)
+                elif packet_id == _SHELL_ID_EXIT:
+                    exit_code = ord(data[:1])
+        finally:
+            sock.close()
+        return b"".join(stdout), b"".join(stderr), exit_code
+
+    def exec_out(self, command):
+        """Runs a command and returns its raw stdout, e.g., a tar stream.
+
+        Args:
+            command: string, the command line.
+
+        Returns:
+            bytes, the stdout.
+        """
+        sock = self._open_service("exec:%s" % command)
+        try:
+            return _recv_until_closed(sock)
+        finally:
+            sock.close()
+
+    def open_exec_out(self, command):
+        """Runs a command and returns a file object of its raw stdout.
+
+        Args:
+            command: string, the command line.
+
+        Returns:
+            a binary file object, which the caller closes.
+        """
+        sock = self._open_service("exec:%s" % command)
+        stream = sock.makefile("rb")
+        # The connection stays open until the file object is closed.
+        sock.close()
+        return stream
+
+    def forward(self, local, remote, no_rebind=False):
+        """Forwards a host socket to a device socket, e.g., tcp:5000."""
+        self._host_command("forward:%s%s;%s" %
+                           ("norebind:" if no_rebind else "", local, remote))
+
+    def kill_forward(self, local=None):
+        """Removes a forward, or all of them if local is None."""
+        if local is None:
+            self._host_command("killforward-all")
+        else:
+            self._host_command("killforward:%s" % local)
+
+    def list_forward(self):
+        """Returns the forwards as "adb forward --list" prints them."""
+        sock = self._connect()
+        try:
+            self._send_request(sock, "host:list-forward")
+            return self._read_payload(sock)
+        finally:
+            sock.close()
+
+    def reverse(self, remote, local, no_rebind=False):
+        """Forwards a device socket to a host socket."""
+        self._reverse_command("forward:%s%s;%s" %
+                              ("norebind:" if no_rebind else "", remote,
+                               local))
+
+    def kill_reverse(self, remote=None):
+        """Removes a reverse forward, or all of them if remote is None."""
+        if remote is None:
+            self._reverse_command("killforward-all")
+        else:
+            self._reverse_command("killforward:%s" % remote)
+
+    def list_reverse(self):
+        """Returns the reverse forwards as "adb reverse --list" prints them."""
+        sock = self._open_service("reverse:list-forward")
+        try:
+            self._read_status(sock)
+            return self._read_payload(sock)
+        finally:
+            sock.close()
+
+    def _reverse_command(self, command):
+        sock = self._open_service("reverse:%s" % command)
+        try:
+            self._read_status(sock)
+        finally:
+            sock.close()
+
+    def _sync_request(self, sock, sync_id, path):
+        """Sends a sync request with a path."""
+        path = path.encode("utf-8")
+        sock.sendall(sync_id + struct.pack("<I", len(path)) + path)
+
+    def _sync_stat(self, sock, path):
+        """Returns the mode of a device path, 0 if it does not exist."""
+        self._sync_request(sock, b"STAT", path)
+        response = _recv_exactly(sock, 16)
+        if response[:4] != b"STAT":
+            raise AdbSocketError("unexpected sync response %r" % response[:4])
+        return struct.unpack("<I", response[4:8])[0]
+
+    def _sync_list(self, sock, path):
+        """Returns the (name, mode) of the entries of a device directory."""
+        self._sync_request(sock, b"LIST", path)
+        entries = []
+        while True:
+            response = _recv_exactly(sock, 20)
+            sync_id = response[:4]
+            if sync_id == b"DONE":
+                return entries
+            if sync_id != b"DENT":
+                raise AdbSocketError("unexpected sync response %r" % sync_id)
+            mode, _, _, name_length = struct.unpack("<IIII", response[4:])
+            name = _to_str(_recv_exactly(sock, name_length))
+            if name not in (".", ".."):
+                entries.append((name, mode))
+
+    def _sync_fail(self, sock, response):
+        """Raises AdbSocketError for a FAIL or an unexpected sync response."""
+        if response[:4] == b"FAIL":
+            length = struct.unpack("<I", response[4:8])[0]
+            raise AdbSocketError(_to_str(_recv_exactly(sock, length)))
+        raise AdbSocketError("unexpected sync response %r" % response[:4])
+
+    def _sync_recv(self, sock, remote_path, local_path):
+        """Pulls a device file."""
+        self._sync_request(sock, b"RECV", remote_path)
+        with open(local_path, "wb") as local_file:
+            while True:
+                response = _recv_exactly(sock, 8)
+                if response[:4] == b"DATA":
+                    length = struct.unpack("<I", response[4:8])[0]
+                    local_file.write(_recv_exactly(sock, length))
+                elif response[:4] == b"DONE":
+                    return
+                else:
+                    self._sync_fail(sock, response)
+
+    def _sync_send(self, sock, local_path, remote_path):
+        """Pushes a host file. The device creates the parent directories."""
+        mode = stat.S_IFREG | stat.S_IMODE(os.stat(local_path).st_mode)
+        self._sync_request(sock, b"SEND", "%s,%d" % (remote_path, mode))
+        with open(local_path, "rb") as local_file:
+            while True:
+                data = local_file.read(_SYNC_DATA_MAX)
+                if not data:
+                    break
+                sock.sendall(b"DATA" + struct.pack("<I", len(data)) + data)
+        sock.sendall(b"DONE" + struct.pack("<I", int(time.time())))
+        response = _recv_exactly(sock, 8)
+        if response[:4] != b"OKAY":
+            self._sync_fail(sock, response)
+
+    def _run_sync(self, function, *args):
+        """Runs a function with the sync connection, which is opened if
+        needed and closed if the function fails."""
+        with self._sync_lock:
+            if self._sync_sock is None:
+                self._sync_sock = self._open_service("sync:")
+            try:
+                return function(self._sync_sock, *args)
+            except:
+                self._close_sync()
+                raise
+
+    def _close_sync(self):
+        if self._sync_sock is not None:
+            try:
+                self._sync_sock.sendall(b"QUIT" + struct.pack("<I", 0))
+            except socket.error:
+                pass
+            self._sync_sock.close()
+            self._sync_sock = None
+
+    def close(self):
+        """Closes the sync connection."""
+        with self._sync_lock:
+            self._close_sync()
+
+    def stat(self, remote_path):
+        """Returns the mode of a device path, 0 if it does not exist."""
+        return self._run_sync(self._sync_stat, remote_path)
+
+    def pull(self, remote_paths, local_path):
+        """Pulls device files or directories like "adb pull" does.
+
+        Args:
+            remote_paths: list of strings, the device paths.
+            local_path: string, the host file or directory.
+
+        Returns:
+            integer, the number of pulled files.
+        """
+        return self._run_sync(self._sync_pull, remote_paths, local_path)
+
+    def _sync_pull(self, sock, remote_paths, local_path):
+        local_is_dir = os.path.isdir(local_path)
+        if len(remote_paths) > 1 and not local_is_dir:
+            raise AdbSocketError("target '%s' is not a directory" % local_path)
+        count = 0
+        for remote_path in remote_paths:
+            mode = self._sync_stat(sock, remote_path)
+            if not mode:
+                raise AdbSocketError(
+                    "remote object '%s' does not exist" % remote_path)
+            destination = local_path
+            if local_is_dir:
+                destination = os.path.join(
+                    local_path, posixpath.basename(remote_path.rstrip("/")))
+            if stat.S_ISDIR(mode):
+                count += self._sync_pull_dir(sock, remote_path, destination)
+            else:
+                self._sync_recv(sock, remote_path, destination)
+                count += 1
+        return count
+
+    def _sync_pull_dir(self, sock, remote_dir, local_dir):
+        if not os.path.isdir(local_dir):
+            os.makedirs(local_dir)
+        count = 0
+        for name, mode in self._sync_list(sock, remote_dir):
+            remote_path = posixpath.join(remote_dir, name)
+            local_path = os.path.join(local_dir, name)
+            if stat.S_ISDIR(mode):
+                count += self._sync_pull_dir(sock, remote_path, local_path)
+            elif stat.S_ISREG(mode):
+                self._sync_recv(sock, remote_path, local_path)
+                count += 1
+        return count
+
+    def push(self, local_paths, remote_path):
+        """Pushes host files or directories like "adb push" does.
+
+        Args:
+            local_paths: list of strings, the host paths.
+            remote_path: string, the device file or directory.
+
+        Returns:
+            integer, the number of pushed files.
+        """
+        return self._run_sync(self._sync_push, local_paths, remote_path)
+
+    def push_files(self, file_pairs):
+        """Pushes host files to device paths over one sync stream.
+
+        Args:
+            file_pairs: list of (host file, device file) tuples.
+        """
+        def _send_all(sock):
+            for local_path, remote_path in file_pairs:
+                self._sync_send(sock, local_path, remote_path)
+
+        self._run_sync(_send_all)
+
+    def _sync_push(self, sock, local_paths, remote_path):
+        remote_is_dir = (remote_path.endswith("/") or
+                         stat.S_ISDIR(self._sync_stat(sock, remote_path)))
+        if len(local_paths) > 1 and not remote_is_dir:
+            raise AdbSocketError("target '%s' is not a directory" %
+                                 remote_path)
+        count = 0
+        for local_path in local_paths:
+            if not os.path.exists(local_path):
+                raise AdbSocketError(
+                    "cannot stat '%s': No such file or directory" % local_path)
+            destination = remote_path
+            if remote_is_dir:
+                destination = posixpath.normpath(
+                    posixpath.join(remote_path,
+                                   os.path.basename(local_path.rstrip("/"))))
+            if os.path.isdir(local_path):
+                for root, _, files in os.walk(local_path):
+                    relative_root = os.path.relpath(root, local_path)
+                    for name in files:
+                        self._sync_send(
+                            sock, os.path.join(root, name),
+                            posixpath.normpath(
+                                posixpath.join(destination, relative_root,
+                                               name)))
+                        count += 1
+            else:
+                self._sync_send(sock, local_path, destination)
+                count += 1
+        logging.debug("pushed %d files to %s", count, remote_path)
+        return count
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+#
+#   Copyright 2017 - The Android Open Source Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import shutil
+import socket
+import struct
+import subprocess
+import tempfile
+import threading
+import unittest
+
+from vts.runners.host import const
+from vts.utils.python.controllers import adb
+from vts.utils.python.controllers import adb_socket
+
+_SERIAL = "fake_serial"
+
+
+def _recv_exactly(conn, size):
+    data = b""
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise EOFError()
+        data += chunk
+    return data
+
+
+class FakeAdbServer(object):
+    """An adb server with one device whose file system is a host directory.
+
+    Shell commands are run by the host's /bin/sh in that directory.
+
+    Attributes:
+        port: int, the port the server listens on.
+        root: string, the host directory which is the device's /.
+        forwards: list of (local, remote) tuples.
+    """
+
+    def __init__(self, features="shell_v2,cmd"):
+        self.root = tempfile.mkdtemp()
+        self.forwards = []
+        self._features = features
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.bind(("127.0.0.1", 0))
+        self._sock.listen(5)
+        self.port = self._sock.getsockname()[1]
+        self._thread = threading.Thread(target=self._Serve)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def Stop(self):
+        self._sock.close()
+        shutil.rmtree(self.root)
+
+    def _Serve(self):
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except socket.error:
+                return
+            threading.Thread(target=self._Handle, args=(conn, )).start()
+
+    def _Path(self, path):
+        return os.path.join(self.root, path.decode("utf-8").lstrip("/"))
+
+    def _Reply(self, conn, payload=None):
+        conn.sendall(b"OKAY")
+        if payload is not None:
+            conn.sendall(("%04x" % len(payload)).encode("ascii") + payload)
+
+    def _Handle(self, conn):
+        try:
+            while True:
+                length = int(_recv_exactly(conn, 4), 16)
+                request = _recv_exactly(conn, length).decode("utf-8")
+                if request.startswith("host-serial:%s:" % _SERIAL):
+                    request = "host:" + request[len(_SERIAL) + 13:]
+                if request == "host:features":
+                    self._Reply(conn, self._features.encode("utf-8"))
+                elif request.startswith("host:forward:"):
+                    local, remote = request[len("host:forward:"):].split(";")
+                    self.forwards.append((local, remote))
+                    self._Reply(conn)
+                    self._Reply(conn)
+                elif request == "host:list-forward":
+                    self._Reply(conn, b"".join(
+                        ("%s %s %s\n" % (_SERIAL, local, remote)).encode(
+                            "utf-8") for local, remote in self.forwards))
+                elif request == "host:transport:%s" % _SERIAL:
+                    self._Reply(conn)
+                    continue
+                elif request.startswith("shell,v2,raw:"):
+                    self._Reply(conn)
+                    self._Shell(conn, request[len("shell,v2,raw:"):])
+                elif request.startswith("exec:"):
+                    self._Reply(conn)
+                    conn.sendall(subprocess.check_output(
+                        request[len("exec:"):], shell=True, cwd=self.root))
+                elif request == "sync:":
+                    self._Reply(conn)
+                    self._Sync(conn)
+                else:
+                    message = b"unknown request"
+                    conn.sendall(b"FAIL" + (
+                        "%04x" % len(message)).encode("ascii") + message)
+                return
+        except EOFError:
+            pass
+        finally:
+            conn.close()
+
+    def _Shell(self, conn, command):
+        # The client closes the stdin first.
+        _recv_exactly(conn, 5)
+        proc = subprocess.Popen(command, shell=True, cwd=self.root,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        for packet_id, data in ((1, out), (2, err),
+                                (3, struct.pack("B", proc.returncode))):
+            conn.sendall(struct.pack("<BI", packet_id, len(data)) + data)
+
+    def _Sync(self, conn):
+        while True:
+            sync_id, length = struct.unpack("<4sI", _recv_exactly(conn, 8))
+            if sync_id == b"QUIT":
+                return
+            argument = _recv_exactly(conn, length)
+            if sync_id == b"STAT":
+                try:
+                    mode = os.stat(self._Path(argument)).st_mode
+                except OSError:
+                    mode = 0
+                conn.sendall(b"STAT" + struct.pack("<III", mode, 0, 0))
+            elif sync_id == b"LIST":
+                path = self._Path(argument)
+                for name in os.listdir(path):
+                    mode = os.stat(os.path.join(path, name)).st_mode
+                    name = name.encode("utf-8")
+                    conn.sendall(b"DENT" + struct.pack(
+                        "<IIII", mode, 0, 0, len(name)) + name)
+                conn.sendall(b"DONE" + struct.pack("<IIII", 0, 0, 0, 0))
+            elif sync_id == b"RECV":
+                with open(self._Path(argument), "rb") as device_file:
+                    data = device_file.read()
+                conn.sendall(b"DATA" + struct.pack("<I", len(data)) + data)
+                conn.sendall(b"DONE" + struct.pack("<I", 0))
+            elif sync_id == b"SEND":
+                path = self._Path(argument.rsplit(b",", 1)[0])
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                with open(path, "wb") as device_file:
+                    while True:
+                        data_id, length = struct.unpack(
+                            "<4sI", _recv_exactly(conn, 8))
+                        if data_id == b"DONE":
+                            break
+                        device_file.write(_recv_exactly(conn, length))
+                conn.sendall(b"OKAY" + struct.pack("<I", 0))
+
+
+class AdbSocketTest(unittest.TestCase):
+    """Tests AdbProxy with the socket backend against FakeAdbServer."""
+
+    def setUp(self):
+        self._server = FakeAdbServer()
+        self._adb = adb.AdbProxy(_SERIAL)
+        self._adb._server_client = adb_socket.AdbServerClient(
+            _SERIAL, port=self._server.port)
+        self._host_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self._adb._server_client.close()
+        self._server.Stop()
+        shutil.rmtree(self._host_dir)
+
+    def testShell(self):
+        """Tests the output and the exit code of shell commands."""
+        # Like adb, the arguments are joined by spaces.
+        self.assertEqual(self._adb.shell("echo", "'a  b'"), b"a b\n")
+        results = self._adb.shell("exit 3", no_except=True)
+        self.assertEqual(results[const.EXIT_CODE], 3)
+        with self.assertRaises(adb.AdbError):
+            self._adb.shell("false")
+
+    def testRequestTooLong(self):
+        """Tests that a request whose length needs 5 hex digits is refused
+        before it is sent."""
+        with self.assertRaises(adb_socket.AdbSocketError):
+            self._adb._server_client.shell("echo " + "a" * 0x10000)
+        self.assertEqual(self._adb.shell("echo b"), b"b\n")
+
+    def testForward(self):
+        """Tests adding and listing forwards."""
+        self._adb.tcp_forward(5000, 6000)
+        self.assertEqual(self._adb.forward("--list"),
+                         b"fake_serial tcp:5000 tcp:6000\n")
+
+    def testPushAndPull(self):
+        """Tests pushing a directory and pulling it back."""
+        source = os.path.join(self._host_dir, "source")
+        os.makedirs(os.path.join(source, "sub"))
+        with open(os.path.join(source, "sub", "a.txt"), "w") as host_file:
+            host_file.write("content")
+        self._adb.push(source, "/data/local/tmp/")
+        self.assertTrue(
+            os.path.isfile(
+                os.path.join(self._server.root,
+                             "data/local/tmp/source/sub/a.txt")))
+
+        destination = os.path.join(self._host_dir, "pulled")
+        self._adb.pull("/data/local/tmp/source", destination)
+        with open(os.path.join(destination, "sub", "a.txt")) as host_file:
+            self.assertEqual(host_file.read(), "content")
+
+    def testPullMissingFile(self):
+        """Tests that a failed pull raises AdbError."""
+        with self.assertRaises(adb.AdbError):
+            self._adb.pull("/missing", self._host_dir)
+
+    def testUnsupportedShell(self):
+        """Tests that a device without shell_v2 is left to the adb binary."""
+        self._server._features = "cmd"
+        with self.assertRaises(adb_socket.AdbSocketUnsupportedError):
+            self._adb._exec_server_cmd("shell", "ls")
+
+    def testHostShellSyntax(self):
+        """Tests which arguments need the host shell."""
+        self.assertTrue(adb._has_host_shell_syntax(" > /tmp/bugreport.txt"))
+        self.assertTrue(adb._has_host_shell_syntax("ls $HOME"))
+        self.assertFalse(adb._has_host_shell_syntax('"ls 2> /dev/null"'))
+        self.assertFalse(adb._has_host_shell_syntax("setprop a 'b c'"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -16,6 +16,7 @@
 from builtins import str
 from builtins import open
 
+import concurrent.futures
 import logging
 import os
 import time
@@ -28,16 +29,24 @@ from vts.runners.host import logger as vts_logger
 from vts.runners.host import signals
 from vts.runners.host import utils
 from vts.utils.python.controllers import adb
+from vts.utils.python.controllers import device_facts
 from vts.utils.python.controllers import event_dispatcher
 from vts.utils.python.controllers import fastboot
 from vts.utils.python.controllers import sl4a_client
 from vts.runners.host.tcp_client import vts_tcp_client
+from vts.runners.host.tcp_client import vts_tcp_client_pool
+from vts.utils.python.common import vts_spec_cache
 from vts.utils.python.mirror import hal_mirror
 from vts.utils.python.mirror import shell_mirror
 from vts.utils.python.mirror import lib_mirror
 from vts.runners.host import errors
 import subprocess
 
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
 VTS_CONTROLLER_CONFIG_NAME = "AndroidDevice"
 VTS_CONTROLLER_REFERENCE_NAME = "android_devices"
 
@@ -56,6 +65,8 @@ DEFAULT_AGENT_BASE_DIR = "/data/local/tmp"
 THREAD_SLEEP_TIME = 1
 # Max number of attempts that the client can make to connect to the agent
 MAX_AGENT_CONNECT_RETRIES = 10
+# Max number of devices which are brought up at the same time
+MAX_PARALLEL_DEVICES = 8
 
 class AndroidDeviceError(signals.ControllerError):
     pass
@@ -110,22 +121,76 @@ def destroy(ads):
 def _startServicesOnAds(ads):
     """Starts long running services on multiple AndroidDevice objects.
 
-    If any one AndroidDevice object fails to start services, cleans up all
-    existing AndroidDevice objects and their services.
+    The services of different devices are started concurrently. If any one
+    AndroidDevice object fails to start services, cleans up all existing
+    AndroidDevice objects and their services.
 
     Args:
         ads: A list of AndroidDevice objects whose services to start.
     """
-    running_ads = []
-    for ad in ads:
-        running_ads.append(ad)
+    def _startServices(ad):
         try:
             ad.startServices()
         except:
             ad.log.exception("Failed to start some services, abort!")
-            destroy(running_ads)
             raise
 
+    try:
+        _runOnDevices(_startServices, ads, "startServices",
+                      lambda ad: ad.serial)
+    except:
+        destroy(ads)
+        raise
+
+
+def _runOnDevices(func, args, phase, get_serial=str):
+    """Runs a bring-up phase for multiple devices concurrently.
+
+    At most MAX_PARALLEL_DEVICES calls run at the same time. The time taken
+    by each call is logged.
+
+    Args:
+        func: function which takes one element of args.
+        args: list, one element per device.
+        phase: string, the name of the phase in the logs.
+        get_serial: function which returns the serial of an element of args.
+
+    Returns:
+        A list of the return values of func, in the order of args.
+
+    Raises:
+        The exception raised by the first failed call in the order of args,
+        after all calls have finished. The AndroidDevice objects returned by
+        the successful calls are destroyed before that.
+    """
+
+    def _timedCall(arg):
+        start_time = time.time()
+        try:
+            return func(arg)
+        finally:
+            logging.info("%s: %s took %.1f seconds", get_serial(arg), phase,
+                         time.time() - start_time)
+
+    if not args:
+        return []
+    start_time = time.time()
+    max_workers = min(len(args), MAX_PARALLEL_DEVICES)
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers) as executor:
+        futures = [executor.submit(_timedCall, arg) for arg in args]
+    logging.info("%s on %d devices took %.1f seconds", phase, len(args),
+                 time.time() - start_time)
+    failed = [future for future in futures if future.exception() is not None]
+    if failed:
+        destroy([
+            future.result() for future in futures
+            if future.exception() is None and
+            isinstance(future.result(), AndroidDevice)
+        ])
+        failed[0].result()
+    return [future.result() for future in futures]
+
 
 def _parse_device_list(device_list_str, key):
     """Parses a byte string representing a list of devices. The string is
@@ -171,22 +236,24 @@ def list_fastboot_devices():
 def get_instances(serials):
     """Create AndroidDevice instances from a list of serials.
 
+    The instances are created concurrently. If any one fails, the others are
+    cleaned up.
+
     Args:
         serials: A list of android device serials.
 
     Returns:
         A list of AndroidDevice objects.
     """
-    results = []
-    for s in serials:
-        results.append(AndroidDevice(s))
-    return results
+    return _runOnDevices(AndroidDevice, serials, "AndroidDevice creation")
 
 
 def get_instances_with_configs(configs):
     """Create AndroidDevice instances from a list of json configs.
 
-    Each config should have the required key-value pair "serial".
+    Each config should have the required key-value pair "serial". The
+    instances are created concurrently. If any one fails, the others are
+    cleaned up.
 
     Args:
         configs: A list of dicts each representing the configuration of one
@@ -195,7 +262,7 @@ def get_instances_with_configs(configs):
     Returns:
         A list of AndroidDevice objects.
     """
-    results = []
+    params = []
     for c in configs:
         try:
             serial = c.pop(keys.ConfigKeys.IKEY_SERIAL)
@@ -212,11 +279,20 @@ def get_instances_with_configs(configs):
                 'AndroidDevice config %s.',
                 keys.ConfigKeys.IKEY_PRODUCT_TYPE, c)
             product_type = ANDROID_PRODUCT_TYPE_UNKNOWN
+        params.append((serial, product_type, c))
 
+    def _createAndroidDevice(param):
+        serial, product_type, config = param
         ad = AndroidDevice(serial, product_type)
-        ad.loadConfig(c)
-        results.append(ad)
-    return results
+        try:
+            ad.loadConfig(config)
+        except:
+            destroy([ad])
+            raise
+        return ad
+
+    return _runOnDevices(_createAndroidDevice, params,
+                         "AndroidDevice creation", lambda param: param[0])
 
 
 def get_all_instances(include_fastboot=False):
@@ -336,6 +412,8 @@ class AndroidDevice(object):
                               file collected, if any.
         vts_agent_process: A process that runs the HAL agent.
         adb: An AdbProxy object used for interacting with the device via adb.
+        facts: DeviceFacts, the cached system properties and facts of the
+               device.
         fastboot: A FastbootProxy object used for interacting with the device
                   via fastboot.
         host_command_port: the host-side port for runner to agent sessions
@@ -346,6 +424,9 @@ class AndroidDevice(object):
         lib: LibMirror, in charge of all communications with static and shared
              native libs.
         shell: ShellMirror, in charge of all communications with shell.
+        agent_client_pool: VtsTcpClientPool, the agent sessions shared by hal,
+                           lib and shell.
+        spec_cache: VtsSpecCache, the HAL specifications of the device build.
         _product_type: A string, the device product type (e.g., bullhead) if
                        known, ANDROID_PRODUCT_TYPE_UNKNOWN otherwise.
     """
@@ -364,6 +445,7 @@ class AndroidDevice(object):
         self.adb_logcat_file_path = None
         self.vts_agent_process = None
         self.adb = adb.AdbProxy(serial)
+        self.facts = device_facts.DeviceFacts(self.adb)
         self.fastboot = fastboot.FastbootProxy(serial)
         if not self.isBootloaderMode:
             self.rootAdb()
@@ -374,6 +456,8 @@ class AndroidDevice(object):
         self.hal = None
         self.lib = None
         self.shell = None
+        self.agent_client_pool = None
+        self.spec_cache = None
         self.sl4a_host_port = None
         # TODO: figure out a good way to detect which port is available
         # on the target side, instead of hard coding a port number.
@@ -387,22 +471,36 @@ class AndroidDevice(object):
         claimed.
         """
         self.stopServices()
+        self.log.debug("Device facts cache: %s", self.facts.GetStats())
         if self.host_command_port:
             self.adb.forward("--remove tcp:%s" % self.host_command_port)
             self.host_command_port = None
         if self.sl4a_host_port:
             self.adb.forward("--remove tcp:%s" % self.sl4a_host_port)
             self.sl4a_host_port = None
+        # Nothing binds the reverse forward's host port until a callback
+        # server starts, so it stays reserved while the object is in use.
+        adb.release_host_port(self.host_callback_port)
 
     @property
     def isBootloaderMode(self):
         """True if the device is in bootloader mode."""
+        return self.facts.GetFact("bootloader_mode",
+                                  self._checkBootloaderMode)
+
+    def _checkBootloaderMode(self):
+        """Checks the bootloader mode, asking fastboot only if adb fails."""
+        try:
+            if self.adb.get_state().strip():
+                return False
+        except adb.AdbError:
+            pass
         return self.serial in list_fastboot_devices()
 
     @property
     def isAdbRoot(self):
         """True if adb is running as root for this device."""
-        id_str = self.adb.shell("id -u").decode("utf-8")
+        id_str = self.facts.GetFact("uid")
         return "root" in id_str
 
     @property
@@ -451,7 +549,7 @@ class AndroidDevice(object):
     @property
     def is64Bit(self):
         """True if device is 64 bit."""
-        out = self.adb.shell('uname -m')
+        out = self.facts.GetFact("machine")
         return "64" in out
 
     @property
@@ -501,6 +599,8 @@ class AndroidDevice(object):
                 # adb wait-for-device is not always possible in the lab
                 # continue with an assumption it's done by the harness.
                 logging.exception(e)
+            finally:
+                self.facts.Invalidate()
 
     def startAdbLogcat(self):
         """Starts a standing adb logcat collection in separate subprocesses and
@@ -558,6 +658,7 @@ class AndroidDevice(object):
 
         This function times out after 15 minutes.
         """
+        self.facts.Invalidate()
         try:
             self.adb.wait_for_device()
         except adb.AdbError as e:
@@ -593,6 +694,7 @@ class AndroidDevice(object):
         logging.info("stopping Android Runtime")
         self.adb.shell("stop")
         self.setProp("sys.boot_completed", 0)
+        self.facts.Invalidate()
         logging.info("Android Runtime stopped")
 
     def setProp(self, name, value):
@@ -619,10 +721,17 @@ class AndroidDevice(object):
                           "is not yet supported. No property is set.")
             return
 
-        self.adb.shell("setprop %s \"%s\"" % (name, value))
+        try:
+            self.adb.shell("setprop %s \"%s\"" % (name, value))
+        finally:
+            self.facts.InvalidateProp(name)
 
     def getProp(self, name):
-        """Calls getprop shell command.
+        """Gets a system property.
+
+        The properties which are constant until reboot, e.g., ro.*, are read
+        from a snapshot which is kept until setProp, rootAdb or a reboot; the
+        others are read from the device.
 
         Args:
             name: string, the name of a system property to get
@@ -640,8 +749,83 @@ class AndroidDevice(object):
             logging.error("name of system property should not be None.")
             return None
 
-        out = self.adb.shell("getprop %s" % name)
-        return out.decode("utf-8").strip()
+        return self.facts.GetProp(name)
+
+    def pullFiles(self,
+                  device_paths,
+                  name_pattern=None,
+                  max_depth=None,
+                  handler=None,
+                  local_dir=None):
+        """Pulls device files in a single stream.
+
+        The files found under device_paths are written one after another, each
+        preceded by its path and size, to the stdout of one device command,
+        which is read as it arrives. This takes one round trip instead of one
+        adb pull per file. The files must not change during the pull.
+
+        Args:
+            device_paths: list of strings, the device files and directories.
+            name_pattern: string, the pattern of the file names to pull,
+                          e.g., *.gcda. All files if None.
+            max_depth: int, how deep the directories are searched, 1 for
+                       their direct children. Unlimited if None.
+            handler: function, called with the device path and the content of
+                     each file as it arrives.
+            local_dir: string, the host directory the files are written to,
+                       at their device paths relative to /.
+
+        Returns:
+            dict of device path to content, if neither handler nor local_dir
+            is given. Otherwise, the list of the pulled device paths.
+
+        Raises:
+            AdbError if the stream ends in the middle of a file.
+        """
+        find_cmd = ["find"] + [quote(path) for path in device_paths]
+        if max_depth is not None:
+            find_cmd.append("-maxdepth %d" % max_depth)
+        find_cmd.append("-type f")
+        if name_pattern:
+            find_cmd.append("-name %s" % quote(name_pattern))
+        command = ("%s 2>/dev/null | while IFS= read -r f; do "
+                   'echo "$f"; stat -c %%s "$f"; cat "$f"; done' %
+                   " ".join(find_cmd))
+
+        contents = {}
+        pulled = []
+        stream = self.adb.open_exec_out(command)
+        try:
+            while True:
+                path = stream.readline()
+                if not path:
+                    break
+                path = path.decode("utf-8").rstrip("\n")
+                size = stream.readline().strip()
+                content = stream.read(int(size)) if size else b""
+                if not size or len(content) != int(size):
+                    raise adb.AdbError(
+                        cmd=command,
+                        stdout=b"",
+                        stderr=("stream ended in %s" % path).encode("utf-8"),
+                        ret_code=1)
+                pulled.append(path)
+                if handler:
+                    handler(path, content)
+                if local_dir:
+                    local_path = os.path.join(local_dir, path.lstrip("/"))
+                    if not os.path.isdir(os.path.dirname(local_path)):
+                        os.makedirs(os.path.dirname(local_path))
+                    with open(local_path, "wb") as local_file:
+                        local_file.write(content)
+                if not handler and not local_dir:
+                    contents[path] = content
+        finally:
+            stream.close()
+        logging.debug("pulled %d files from %s", len(pulled), device_paths)
+        if handler or local_dir:
+            return pulled
+        return contents
 
     def reboot(self, restart_services=True):
         """Reboots the device and wait for device to complete booting.
@@ -655,6 +839,7 @@ class AndroidDevice(object):
         """
         if self.isBootloaderMode:
             self.fastboot.reboot()
+            self.facts.Invalidate()
             return
 
         if restart_services:
@@ -666,6 +851,7 @@ class AndroidDevice(object):
                 self.stopVtsAgent()
 
         self.adb.reboot()
+        self.facts.Invalidate()
         self.waitForBootCompletion()
         self.rootAdb()
 
@@ -697,10 +883,20 @@ class AndroidDevice(object):
             if not self.host_command_port:
                 self.host_command_port = adb.get_available_host_port()
             self.adb.tcp_forward(self.host_command_port, self.device_command_port)
+            if not self.spec_cache:
+                self.spec_cache = vts_spec_cache.VtsSpecCache(
+                    self.getProp("ro.build.fingerprint"))
+            self.agent_client_pool = vts_tcp_client_pool.VtsTcpClientPool(
+                self.host_command_port,
+                self.host_callback_port,
+                spec_cache=self.spec_cache)
             self.hal = hal_mirror.HalMirror(self.host_command_port,
-                                            self.host_callback_port)
-            self.lib = lib_mirror.LibMirror(self.host_command_port)
-            self.shell = shell_mirror.ShellMirror(self.host_command_port)
+                                            self.host_callback_port,
+                                            self.agent_client_pool)
+            self.lib = lib_mirror.LibMirror(self.host_command_port,
+                                            self.agent_client_pool)
+            self.shell = shell_mirror.ShellMirror(self.host_command_port,
+                                                  self.agent_client_pool)
         if enable_sl4a:
             self.startSl4aClient()
 
@@ -712,6 +908,8 @@ class AndroidDevice(object):
         self.stopVtsAgent()
         if self.hal:
             self.hal.CleanUp()
+        if self.agent_client_pool:
+            self.agent_client_pool.Clear()
 
     def startVtsAgent(self):
         """Start HAL agent on the AndroidDevice.
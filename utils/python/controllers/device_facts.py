@@ -0,0 +1,180 @@
+#
+#   Copyright 2017 - The Android Open Source Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import logging
+import re
+import threading
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+# The properties which do not change until the device reboots, besides the
+# read-only ro.* ones.
+_STABLE_PROPS = frozenset(["partition.system.verified"])
+
+# Separates the outputs of the commands in the snapshot.
+_SNAPSHOT_SEPARATOR = "----vts-device-facts----"
+
+# The facts in the snapshot and the commands which print them.
+_SNAPSHOT_FACTS = (
+    ("uid", "id -u"),
+    ("machine", "uname -m"),
+)
+
+_GETPROP_LINE = re.compile(r"^\[(.*?)\]: \[(.*?)\]$", re.MULTILINE | re.DOTALL)
+
+
+def IsStableProp(name):
+    """Returns whether a system property is constant until reboot."""
+    return name.startswith("ro.") or name in _STABLE_PROPS
+
+
+def ParseGetprop(out):
+    """Parses the output of getprop without arguments.
+
+    Args:
+        out: string, lines such as "[ro.product.name]: [sailfish]".
+
+    Returns:
+        dict of property name to value.
+    """
+    return dict(_GETPROP_LINE.findall(out))
+
+
+class DeviceFacts(object):
+    """Caches the system properties and facts of a device.
+
+    The first access reads all the properties and facts in one adb shell
+    command. The stable properties, i.e., the ro.* ones, and the facts are
+    then served from memory until invalidated. Other properties, e.g.,
+    sys.boot_completed, are always read from the device.
+
+    Attributes:
+        _adb: AdbProxy of the device.
+        _props: dict of property name to value, the stable properties.
+        _stale_props: set of strings, the stable properties which were set
+                      since the snapshot was taken.
+        _facts: dict of fact name to value.
+        _loaded: bool, whether _props holds a snapshot.
+        _hits: int, the number of accesses served from memory.
+        _misses: int, the number of accesses which read the device.
+        _lock: RLock, guards the attributes above.
+    """
+
+    def __init__(self, adb_proxy):
+        self._adb = adb_proxy
+        self._props = {}
+        self._stale_props = set()
+        self._facts = {}
+        self._loaded = False
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.RLock()
+
+    def _Shell(self, command):
+        out = self._adb.shell(quote(command))
+        return out.decode("utf-8", "replace")
+
+    def _Load(self):
+        """Reads all properties and the snapshot facts in one command."""
+        commands = ["getprop"] + [command for _, command in _SNAPSHOT_FACTS]
+        out = self._Shell(("; echo %s; " % _SNAPSHOT_SEPARATOR).join(commands))
+        sections = out.split(_SNAPSHOT_SEPARATOR + "\n")
+        props = ParseGetprop(sections[0])
+        self._props = dict(
+            (name, value) for name, value in props.items()
+            if IsStableProp(name))
+        self._stale_props.clear()
+        for (name, _), section in zip(_SNAPSHOT_FACTS, sections[1:]):
+            self._facts[name] = section
+        self._loaded = True
+        logging.debug("device facts: %d properties, %s", len(props),
+                      sorted(self._facts))
+
+    def GetProp(self, name):
+        """Returns the value of a system property.
+
+        Args:
+            name: string, the name of the property.
+
+        Returns:
+            string, the value, empty if the property does not exist.
+
+        Raises:
+            AdbError if the device cannot be read.
+        """
+        with self._lock:
+            if not IsStableProp(name):
+                self._misses += 1
+                return self._Shell("getprop %s" % name).strip()
+            if self._loaded and name not in self._stale_props:
+                self._hits += 1
+                return self._props.get(name, "")
+            self._misses += 1
+            if not self._loaded:
+                self._Load()
+                return self._props.get(name, "")
+            value = self._Shell("getprop %s" % name).strip()
+            self._props[name] = value
+            self._stale_props.discard(name)
+            return value
+
+    def InvalidateProp(self, name):
+        """Makes the next access to a property read the device.
+
+        Args:
+            name: string, the name of a property which was set.
+        """
+        with self._lock:
+            if IsStableProp(name):
+                self._stale_props.add(name)
+
+    def GetFact(self, name, loader=None):
+        """Returns a fact about the device.
+
+        Args:
+            name: string, the name of the fact, e.g., one in the snapshot.
+            loader: function which returns the fact, for the facts which are
+                    not in the snapshot.
+
+        Returns:
+            the value of the fact. The output of its command for the facts
+            in the snapshot.
+        """
+        with self._lock:
+            if name in self._facts:
+                self._hits += 1
+                return self._facts[name]
+            self._misses += 1
+            if loader is None:
+                self._Load()
+            else:
+                self._facts[name] = loader()
+            return self._facts.get(name)
+
+    def Invalidate(self):
+        """Discards everything, e.g., when the device reboots."""
+        with self._lock:
+            self._props = {}
+            self._stale_props.clear()
+            self._facts = {}
+            self._loaded = False
+
+    def GetStats(self):
+        """Returns a dict of the number of cache hits and misses."""
+        with self._lock:
+            return {"hits": self._hits, "misses": self._misses}
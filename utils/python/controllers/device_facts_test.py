@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+#
+#   Copyright 2017 - The Android Open Source Project
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import unittest
+
+from vts.utils.python.controllers import device_facts
+
+_GETPROP = b"""[partition.system.verified]: [2]
+[ro.build.fingerprint]: [a/b/c:8.0/1/2:userdebug/test-keys]
+[ro.product.cpu.abi]: [arm64-v8a]
+[sys.boot_completed]: [1]
+"""
+
+
+class FakeAdbProxy(object):
+    """Answers the shell commands of DeviceFacts and counts them."""
+
+    def __init__(self):
+        self.commands = []
+
+    def shell(self, command):
+        self.commands.append(command)
+        if command.startswith("'getprop;"):
+            separator = device_facts._SNAPSHOT_SEPARATOR.encode("utf-8")
+            return (_GETPROP + separator + b"\n0\n" + separator +
+                    b"\naarch64\n")
+        if command == "'getprop sys.boot_completed'":
+            return b"0\n"
+        return b"value\n"
+
+
+class DeviceFactsTest(unittest.TestCase):
+    """Tests DeviceFacts with a fake adb."""
+
+    def setUp(self):
+        self._adb = FakeAdbProxy()
+        self._facts = device_facts.DeviceFacts(self._adb)
+
+    def testSnapshot(self):
+        """Tests that the stable properties and facts take one command."""
+        self.assertEqual(self._facts.GetProp("ro.product.cpu.abi"),
+                         "arm64-v8a")
+        self.assertEqual(self._facts.GetProp("partition.system.verified"),
+                         "2")
+        self.assertEqual(self._facts.GetProp("ro.missing"), "")
+        self.assertEqual(self._facts.GetFact("uid"), "0\n")
+        self.assertEqual(self._facts.GetFact("machine"), "aarch64\n")
+        self.assertEqual(len(self._adb.commands), 1)
+        self.assertEqual(self._facts.GetStats(), {"hits": 4, "misses": 1})
+
+    def testVolatileProp(self):
+        """Tests that other properties are always read from the device."""
+        self._facts.GetProp("ro.product.cpu.abi")
+        self.assertEqual(self._facts.GetProp("sys.boot_completed"), "0")
+        self.assertEqual(self._facts.GetProp("sys.boot_completed"), "0")
+        self.assertEqual(len(self._adb.commands), 3)
+
+    def testInvalidate(self):
+        """Tests that set properties and invalidation read the device."""
+        self._facts.GetProp("ro.product.cpu.abi")
+        self._facts.InvalidateProp("ro.product.cpu.abi")
+        self.assertEqual(self._facts.GetProp("ro.product.cpu.abi"), "value")
+        self.assertEqual(self._facts.GetProp("ro.product.cpu.abi"), "value")
+        self.assertEqual(len(self._adb.commands), 2)
+
+        self._facts.Invalidate()
+        self.assertEqual(self._facts.GetProp("ro.product.cpu.abi"),
+                         "arm64-v8a")
+        self.assertEqual(len(self._adb.commands), 3)
+        self.assertEqual(
+            self._facts.GetFact("bootloader_mode", lambda: False), False)
+        self.assertEqual(
+            self._facts.GetFact("bootloader_mode", lambda: True), False)
+
+
+if __name__ == "__main__":
+    unittest.main()
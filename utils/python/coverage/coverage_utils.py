@@ -176,9 +176,9 @@ class CoverageFeature(feature_utils.Feature):
     def GetGcdaDict(self, dut):
         """Retrieves GCDA files from device and creates a dictionary of files.
 
-        Find all GCDA files on the target device, copy them to the host using
-        adb, then return a dictionary mapping from the gcda basename to the
-        temp location on the host.
+        Find all GCDA files on the target device, stream them to the host in
+        one adb session, store them in the temp location on the host, and
+        return a dictionary mapping from the gcda basename to the contents.
 
         Args:
             dut: the device under test.
@@ -190,15 +190,17 @@ class CoverageFeature(feature_utils.Feature):
         logging.info("Creating gcda dictionary")
         gcda_dict = {}
         logging.info("Storing gcda tmp files to: %s", self.local_coverage_path)
-        gcda_files = dut.adb.shell("find %s -name \"*.gcda\"" %
-                                   TARGET_COVERAGE_PATH).split("\n")
-        for gcda in gcda_files:
-            if gcda:
-                basename = os.path.basename(gcda.strip())
-                file_name = os.path.join(self.local_coverage_path, basename)
-                dut.adb.pull("%s %s" % (gcda, file_name))
-                gcda_content = open(file_name, "rb").read()
-                gcda_dict[basename] = gcda_content
+
+        def _StoreGcda(gcda, gcda_content):
+            basename = os.path.basename(gcda)
+            file_name = os.path.join(self.local_coverage_path, basename)
+            with open(file_name, "wb") as gcda_file:
+                gcda_file.write(gcda_content)
+            gcda_dict[basename] = gcda_content
+
+        dut.pullFiles([TARGET_COVERAGE_PATH],
+                      name_pattern="*.gcda",
+                      handler=_StoreGcda)
         return gcda_dict
 
     def _OutputCoverageReport(self, isGlobal):
@@ -0,0 +1,240 @@
+#
+# Copyright 2017 - The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import logging
+import os
+import posixpath
+import threading
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+# The maximum length of a shell command sent to the device. The commands on
+# more files are split. adbd of protocol version 1 accepts service requests
+# of at most 4K, which also hold the shell,v2,raw: prefix and the quotes
+# _Shell adds, so the commands are kept well under that.
+_MAX_COMMAND_LENGTH = 3 * 1024
+
+# Printed by the device before each of the given paths which is a directory.
+_DIR_MARKER = "DIR:"
+
+# (path, size, mtime) to the MD5 of a host file.
+_host_hash_cache = {}
+_host_hash_cache_lock = threading.Lock()
+
+
+def GetHostFileHash(path):
+    """Returns the MD5 hex digest of a host file.
+
+    The digests are cached by path, size and modification time, so a file
+    is read once per process unless it changes.
+
+    Args:
+        path: string, the path of the file.
+
+    Returns:
+        string, the hex digest.
+    """
+    stat_result = os.stat(path)
+    key = (os.path.abspath(path), stat_result.st_size, stat_result.st_mtime)
+    with _host_hash_cache_lock:
+        digest = _host_hash_cache.get(key)
+    if digest is None:
+        md5 = hashlib.md5()
+        with open(path, "rb") as host_file:
+            for chunk in iter(lambda: host_file.read(1024 * 1024), b""):
+                md5.update(chunk)
+        digest = md5.hexdigest()
+        with _host_hash_cache_lock:
+            _host_hash_cache[key] = digest
+    return digest
+
+
+def _SplitArgs(args, prefix_length):
+    """Splits a list of quoted arguments into command-sized groups.
+
+    The length of an argument counts the escapes of its single quotes when
+    _Shell quotes the whole command.
+    """
+    groups = []
+    group = []
+    length = prefix_length
+    for arg in args:
+        arg_length = len(arg) + 4 * arg.count("'") + 1
+        if group and length + arg_length > _MAX_COMMAND_LENGTH:
+            groups.append(group)
+            group = []
+            length = prefix_length
+        group.append(arg)
+        length += arg_length
+    if group:
+        groups.append(group)
+    return groups
+
+
+class FileSync(object):
+    """Pushes files to a device, skipping the ones it already has.
+
+    For each push, the host files are hashed and the device is asked for the
+    hashes of the existing copies in one shell command, which also creates
+    all the directories. Only the files which differ are pushed, in one
+    stream, and an optional chmod runs once at the end.
+
+    Attributes:
+        _adb: AdbProxy of the device.
+    """
+
+    def __init__(self, adb_proxy):
+        self._adb = adb_proxy
+
+    def _Shell(self, command):
+        """Runs a device shell command.
+
+        Args:
+            command: string, which may use any shell syntax.
+
+        Returns:
+            string, the stdout.
+        """
+        # Quoted so that the whole command reaches the device shell.
+        out = self._adb.shell(quote(command))
+        if isinstance(out, bytes):
+            out = out.decode("utf-8", "replace")
+        return out
+
+    def _FindRemoteDirs(self, remote_paths):
+        """Returns the subset of device paths which are directories."""
+        args = [quote(path) for path in remote_paths]
+        loop = 'for p in %s; do [ -d "$p" ] && echo "%s$p"; done; true'
+        dirs = set()
+        for group in _SplitArgs(args, len(loop)):
+            out = self._Shell(loop % (" ".join(group), _DIR_MARKER))
+            for line in out.splitlines():
+                if line.startswith(_DIR_MARKER):
+                    dirs.add(line[len(_DIR_MARKER):])
+        return dirs
+
+    def _ExpandPushList(self, push_list):
+        """Lists the files and directories pushed like "adb push" does.
+
+        Args:
+            push_list: list of (host path, device path) tuples.
+
+        Returns:
+            a tuple of a list of (host file, device file) tuples and a list of
+            device directories.
+        """
+        ambiguous = [
+            remote_path for local_path, remote_path in push_list
+            if not remote_path.endswith("/") and
+            os.path.basename(local_path.rstrip("/")) not in (".", "")
+        ]
+        remote_dirs = self._FindRemoteDirs(ambiguous) if ambiguous else set()
+
+        file_pairs = []
+        dirs = []
+        for local_path, remote_path in push_list:
+            if not os.path.exists(local_path):
+                raise IOError("cannot stat '%s': No such file or directory" %
+                              local_path)
+            destination = remote_path
+            if remote_path.endswith("/") or remote_path in remote_dirs:
+                destination = posixpath.join(
+                    remote_path, os.path.basename(local_path.rstrip("/")))
+            destination = posixpath.normpath(destination)
+            if not os.path.isdir(local_path):
+                file_pairs.append((local_path, destination))
+                continue
+            for root, _, files in os.walk(local_path):
+                remote_root = posixpath.normpath(
+                    posixpath.join(destination,
+                                   os.path.relpath(root, local_path)))
+                dirs.append(remote_root)
+                for name in files:
+                    file_pairs.append((os.path.join(root, name),
+                                       posixpath.join(remote_root, name)))
+        for _, remote_file in file_pairs:
+            dirs.append(posixpath.dirname(remote_file))
+        return file_pairs, sorted(set(dirs))
+
+    def _GetRemoteHashes(self, dirs, remote_files):
+        """Creates directories and hashes files on the device.
+
+        Unless there are too many paths, this is a single shell command.
+
+        Args:
+            dirs: list of strings, the device directories to create.
+            remote_files: list of strings, the device files to hash.
+
+        Returns:
+            dict of device file to MD5 hex digest, for the existing files.
+        """
+        commands = [
+            "mkdir -p %s" % " ".join(group)
+            for group in _SplitArgs([quote(d) for d in dirs], 9)
+        ]
+        commands.extend(
+            "md5sum %s 2>/dev/null" % " ".join(group)
+            for group in _SplitArgs([quote(f) for f in remote_files], 19))
+        hashes = {}
+        for group in _SplitArgs(commands, len("; true")):
+            out = self._Shell("; ".join(group + ["true"]))
+            for line in out.splitlines():
+                digest, _, path = line.partition("  ")
+                if path:
+                    hashes[path] = digest
+        return hashes
+
+    def Push(self, push_list, mode=None):
+        """Pushes files and directories to the device.
+
+        Args:
+            push_list: list of (host path, device path) tuples, each of which
+                       is pushed like "adb push <host path> <device path>".
+            mode: string, e.g., 755, the mode of all the pushed files. None
+                  to keep the mode of the host files.
+
+        Returns:
+            a tuple of the number of pushed files and the number of the files
+            the device already had.
+
+        Raises:
+            IOError if a host path does not exist.
+            AdbError if a push fails.
+        """
+        file_pairs, dirs = self._ExpandPushList(push_list)
+        remote_hashes = self._GetRemoteHashes(
+            dirs, [remote_file for _, remote_file in file_pairs])
+        changed = [(local_file, remote_file)
+                   for local_file, remote_file in file_pairs
+                   if remote_hashes.get(remote_file) !=
+                   GetHostFileHash(local_file)]
+        if changed:
+            self._adb.push_files(changed)
+        if mode is not None and file_pairs:
+            prefix = "chmod %s " % mode
+            for group in _SplitArgs(
+                [quote(remote_file) for _, remote_file in file_pairs],
+                    len(prefix)):
+                self._Shell(prefix + " ".join(group))
+        logging.info("Pushed %d files (%d bytes); %d were up to date.",
+                     len(changed),
+                     sum(os.path.getsize(local_file)
+                         for local_file, _ in changed),
+                     len(file_pairs) - len(changed))
+        return len(changed), len(file_pairs) - len(changed)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+#
+# Copyright 2017 - The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from vts.utils.python.controllers import adb
+from vts.utils.python.controllers import adb_socket
+from vts.utils.python.controllers import adb_socket_test
+from vts.utils.python.file import file_sync
+
+
+class FileSyncTest(unittest.TestCase):
+    """Tests FileSync against a fake adb server.
+
+    The device paths are relative because the fake device runs shell
+    commands in its root directory.
+    """
+
+    def setUp(self):
+        self._server = adb_socket_test.FakeAdbServer()
+        self._adb = adb.AdbProxy(adb_socket_test._SERIAL)
+        self._adb._server_client = adb_socket.AdbServerClient(
+            adb_socket_test._SERIAL, port=self._server.port)
+        self._host_dir = tempfile.mkdtemp()
+        self._source = os.path.join(self._host_dir, "bin")
+        os.makedirs(os.path.join(self._source, "sub"))
+        for name in ("a", os.path.join("sub", "b")):
+            with open(os.path.join(self._source, name), "w") as host_file:
+                host_file.write(name)
+
+    def tearDown(self):
+        self._adb._server_client.close()
+        self._server.Stop()
+        shutil.rmtree(self._host_dir)
+
+    def testPushSkipsIdenticalFiles(self):
+        """Tests that a second push of the same files pushes nothing."""
+        sync = file_sync.FileSync(self._adb)
+        push_list = [(os.path.join(self._source, "."), "data/bin")]
+        self.assertEqual(sync.Push(push_list, mode="755"), (2, 0))
+        device_file = os.path.join(self._server.root, "data/bin/sub/b")
+        self.assertTrue(os.path.isfile(device_file))
+        self.assertEqual(stat.S_IMODE(os.stat(device_file).st_mode), 0o755)
+
+        self.assertEqual(sync.Push(push_list), (0, 2))
+        with open(os.path.join(self._source, "a"), "w") as host_file:
+            host_file.write("changed")
+        self.assertEqual(sync.Push(push_list), (1, 1))
+
+    def testPushIntoDirectory(self):
+        """Tests that a file pushed to a directory keeps its name."""
+        os.makedirs(os.path.join(self._server.root, "data/tmp"))
+        sync = file_sync.FileSync(self._adb)
+        sync.Push([(os.path.join(self._source, "a"), "data/tmp")])
+        self.assertTrue(
+            os.path.isfile(os.path.join(self._server.root, "data/tmp/a")))
+
+    def testSplitArgs(self):
+        """Tests that the commands on many files fit in an adb request once
+        _Shell quotes them."""
+        args = [
+            file_sync.quote("data/it's %03d %s" % (index, "x" * 50))
+            for index in range(300)
+        ]
+        prefix = "chmod 755 "
+        groups = file_sync._SplitArgs(args, len(prefix))
+        self.assertGreater(len(groups), 1)
+        self.assertEqual(sum(groups, []), args)
+        for group in groups:
+            command = file_sync.quote(prefix + " ".join(group))
+            self.assertLessEqual(
+                len(command), file_sync._MAX_COMMAND_LENGTH + len("''"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,168 @@
+#
+# Copyright (C) 2017 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import logging
+import random
+
+from vts.proto import ComponentSpecificationMessage_pb2 as CompSpecMsg
+from vts.runners.host import errors
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# scalar_type to (bit width, whether it is signed) of the integer types whose
+# bits are flipped.
+_INTEGER_TYPES = {
+    "int8_t": (8, True),
+    "char": (8, True),
+    "uint8_t": (8, False),
+    "uchar": (8, False),
+    "int16_t": (16, True),
+    "uint16_t": (16, False),
+    "int32_t": (32, True),
+    "uint32_t": (32, False),
+    "int64_t": (64, True),
+    "uint64_t": (64, False),
+}
+
+
+def GetFuzzableFields(struct_msg):
+    """Returns the fields of a struct whose bits can be flipped.
+
+    Args:
+        struct_msg: VariableSpecificationMessage of a struct.
+
+    Returns:
+        list of (index in struct_value, scalar_type) tuples.
+    """
+    return [(index, field.scalar_type)
+            for index, field in enumerate(struct_msg.struct_value)
+            if field.type == CompSpecMsg.TYPE_SCALAR and
+            field.scalar_type in _INTEGER_TYPES]
+
+
+class BatchFuzzer(object):
+    """Generates mutations of a struct message in batches.
+
+    Like the MessageFuzzer of a MirrorObject, a mutation flips one bit of one
+    integer field of the template. The fields and the bits of a whole batch
+    are drawn at once, by NumPy if it is installed, and written into
+    messages which are all parsed from the serialized template.
+
+    The same seed gives the same sequence of batches on the same host; the
+    sequence differs depending on whether NumPy is installed.
+
+    Attributes:
+        _template: VariableSpecificationMessage, the struct to mutate.
+        _fields: list of (index in struct_value, scalar_type) tuples, the
+                 fields which are mutated.
+        _values: list of integers, the template's value of each of _fields.
+        _widths: list of integers, the bit width of each of _fields.
+        _random: random.Random, draws the mutations without NumPy.
+        _numpy_random: numpy.random.RandomState, draws the mutations with
+                       NumPy, None if NumPy is not installed.
+    """
+
+    def __init__(self, template, seed=None):
+        """Initializes the fuzzer.
+
+        Args:
+            template: VariableSpecificationMessage of a struct, e.g., the one
+                      returned by a MirrorObject's message generator.
+            seed: integer, the seed of the random mutations. None to seed
+                  from the system.
+
+        Raises:
+            errors.VtsUnsupportedTypeError if the template is not a struct
+            or has no integer field.
+        """
+        if template.type != CompSpecMsg.TYPE_STRUCT:
+            raise errors.VtsUnsupportedTypeError(
+                "unsupported fuzz message type %s." % template.type)
+        self._fields = GetFuzzableFields(template)
+        if not self._fields:
+            raise errors.VtsUnsupportedTypeError(
+                "struct %s has no integer field to fuzz" %
+                template.predefined_type)
+        self._template = template
+        self._values = [
+            getattr(template.struct_value[index].scalar_value, scalar_type)
+            for index, scalar_type in self._fields
+        ]
+        self._widths = [
+            _INTEGER_TYPES[scalar_type][0] for _, scalar_type in self._fields
+        ]
+        self._random = random.Random(seed)
+        self._numpy_random = (numpy.random.RandomState(seed)
+                              if numpy is not None else None)
+
+    def _DrawMutations(self, count):
+        """Draws the field and the bit of each mutation.
+
+        Args:
+            count: integer, the number of mutations.
+
+        Returns:
+            a tuple of two lists of integers: the positions in _fields of
+            the mutated fields and the masks XORed into them.
+        """
+        if self._numpy_random is not None:
+            positions = self._numpy_random.randint(
+                0, len(self._fields), size=count)
+            widths = numpy.array(self._widths, dtype=numpy.uint64)[positions]
+            shifts = (self._numpy_random.random_sample(count) *
+                      widths).astype(numpy.uint64)
+            masks = numpy.left_shift(numpy.uint64(1), shifts)
+            return positions.tolist(), masks.tolist()
+
+        randrange = self._random.randrange
+        field_count = len(self._fields)
+        positions = [randrange(field_count) for _ in range(count)]
+        widths = self._widths
+        masks = [1 << randrange(widths[position]) for position in positions]
+        return positions, masks
+
+    def Fuzz(self, count):
+        """Generates a batch of mutations of the template.
+
+        Args:
+            count: integer, the number of messages to generate.
+
+        Returns:
+            a list of VariableSpecificationMessages.
+        """
+        serialized = self._template.SerializeToString()
+        message_class = self._template.__class__
+        messages = []
+        for _ in range(count):
+            message = message_class()
+            message.MergeFromString(serialized)
+            messages.append(message)
+
+        positions, masks = self._DrawMutations(count)
+        for message, position, mask in zip(messages, positions, masks):
+            index, scalar_type = self._fields[position]
+            width, signed = _INTEGER_TYPES[scalar_type]
+            value = (self._values[position] ^ mask) & ((1 << width) - 1)
+            if signed and value >= 1 << (width - 1):
+                value -= 1 << width
+            setattr(message.struct_value[index].scalar_value, scalar_type,
+                    value)
+        logging.debug("fuzzed %d messages of %s", count,
+                      self._template.predefined_type)
+        return messages
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2017 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+
+from vts.proto import ComponentSpecificationMessage_pb2 as CompSpecMsg
+from vts.utils.python.fuzzer import BatchFuzzer
+
+# The number of mutations drawn to check their distribution.
+_SAMPLE_COUNT = 20000
+
+
+def _CreateStruct(*fields):
+    """Returns a struct message of the given (scalar_type, value) fields."""
+    struct_msg = CompSpecMsg.VariableSpecificationMessage()
+    struct_msg.type = CompSpecMsg.TYPE_STRUCT
+    struct_msg.predefined_type = "::android::hardware::fake::Fields"
+    for index, (scalar_type, value) in enumerate(fields):
+        field = struct_msg.struct_value.add()
+        field.name = "field%d" % index
+        field.type = CompSpecMsg.TYPE_SCALAR
+        field.scalar_type = scalar_type
+        setattr(field.scalar_value, scalar_type, value)
+    return struct_msg
+
+
+def _GetValues(struct_msg):
+    """Returns the values of the fields of a struct message."""
+    return [
+        getattr(field.scalar_value, field.scalar_type)
+        for field in struct_msg.struct_value
+    ]
+
+
+def _CreateFuzzer(template, seed, use_numpy):
+    """Returns a BatchFuzzer which draws with NumPy or with random."""
+    fuzzer = BatchFuzzer.BatchFuzzer(template, seed)
+    if not use_numpy:
+        fuzzer._numpy_random = None
+    return fuzzer
+
+
+def _GetFrequencies(fuzzer, count):
+    """Returns the frequency of each (field position, bit) mutation."""
+    positions, masks = fuzzer._DrawMutations(count)
+    frequencies = {}
+    for position, mask in zip(positions, masks):
+        key = (position, int(mask).bit_length() - 1)
+        frequencies[key] = frequencies.get(key, 0) + 1.0 / count
+    return frequencies
+
+
+class BatchFuzzerTest(unittest.TestCase):
+    """Tests for BatchFuzzer of vts.utils.python.fuzzer."""
+
+    def _GetModes(self):
+        """Returns whether to use NumPy, for each mode this host has."""
+        if BatchFuzzer.numpy is None:
+            return [False]
+        return [False, True]
+
+    def testSeededDeterminism(self):
+        """Tests that a seed gives the same sequence of batches."""
+        template = _CreateStruct(("int32_t", 5), ("uint8_t", 9))
+        for use_numpy in self._GetModes():
+            first = _CreateFuzzer(template, 7, use_numpy)
+            second = _CreateFuzzer(template, 7, use_numpy)
+            for count in (1, 10, 100):
+                self.assertEqual(
+                    [_GetValues(msg) for msg in first.Fuzz(count)],
+                    [_GetValues(msg) for msg in second.Fuzz(count)])
+            other = _CreateFuzzer(template, 8, use_numpy)
+            self.assertNotEqual(
+                [_GetValues(msg) for msg in first.Fuzz(100)],
+                [_GetValues(msg) for msg in other.Fuzz(100)])
+        self.assertEqual(_GetValues(template), [5, 9])
+
+    def testDistribution(self):
+        """Tests that both ways to draw pick the fields and the bits
+        uniformly."""
+        template = _CreateStruct(("uint8_t", 0), ("int64_t", 0))
+        expected = {}
+        for bit in range(8):
+            expected[(0, bit)] = 1.0 / 2 / 8
+        for bit in range(64):
+            expected[(1, bit)] = 1.0 / 2 / 64
+        distributions = []
+        for use_numpy in self._GetModes():
+            frequencies = _GetFrequencies(
+                _CreateFuzzer(template, 1, use_numpy), _SAMPLE_COUNT)
+            self.assertEqual(set(frequencies), set(expected))
+            for key, frequency in frequencies.items():
+                self.assertAlmostEqual(
+                    frequency, expected[key], delta=expected[key] * 0.3)
+            distributions.append(frequencies)
+        if len(distributions) == 2:
+            for key in expected:
+                self.assertAlmostEqual(
+                    distributions[0][key],
+                    distributions[1][key],
+                    delta=expected[key] * 0.5)
+
+    def testSignAndWidth(self):
+        """Tests that flipping the top bit keeps the values in range of
+        their signed and unsigned types."""
+        template = _CreateStruct(("int32_t", 0), ("uint32_t", 0),
+                                 ("int64_t", -1), ("uint64_t", 0))
+        top_bit_values = [-2**31, 2**31, 2**63 - 1, 2**63]
+        masks = [2**32 - 1, 2**32 - 1, 2**64 - 1, 2**64 - 1]
+        for use_numpy in self._GetModes():
+            seen_top_bits = set()
+            fuzzer = _CreateFuzzer(template, 3, use_numpy)
+            for message in fuzzer.Fuzz(_SAMPLE_COUNT // 4):
+                values = _GetValues(message)
+                changed = [
+                    index
+                    for index, (value, original) in enumerate(
+                        zip(values, _GetValues(template)))
+                    if value != original
+                ]
+                self.assertEqual(len(changed), 1)
+                index = changed[0]
+                original = _GetValues(template)[index]
+                flipped = (values[index] ^ original) & masks[index]
+                self.assertEqual(bin(flipped).count("1"), 1)
+                if values[index] == top_bit_values[index]:
+                    seen_top_bits.add(index)
+            self.assertEqual(seen_top_bits, set(range(4)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -14,8 +14,11 @@
 # limitations under the License.
 #
 
+import json
 import random
 
+from vts.utils.python.fuzzer import BatchFuzzer
+
 REPLICATION_COUNT_IF_NEW_COVERAGE_IS_SEEN = 5
 REPLICATION_PARAM_IF_NO_COVERAGE_IS_SEEN = 10
 
@@ -39,20 +42,125 @@ def CreateGenePool(count, generator, fuzzer, **kwargs):
   return genes
 
 
+def CreateGenePoolBatch(count, generator, seed=None, **kwargs):
+  """Creates a gene pool by mutating a struct in one batch.
+
+  Much faster than CreateGenePool for a large pool, and reproducible.
+
+  Args:
+    count: integer, the size of the pool.
+    generator: function pointer, which can generate a struct message.
+    seed: integer, the seed of the mutations. None to seed from the system.
+    **kwargs: the args to the generator function pointer.
+
+  Returns:
+    a list of generated data.
+  """
+  fuzzer = BatchFuzzer.BatchFuzzer(generator(**kwargs), seed)
+  return fuzzer.Fuzz(count)
+
+
+class CoverageDatabase(object):
+  """A set of the coverage entities seen previously.
+
+  Attributes:
+    _entities: set of the IDs of the covered entities (e.g., basic blocks).
+  """
+
+  def __init__(self, entities=None):
+    self._entities = set(entities or ())
+
+  def __len__(self):
+    return len(self._entities)
+
+  def __contains__(self, entity):
+    return entity in self._entities
+
+  def CountNew(self, coverage):
+    """Returns the number of entities in 'coverage' not seen before.
+
+    Args:
+      coverage: a list of the IDs of covered entities.
+    """
+    return len(set(coverage) - self._entities)
+
+  def Add(self, coverage):
+    """Adds coverage to the database.
+
+    Args:
+      coverage: a list of the IDs of covered entities.
+
+    Returns:
+      integer, the number of entities which were not seen before.
+    """
+    size = len(self._entities)
+    self._entities.update(coverage)
+    return len(self._entities) - size
+
+  def Save(self, path):
+    """Saves the database to a file so that a campaign can be resumed.
+
+    Args:
+      path: string, the path of the file.
+    """
+    with open(path, "w") as database_file:
+      json.dump(sorted(self._entities), database_file)
+
+  @classmethod
+  def Load(cls, path):
+    """Loads a database saved by Save.
+
+    Args:
+      path: string, the path of the file.
+
+    Returns:
+      a CoverageDatabase.
+    """
+    with open(path) as database_file:
+      return cls(json.load(database_file))
+
+
 class Evolution(object):
   """Evolution class
 
+  A gene which covers new entities is replicated alpha times per new entity,
+  up to max_energy times. With the default max_energy, any new coverage
+  gets alpha replicas.
+
   Attributes:
-    _coverages_database: a list of coverage entities seen previously.
+    _coverages_database: CoverageDatabase, the coverage entities seen
+                         previously.
     _alpha: replication count if new coverage is seen.
     _beta: replication parameter if no coverage is seen.
+    _max_energy: the maximum replication count of a gene.
+    _random: random.Random, decides whether a gene without new coverage
+             is replicated.
   """
 
   def __init__(self, alpha=REPLICATION_COUNT_IF_NEW_COVERAGE_IS_SEEN,
-               beta=REPLICATION_PARAM_IF_NO_COVERAGE_IS_SEEN):
-    self._coverages_database = []
+               beta=REPLICATION_PARAM_IF_NO_COVERAGE_IS_SEEN,
+               database=None, max_energy=None, seed=None):
+    """Initializes the evolution.
+
+    Args:
+      alpha: replication count if new coverage is seen.
+      beta: replication parameter if no coverage is seen.
+      database: CoverageDatabase, to keep the coverage across evolutions.
+        A new one if None.
+      max_energy: the maximum replication count of a gene. alpha if None.
+      seed: integer, the seed of the replication of genes without new
+        coverage. None to seed from the system.
+    """
+    self._coverages_database = (database if database is not None
+                                else CoverageDatabase())
     self._alpha = alpha
     self._beta = beta
+    self._max_energy = alpha if max_energy is None else max_energy
+    self._random = random.Random(seed)
+
+  def GetCoverageDatabase(self):
+    """Returns the CoverageDatabase of the evolution."""
+    return self._coverages_database
 
   def _IsNewCoverage(self, coverage, add=False):
     """Returns True iff the 'coverage' is new.
@@ -64,18 +172,25 @@ class Evolution(object):
     Returns:
       True if new, False otherwise
     """
-    is_new_coverage = False
-    new_coverage_entities_to_add = []
-    for entity in coverage:
-      if entity not in self._coverages_database:
-        is_new_coverage = True
-        if add:
-          new_coverage_entities_to_add.append(entity)
-        else:
-          return True
     if add:
-      self._coverages_database.extend(new_coverage_entities_to_add)
-    return is_new_coverage
+      return self._coverages_database.Add(coverage) > 0
+    return self._coverages_database.CountNew(coverage) > 0
+
+  def Score(self, coverages):
+    """Returns the novelty score of each gene.
+
+    Args:
+      coverages: a list of the coverage data of the genes.
+
+    Returns:
+      a list of integers, the number of entities each gene covers which
+      neither the database nor a previous gene in the list has.
+    """
+    return [self._coverages_database.Add(coverage) for coverage in coverages]
+
+  def _Energy(self, novelty):
+    """Returns the replication count of a gene with a novelty score."""
+    return min(self._alpha * novelty, self._max_energy)
 
   def Evolve(self, genes, fuzzer, coverages=None):
     """Evolves a gene pool.
@@ -95,10 +210,10 @@ class Evolution(object):
         # TODO: consider cross over
         new_genes.append(fuzzer(gene))
     else:
-      for gene, coverage in zip(genes, coverages):
-        if self._IsNewCoverage(coverage, add=True):
-          for _ in range(self._alpha):
+      for gene, novelty in zip(genes, self.Score(coverages)):
+        if novelty:
+          for _ in range(self._Energy(novelty)):
             new_genes.append(fuzzer(gene))
-        elif random.randint(0, self._beta) == 1:
+        elif self._random.randint(0, self._beta) == 1:
           new_genes.append(fuzzer(gene))
     return new_genes
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2017 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from vts.proto import ComponentSpecificationMessage_pb2 as CompSpecMsg
+from vts.utils.python.fuzzer import GenePool
+
+
+class GenePoolTest(unittest.TestCase):
+  """Tests for GenePool of vts.utils.python.fuzzer."""
+
+  def testCoverageDatabase(self):
+    """Tests that only unseen entities are counted as new."""
+    database = GenePool.CoverageDatabase()
+    self.assertEqual(database.Add([1, 2, 3]), 3)
+    self.assertEqual(database.CountNew([3, 4]), 1)
+    self.assertEqual(database.Add([3, 4, 4]), 1)
+    self.assertEqual(len(database), 4)
+    self.assertIn(4, database)
+
+  def testSaveAndLoad(self):
+    """Tests that a saved database is loaded with the same entities."""
+    temp_dir = tempfile.mkdtemp()
+    try:
+      path = os.path.join(temp_dir, "coverage.json")
+      database = GenePool.CoverageDatabase([5, 7])
+      database.Save(path)
+      loaded = GenePool.CoverageDatabase.Load(path)
+      self.assertEqual(loaded.CountNew([5, 6, 7]), 1)
+    finally:
+      shutil.rmtree(temp_dir)
+
+  def testCreateGenePoolBatch(self):
+    """Tests that a batch pool has the requested size and is seeded."""
+
+    def Generator(value):
+      struct_msg = CompSpecMsg.VariableSpecificationMessage()
+      struct_msg.type = CompSpecMsg.TYPE_STRUCT
+      field = struct_msg.struct_value.add()
+      field.type = CompSpecMsg.TYPE_SCALAR
+      field.scalar_type = "uint32_t"
+      field.scalar_value.uint32_t = value
+      return struct_msg
+
+    for count in (0, 1, 100):
+      genes = GenePool.CreateGenePoolBatch(count, Generator, seed=5, value=3)
+      self.assertEqual(len(genes), count)
+    genes = GenePool.CreateGenePoolBatch(100, Generator, seed=5, value=3)
+    self.assertEqual(
+        GenePool.CreateGenePoolBatch(100, Generator, seed=5, value=3), genes)
+    for gene in genes:
+      self.assertNotEqual(gene.struct_value[0].scalar_value.uint32_t, 3)
+
+  def testEvolve(self):
+    """Tests that genes are replicated by their new coverage."""
+    evolution = GenePool.Evolution(alpha=2, beta=0, max_energy=4)
+    genes = evolution.Evolve(
+        ["a", "b", "c"], lambda gene: gene,
+        coverages=[[1], [1, 2, 3], [3]])
+    # "a" covers 1 new entity, "b" 2 and "c" none.
+    self.assertEqual(genes, ["a", "a", "b", "b", "b", "b"])
+    self.assertEqual(evolution.Score([[1, 2, 3, 4]]), [1])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,228 @@
+#
+# Copyright (C) 2017 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import array
+import numbers
+import operator
+
+from vts.proto import ComponentSpecificationMessage_pb2 as CompSpecMsg
+from vts.runners.host import errors
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The ways a vector or an array of scalars is returned.
+# A list of Python values, one per element.
+VECTOR_MODE_LIST = "list"
+# bytes, the elements packed in the host's native byte order.
+VECTOR_MODE_BYTES = "bytes"
+# array.array of the element type.
+VECTOR_MODE_ARRAY = "array"
+# numpy.ndarray of the element type. array.array if numpy is not installed.
+VECTOR_MODE_NUMPY = "numpy"
+VECTOR_MODES = (VECTOR_MODE_LIST, VECTOR_MODE_BYTES, VECTOR_MODE_ARRAY,
+                VECTOR_MODE_NUMPY)
+
+# scalar_type to (size in bytes, candidate array typecodes, numpy dtype).
+_SCALAR_TYPES = {
+    "int8_t": (1, "b", "int8"),
+    "char": (1, "b", "int8"),
+    "uint8_t": (1, "B", "uint8"),
+    "uchar": (1, "B", "uint8"),
+    "int16_t": (2, "h", "int16"),
+    "uint16_t": (2, "H", "uint16"),
+    "int32_t": (4, "il", "int32"),
+    "uint32_t": (4, "IL", "uint32"),
+    "int64_t": (8, "qlL", "int64"),
+    "uint64_t": (8, "QL", "uint64"),
+    "float_t": (4, "f", "float32"),
+    "double_t": (8, "d", "float64"),
+}
+
+# The scalar types whose values may be any real number, not only integers.
+_FLOAT_TYPES = frozenset(["float_t", "double_t"])
+
+
+def _GetTypecodes():
+    """Returns the array typecode of each scalar type this Python has."""
+    typecodes = {}
+    for scalar_type, (size, candidates, _) in _SCALAR_TYPES.items():
+        for typecode in candidates:
+            try:
+                if array.array(typecode).itemsize == size:
+                    typecodes[scalar_type] = typecode
+                    break
+            except ValueError:
+                # e.g., "q" is not supported by Python 2.
+                continue
+    return typecodes
+
+
+_TYPECODES = _GetTypecodes()
+
+
+def GetElementScalarType(var_spec_msg, spec_msg=None):
+    """Returns the scalar type of a vector's elements if it can be bulk
+    converted.
+
+    Args:
+        var_spec_msg: VariableSpecificationMessage of a vector or an array.
+        spec_msg: VariableSpecificationMessage, the spec of the vector, e.g.,
+                  the return type of an API, whose element gives the type.
+                  Needed for an empty vector, which has no element. If None,
+                  the first element of var_spec_msg gives the type.
+
+    Returns:
+        string, the scalar_type shared by the elements. None if the elements
+        are not scalars of a type an array.array can hold, or if the type is
+        unknown.
+    """
+    for msg in (spec_msg, var_spec_msg):
+        if msg is not None and msg.vector_value:
+            element = msg.vector_value[0]
+            if (element.type != CompSpecMsg.TYPE_SCALAR or
+                    element.scalar_type not in _TYPECODES):
+                return None
+            return element.scalar_type
+    return None
+
+
+def CheckVectorMode(vector_mode):
+    """Raises an error if a vector mode is unknown.
+
+    Args:
+        vector_mode: string, one of VECTOR_MODES.
+
+    Raises:
+        errors.VtsUnsupportedTypeError if the mode is unknown.
+    """
+    if vector_mode not in VECTOR_MODES:
+        raise errors.VtsUnsupportedTypeError("Unknown vector mode '%s'" %
+                                             vector_mode)
+
+
+def PbVector2PyBulk(var_spec_msg, vector_mode, spec_msg=None):
+    """Converts a vector or an array of scalars in bulk.
+
+    The values are read by one pass over the elements, without dispatching
+    on the type of each one, and packed into a single object.
+
+    Args:
+        var_spec_msg: VariableSpecificationMessage of a vector or an array.
+        vector_mode: string, one of VECTOR_MODES.
+        spec_msg: VariableSpecificationMessage, the spec of the vector. See
+                  GetElementScalarType.
+
+    Returns:
+        bytes, array.array or numpy.ndarray depending on vector_mode. None if
+        vector_mode is VECTOR_MODE_LIST or the elements are not scalars of
+        a supported type, in which case the caller converts them one by one.
+    """
+    if vector_mode == VECTOR_MODE_LIST:
+        return None
+    scalar_type = GetElementScalarType(var_spec_msg, spec_msg)
+    if scalar_type is None:
+        return None
+    values = map(
+        operator.attrgetter("scalar_value." + scalar_type),
+        var_spec_msg.vector_value)
+    if vector_mode == VECTOR_MODE_NUMPY and numpy is not None:
+        return numpy.fromiter(
+            values,
+            dtype=_SCALAR_TYPES[scalar_type][2],
+            count=len(var_spec_msg.vector_value))
+    result = array.array(_TYPECODES[scalar_type], values)
+    if vector_mode == VECTOR_MODE_BYTES:
+        return result.tobytes() if hasattr(result,
+                                           "tobytes") else result.tostring()
+    return result
+
+
+def IsBulkValue(py_value):
+    """Returns whether a Python value is a buffer PyBulk2PbVector accepts."""
+    return (isinstance(py_value, (bytes, bytearray, array.array)) or
+            (numpy is not None and isinstance(py_value, numpy.ndarray)))
+
+
+def CanPyBulk2PbVector(message, py_value):
+    """Returns whether PyBulk2PbVector can fill a message with a value.
+
+    Args:
+        message: VariableSpecificationMessage of a vector or an array.
+        py_value: Python value provided by a test case.
+
+    Returns:
+        True if the elements of message are scalars of a supported type and
+        py_value is bytes, bytearray, array.array, numpy.ndarray or a list
+        of numbers of that type. False otherwise, e.g., for a list of
+        VariableSpecificationMessages, which is converted element by element.
+    """
+    scalar_type = GetElementScalarType(message)
+    if scalar_type is None:
+        return False
+    if IsBulkValue(py_value):
+        return True
+    if not isinstance(py_value, list):
+        return False
+    if scalar_type in _FLOAT_TYPES:
+        number_type = numbers.Real
+    else:
+        number_type = numbers.Integral
+    return all(isinstance(value, number_type) for value in py_value)
+
+
+def PyBulk2PbVector(message, py_value):
+    """Fills a vector or an array message with scalars in bulk.
+
+    Args:
+        message: VariableSpecificationMessage of a vector or an array. Its
+                 first element specifies the type of all the elements, which
+                 are replaced.
+        py_value: list, bytes, bytearray, array.array or numpy.ndarray. bytes
+                  are unpacked in the host's native byte order unless the
+                  elements are 8-bit.
+
+    Raises:
+        errors.VtsUnsupportedTypeError if the element type is not supported.
+    """
+    scalar_type = GetElementScalarType(message)
+    if scalar_type is None:
+        raise errors.VtsUnsupportedTypeError(
+            "Cannot convert vector %s in bulk" % message.name)
+    typecode = _TYPECODES[scalar_type]
+    if isinstance(py_value, (bytes, bytearray)):
+        values = array.array(typecode)
+        if hasattr(values, "frombytes"):
+            values.frombytes(bytes(py_value))
+        else:
+            values.fromstring(bytes(py_value))
+        py_value = values
+    elif numpy is not None and isinstance(py_value, numpy.ndarray):
+        py_value = py_value.tolist()
+
+    # The first element is kept as the template of the element type, the
+    # same as MirrorObject.ArgToPb does for an empty list.
+    del message.vector_value[1:]
+    elements = message.vector_value
+    add = elements.add
+    for index, value in enumerate(py_value):
+        element = elements[0] if index == 0 else add()
+        element.type = CompSpecMsg.TYPE_SCALAR
+        element.scalar_type = scalar_type
+        setattr(element.scalar_value, scalar_type, value)
+    message.vector_size = len(py_value)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2017 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import array
+import unittest
+
+from vts.proto import ComponentSpecificationMessage_pb2 as CompSpecMsg
+from vts.runners.host import errors
+from vts.utils.python.mirror import bulk_vector
+from vts.utils.python.mirror import mirror_object
+from vts.utils.python.mirror import pb2py
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def _Vector(scalar_type, values=(), vector_type=CompSpecMsg.TYPE_VECTOR):
+    """Returns a vector message whose elements are scalars."""
+    msg = CompSpecMsg.VariableSpecificationMessage()
+    msg.type = vector_type
+    for value in values or [0]:
+        element = msg.vector_value.add()
+        element.type = CompSpecMsg.TYPE_SCALAR
+        element.scalar_type = scalar_type
+        setattr(element.scalar_value, scalar_type, value)
+    msg.vector_size = len(values)
+    return msg
+
+
+def _Values(msg):
+    """Returns the scalar values of a vector message."""
+    return [getattr(element.scalar_value, element.scalar_type)
+            for element in msg.vector_value[:msg.vector_size]]
+
+
+class BulkVectorTest(unittest.TestCase):
+    """Tests the bulk conversion of the vectors of scalars."""
+
+    def testPbVector2PyBulk(self):
+        """Tests each vector mode."""
+        msg = _Vector("uint8_t", [1, 2, 255])
+        self.assertIsNone(
+            bulk_vector.PbVector2PyBulk(msg, bulk_vector.VECTOR_MODE_LIST))
+        self.assertEqual(
+            bulk_vector.PbVector2PyBulk(msg, bulk_vector.VECTOR_MODE_BYTES),
+            b"\x01\x02\xff")
+        result = bulk_vector.PbVector2PyBulk(msg,
+                                             bulk_vector.VECTOR_MODE_ARRAY)
+        self.assertIsInstance(result, array.array)
+        self.assertEqual(list(result), [1, 2, 255])
+        result = bulk_vector.PbVector2PyBulk(msg,
+                                             bulk_vector.VECTOR_MODE_NUMPY)
+        self.assertEqual(list(result), [1, 2, 255])
+        if numpy is not None:
+            self.assertIsInstance(result, numpy.ndarray)
+
+    def testPbVector2PyBulkEmpty(self):
+        """Tests that an empty vector takes the element type of its spec."""
+        msg = CompSpecMsg.VariableSpecificationMessage()
+        msg.type = CompSpecMsg.TYPE_VECTOR
+        spec = _Vector("int16_t")
+        self.assertIsNone(
+            bulk_vector.PbVector2PyBulk(msg, bulk_vector.VECTOR_MODE_ARRAY))
+        self.assertEqual(
+            bulk_vector.PbVector2PyBulk(msg, bulk_vector.VECTOR_MODE_BYTES,
+                                        spec), b"")
+        result = bulk_vector.PbVector2PyBulk(
+            msg, bulk_vector.VECTOR_MODE_ARRAY, spec)
+        self.assertIsInstance(result, array.array)
+        self.assertEqual(result.itemsize, 2)
+        self.assertEqual(len(result), 0)
+        result = bulk_vector.PbVector2PyBulk(
+            msg, bulk_vector.VECTOR_MODE_NUMPY, spec)
+        self.assertEqual(len(result), 0)
+        if numpy is not None:
+            self.assertEqual(result.dtype, numpy.int16)
+
+        convert = pb2py.CompileConverter(spec, bulk_vector.VECTOR_MODE_BYTES)
+        self.assertEqual(convert(msg), b"")
+        self.assertEqual(pb2py.Convert(msg, bulk_vector.VECTOR_MODE_BYTES), [])
+
+    def testPbVector2PyBulkUnsupported(self):
+        """Tests that the elements which are not scalars are skipped."""
+        msg = CompSpecMsg.VariableSpecificationMessage()
+        msg.type = CompSpecMsg.TYPE_VECTOR
+        msg.vector_value.add().type = CompSpecMsg.TYPE_STRING
+        self.assertIsNone(
+            bulk_vector.PbVector2PyBulk(msg, bulk_vector.VECTOR_MODE_ARRAY))
+        with self.assertRaises(errors.VtsUnsupportedTypeError):
+            bulk_vector.CheckVectorMode("tuple")
+
+    def testPyBulk2PbVector(self):
+        """Tests filling a vector from each kind of bulk value."""
+        values = [(b"\x01\x02\x03", [1, 2, 3]),
+                  (bytearray(b"\x04\x05"), [4, 5]),
+                  (array.array("B", [6, 7]), [6, 7]),
+                  ([8, 9, 10], [8, 9, 10])]
+        if numpy is not None:
+            values.append((numpy.array([11, 12], dtype="uint8"), [11, 12]))
+        for py_value, expected in values:
+            msg = _Vector("uint8_t", vector_type=CompSpecMsg.TYPE_ARRAY)
+            bulk_vector.PyBulk2PbVector(msg, py_value)
+            self.assertEqual(msg.vector_size, len(expected))
+            self.assertEqual(_Values(msg), expected)
+
+        msg = _Vector("int32_t")
+        bulk_vector.PyBulk2PbVector(msg, [])
+        self.assertEqual(msg.vector_size, 0)
+        self.assertEqual(len(msg.vector_value), 1)
+
+    def testCanPyBulk2PbVector(self):
+        """Tests which values take the bulk path."""
+        int_vector = _Vector("int32_t")
+        float_vector = _Vector("float_t")
+        self.assertTrue(bulk_vector.CanPyBulk2PbVector(int_vector, [1, 2]))
+        self.assertTrue(bulk_vector.CanPyBulk2PbVector(int_vector, b"\x01"))
+        self.assertTrue(
+            bulk_vector.CanPyBulk2PbVector(float_vector, [1, 2.5]))
+        self.assertFalse(
+            bulk_vector.CanPyBulk2PbVector(int_vector, [1, 2.5]))
+        self.assertFalse(bulk_vector.CanPyBulk2PbVector(int_vector, 1))
+        self.assertFalse(
+            bulk_vector.CanPyBulk2PbVector(int_vector, [_Vector("int32_t")]))
+
+        string_vector = CompSpecMsg.VariableSpecificationMessage()
+        string_vector.type = CompSpecMsg.TYPE_VECTOR
+        string_vector.vector_value.add().type = CompSpecMsg.TYPE_STRING
+        self.assertFalse(
+            bulk_vector.CanPyBulk2PbVector(string_vector, [1, 2]))
+        with self.assertRaises(errors.VtsUnsupportedTypeError):
+            bulk_vector.PyBulk2PbVector(string_vector, [1, 2])
+
+    def testArgToPb(self):
+        """Tests that ArgToPb converts the lists the bulk path does not."""
+        mirror = mirror_object.MirrorObject(None, None, None)
+
+        arg_msg = _Vector("float_t")
+        mirror.ArgToPb(arg_msg, [1, 2.5])
+        self.assertEqual(_Values(arg_msg), [1.0, 2.5])
+
+        arg_msg = _Vector("int32_t")
+        mirror.ArgToPb(arg_msg, [1, 2.5])
+        self.assertEqual(_Values(arg_msg), [1, 2.5])
+
+        element = CompSpecMsg.VariableSpecificationMessage()
+        element.type = CompSpecMsg.TYPE_SCALAR
+        element.scalar_type = "int32_t"
+        element.scalar_value.int32_t = 7
+        arg_msg = _Vector("int32_t")
+        mirror.ArgToPb(arg_msg, [element, element])
+        self.assertEqual(_Values(arg_msg), [7, 7])
+
+
+if __name__ == "__main__":
+    unittest.main()
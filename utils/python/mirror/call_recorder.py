@@ -0,0 +1,150 @@
+#
+# Copyright (C) 2017 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Records the HAL calls made through MirrorObjects as a replay trace.
+
+A host-driven sequence of calls can then be replayed on the device by
+vts_hal_replayer, e.g., through the hal_hidl_replay_test template:
+
+    recorder = call_recorder.CallRecorder()
+    self.dut.hal.nfc.SetRecorder(recorder)
+    ...  # calls to self.dut.hal.nfc
+    recorder.Save("/tmp/nfc_open_close.vts.trace")
+
+A trace has the same format as the ones the profiler writes: binary
+serialized VtsProfilingRecords, each preceded by its size as a varint, which
+vts_hal_replayer reads with readOneDelimited. Each call is recorded as a
+SERVER_API_ENTRY record with the arguments and a SERVER_API_EXIT record with
+the return values, which the replayer checks the device's results against.
+"""
+
+import logging
+import threading
+import time
+
+from google.protobuf.internal import encoder
+from vts.proto import ComponentSpecificationMessage_pb2 as CompSpecMsg
+from vts.proto import VtsProfilingMessage_pb2 as VtsProfilingMsg
+from vts.runners.host import errors
+from vts.utils.python.mirror import mirror_object
+
+TRACE_FILE_SUFFIX = ".vts.trace"
+
+
+class CallRecorder(object):
+    """Records calls and saves them as a .vts.trace file.
+
+    A recorder may be shared by the mirrors of several interfaces, including
+    the nested ones, so that the trace keeps the order of the calls.
+
+    Attributes:
+        _records: list of VtsProfilingRecord, in the order of the calls.
+        _lock: Lock, guards _records.
+    """
+
+    def __init__(self):
+        self._records = []
+        self._lock = threading.Lock()
+
+    def Record(self, if_spec_msg, mirror, call_msg, result):
+        """Records a call and its return value.
+
+        Args:
+            if_spec_msg: ComponentSpecificationMessage of the called
+                         interface, whose package, version and name the call
+                         is recorded under.
+            mirror: MirrorObject which made the call. It is the interface's
+                    or one of its sub structs'.
+            call_msg: FunctionCallMessage sent to the agent.
+            result: the return value of the call, converted to Python.
+        """
+        entry_record = VtsProfilingMsg.VtsProfilingRecord()
+        entry_record.timestamp = int(time.time() * 1e9)
+        entry_record.event = VtsProfilingMsg.SERVER_API_ENTRY
+        entry_record.package = if_spec_msg.package
+        entry_record.version = if_spec_msg.component_type_version
+        entry_record.interface = if_spec_msg.component_name
+        entry_record.func_msg.CopyFrom(call_msg.api)
+
+        exit_record = VtsProfilingMsg.VtsProfilingRecord()
+        exit_record.CopyFrom(entry_record)
+        exit_record.timestamp = int(time.time() * 1e9)
+        exit_record.event = VtsProfilingMsg.SERVER_API_EXIT
+        return_msgs = exit_record.func_msg.return_type_hidl
+        if len(return_msgs) == 1:
+            _FillReturnValue(mirror, return_msgs[0], result)
+        elif len(return_msgs) > 1 and isinstance(result, (list, tuple)):
+            for return_msg, value in zip(return_msgs, result):
+                _FillReturnValue(mirror, return_msg, value)
+
+        with self._lock:
+            self._records.append(entry_record)
+            self._records.append(exit_record)
+
+    def GetRecords(self):
+        """Returns a copy of the list of recorded VtsProfilingRecords."""
+        with self._lock:
+            return list(self._records)
+
+    def Clear(self):
+        """Discards the recorded calls."""
+        with self._lock:
+            del self._records[:]
+
+    def Save(self, trace_file_path):
+        """Writes the recorded calls to a trace file.
+
+        Args:
+            trace_file_path: string, the path of the file, which should end
+                             with TRACE_FILE_SUFFIX for the replay test to
+                             find it.
+        """
+        with self._lock:
+            records = list(self._records)
+        if not trace_file_path.endswith(TRACE_FILE_SUFFIX):
+            logging.warn("Trace file %s does not end with %s",
+                         trace_file_path, TRACE_FILE_SUFFIX)
+        with open(trace_file_path, "wb") as trace_file:
+            for record in records:
+                trace_file.write(encoder._VarintBytes(record.ByteSize()))
+                trace_file.write(record.SerializeToString())
+        logging.info("Saved %d calls to %s", len(records) // 2,
+                     trace_file_path)
+
+
+def _FillReturnValue(mirror, return_msg, value):
+    """Fills a return value spec with the value a call returned.
+
+    A value which cannot be converted, e.g., a nested interface, is left as
+    its spec so that the replayer only checks its type.
+
+    Args:
+        mirror: MirrorObject, which resolves the struct types.
+        return_msg: VariableSpecificationMessage in return_type_hidl.
+        value: the Python value returned by the call.
+    """
+    if value is None or isinstance(value, mirror_object.MirrorObject):
+        return
+    if (return_msg.type == CompSpecMsg.TYPE_ENUM and
+            isinstance(value, int)):
+        setattr(return_msg.scalar_value, return_msg.scalar_type or "int32_t",
+                value)
+        return
+    try:
+        mirror.ArgToPb(return_msg, value)
+    except (mirror_object.MirrorObjectError, errors.VtsError, AttributeError,
+            TypeError, ValueError) as e:
+        logging.debug("Return value %s of type %s is not recorded: %s",
+                      return_msg.name, return_msg.type, e)
@@ -0,0 +1,142 @@
+#
+# Copyright (C) 2017 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from google.protobuf.internal import decoder
+from vts.proto import ComponentSpecificationMessage_pb2 as CompSpecMsg
+from vts.proto import VtsProfilingMessage_pb2 as VtsProfilingMsg
+from vts.runners.host.tcp_client import vts_tcp_client
+from vts.runners.host.tcp_server import fake_agent
+from vts.utils.python.mirror import call_recorder
+from vts.utils.python.mirror import mirror_object
+
+
+def _AddApi(api_list, name):
+    """Adds an API which takes and returns an int32_t."""
+    api = api_list.add()
+    api.name = name
+    arg = api.arg.add()
+    arg.type = CompSpecMsg.TYPE_SCALAR
+    arg.scalar_type = "int32_t"
+    ret = api.return_type_hidl.add()
+    ret.type = CompSpecMsg.TYPE_SCALAR
+    ret.scalar_type = "int32_t"
+
+
+def _IncrementHandler(session_spec, call_msg):
+    """Returns the argument of a call plus one."""
+    result = CompSpecMsg.FunctionSpecificationMessage()
+    result.CopyFrom(call_msg.api)
+    result.return_type_hidl[0].scalar_value.int32_t = (
+        call_msg.api.arg[0].scalar_value.int32_t + 1)
+    return result
+
+
+def _ReadTrace(trace_file_path):
+    """Reads the delimited records the same as readOneDelimited."""
+    with open(trace_file_path, "rb") as trace_file:
+        data = trace_file.read()
+    records = []
+    pos = 0
+    while pos < len(data):
+        size, pos = decoder._DecodeVarint32(data, pos)
+        record = VtsProfilingMsg.VtsProfilingRecord()
+        record.ParseFromString(data[pos:pos + size])
+        records.append(record)
+        pos += size
+    return records
+
+
+class _FailingRecorder(object):
+    """A recorder which fails to record any call."""
+
+    def Record(self, if_spec_msg, mirror, call_msg, result):
+        raise AttributeError("no recording")
+
+
+class CallRecorderTest(unittest.TestCase):
+    """Tests CallRecorder with MirrorObjects calling FakeAgent.
+
+    Attributes:
+        _agent: FakeAgent, started for each test.
+        _client: VtsTcpClient, connected to _agent.
+        _mirror: MirrorObject of the interface added to _agent.
+        _temp_dir: string, the directory of the trace files.
+    """
+
+    def setUp(self):
+        spec = CompSpecMsg.ComponentSpecificationMessage()
+        spec.package = "android.hardware.fake"
+        spec.component_type_version = 1.0
+        spec.component_name = "IFake"
+        _AddApi(spec.interface.api, "increment")
+        sub_struct = spec.interface.sub_struct.add()
+        sub_struct.name = "counter"
+        _AddApi(sub_struct.api, "incrementCounter")
+        self._agent = fake_agent.FakeAgent(call_handler=_IncrementHandler)
+        self._agent.AddSpec(spec)
+        self._agent.Start()
+        self._client = vts_tcp_client.VtsTcpClient()
+        self._client.Connect(command_port=self._agent.port)
+        self._mirror = mirror_object.MirrorObject(self._client, spec, None)
+        self._temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self._client.Disconnect()
+        self._agent.Stop()
+        shutil.rmtree(self._temp_dir)
+
+    def testSaveAndReadBack(self):
+        """Tests that the calls, including a sub struct's, are saved as
+        delimited records of the top-level interface."""
+        recorder = call_recorder.CallRecorder()
+        self._mirror.SetRecorder(recorder)
+        self.assertEqual(self._mirror.increment(1), 2)
+        self.assertEqual(self._mirror.counter.incrementCounter(5), 6)
+        trace_file_path = os.path.join(self._temp_dir,
+                                       "fake" + call_recorder.TRACE_FILE_SUFFIX)
+        recorder.Save(trace_file_path)
+
+        records = _ReadTrace(trace_file_path)
+        self.assertEqual([record.event for record in records], [
+            VtsProfilingMsg.SERVER_API_ENTRY, VtsProfilingMsg.SERVER_API_EXIT
+        ] * 2)
+        for record in records:
+            self.assertEqual(record.package, "android.hardware.fake")
+            self.assertEqual(record.version, 1.0)
+            self.assertEqual(record.interface, "IFake")
+        self.assertEqual(
+            [record.func_msg.name for record in records],
+            ["increment", "increment", "incrementCounter",
+             "incrementCounter"])
+        self.assertEqual(records[0].func_msg.arg[0].scalar_value.int32_t, 1)
+        self.assertEqual(
+            records[3].func_msg.return_type_hidl[0].scalar_value.int32_t, 6)
+
+    def testRecorderFailure(self):
+        """Tests that a recorder error does not fail a successful call."""
+        self._mirror.SetRecorder(_FailingRecorder())
+        self.assertEqual(self._mirror.increment(1), 2)
+        self.assertEqual(self._mirror.RemoteCallAsync("increment", 2).result(),
+                         3)
+
+
+if __name__ == "__main__":
+    unittest.main()
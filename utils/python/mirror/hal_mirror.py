@@ -16,8 +16,6 @@
 
 import logging
 
-from google.protobuf import text_format
-
 from vts.runners.host import errors
 from vts.proto import AndroidSystemControlMessage_pb2 as ASysCtrlMsg
 from vts.proto import ComponentSpecificationMessage_pb2 as CompSpecMsg
@@ -86,12 +84,19 @@ class HalMirror(object):
         _host_callback_port: int, the host-side port for callback sessions.
         _client: VtsTcpClient, the client instance that can be used to send
                  commands to the target-side's agent.
+        _clients: dict, key is HAL handler name, value is the VtsTcpClient
+                  used by the HAL mirror object.
+        _client_pool: VtsTcpClientPool, the pool to get clients from. None
+                      to connect a new client per HAL.
     """
 
-    def __init__(self, host_command_port, host_callback_port):
+    def __init__(self, host_command_port, host_callback_port,
+                 client_pool=None):
         self._hal_level_mirrors = {}
+        self._clients = {}
         self._host_command_port = host_command_port
         self._host_callback_port = host_callback_port
+        self._client_pool = client_pool
         self._callback_server = None
 
     def __del__(self):
@@ -100,13 +105,26 @@ class HalMirror(object):
     def CleanUp(self):
         """Shutdown services and release resources held by the HalMirror.
         """
-        for hal_mirror_name in self._hal_level_mirrors.values():
-            hal_mirror_name.CleanUp()
+        for handler_name in list(self._hal_level_mirrors):
+            self._ReleaseMirror(handler_name)
         self._hal_level_mirrors = {}
         if self._callback_server:
+            logging.debug("callback stats: %s",
+                          self._callback_server.GetCallbackStats())
             self._callback_server.Stop()
             self._callback_server = None
 
+    def GetCallbackStats(self):
+        """Returns the queue counters of the registered HAL callbacks.
+
+        Returns:
+            dict, see CallbackServer.GetCallbackStats. Empty if no callback
+            server is running.
+        """
+        if not self._callback_server:
+            return {}
+        return self._callback_server.GetCallbackStats()
+
     def InitConventionalHal(self,
                             target_type,
                             target_version,
@@ -204,9 +222,32 @@ class HalMirror(object):
             bits=bits)
 
     def RemoveHal(self, handler_name):
-        self._hal_level_mirrors[handler_name].CleanUp()
+        self._ReleaseMirror(handler_name)
         self._hal_level_mirrors.pop(handler_name)
 
+    def _ReleaseMirror(self, handler_name):
+        """Releases the client of a HAL mirror object.
+
+        Args:
+            handler_name: string, the name of the handler.
+        """
+        client = self._clients.pop(handler_name, None)
+        if self._client_pool and client:
+            self._client_pool.Release(client)
+        else:
+            self._hal_level_mirrors[handler_name].CleanUp()
+
+    def _DiscardClient(self, client):
+        """Closes a client whose driver could not be launched.
+
+        Args:
+            client: VtsTcpClient, the client to close or return to the pool.
+        """
+        if self._client_pool:
+            self._client_pool.Release(client, reusable=False)
+        else:
+            client.Disconnect()
+
     def _StartCallbackServer(self):
         """Starts the callback server.
 
@@ -257,12 +298,41 @@ class HalMirror(object):
             raise error.ComponentLoadingError("Invalid value for bits: %s" %
                                               bits)
         self._StartCallbackServer()
-        self._client = vts_tcp_client.VtsTcpClient()
-        self._client.Connect(
-            command_port=self._host_command_port,
-            callback_port=self._host_callback_port)
+        if self._client_pool:
+            self._client = self._client_pool.Acquire()
+        else:
+            self._client = vts_tcp_client.VtsTcpClient()
+            self._client.Connect(
+                command_port=self._host_command_port,
+                callback_port=self._host_callback_port)
         if not handler_name:
             handler_name = target_type
+        try:
+            hal_mirror = self._LaunchDriver(
+                target_class, target_type, target_version, target_package,
+                target_component_name, target_basepaths, handler_name,
+                hw_binder_service_name, bits)
+        except:
+            self._DiscardClient(self._client)
+            raise
+        self._clients[handler_name] = self._client
+        self._hal_level_mirrors[handler_name] = hal_mirror
+
+    def _LaunchDriver(self, target_class, target_type, target_version,
+                      target_package, target_component_name,
+                      target_basepaths, handler_name, hw_binder_service_name,
+                      bits):
+        """Launches the driver for a HAL and creates its MirrorObject.
+
+        Args:
+            see _CreateMirrorObject.
+
+        Returns:
+            MirrorObject, the top level mirror object of the HAL.
+
+        Raises:
+            errors.ComponentLoadingError if the driver cannot be launched.
+        """
         service_name = "vts_driver_%s" % handler_name
 
         target_filename = None
@@ -327,12 +397,11 @@ class HalMirror(object):
         logging.debug("Found %d APIs for %s:\n%s",
                       len(found_api_spec), service_name, found_api_spec)
         if_spec_msg = CompSpecMsg.ComponentSpecificationMessage()
-        text_format.Merge(found_api_spec, if_spec_msg)
+        self._client.ParsePayload(found_api_spec, if_spec_msg)
 
         # Instantiate a MirrorObject and return it.
-        hal_mirror = mirror_object.MirrorObject(
+        return mirror_object.MirrorObject(
             self._client, if_spec_msg, self._callback_server, driver_id)
-        self._hal_level_mirrors[handler_name] = hal_mirror
 
     def __getattr__(self, name):
         return self._hal_level_mirrors[name]
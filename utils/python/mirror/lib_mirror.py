@@ -16,8 +16,6 @@
 
 import logging
 
-from google.protobuf import text_format
-
 from vts.runners.host import errors
 from vts.proto import AndroidSystemControlMessage_pb2 as ASysCtrlMsg
 from vts.proto import ComponentSpecificationMessage_pb2 as CompSpecMsg
@@ -44,10 +42,16 @@ class LibMirror(object):
         _lib_level_mirrors: dict, key is lib handler name, value is HAL
                             mirror object. internally, it uses a legacy_hal
                             mirror.
+        _clients: dict, key is lib handler name, value is the VtsTcpClient
+                  used by the lib mirror object.
+        _client_pool: VtsTcpClientPool, the pool to get clients from. None
+                      to connect a new client per lib.
     """
-    def __init__(self, host_command_port):
+    def __init__(self, host_command_port, client_pool=None):
         self._lib_level_mirrors = {}
+        self._clients = {}
         self._host_command_port = host_command_port
+        self._client_pool = client_pool
 
     def __del__(self):
         for lib_mirror_name in self._lib_level_mirrors:
@@ -89,6 +93,10 @@ class LibMirror(object):
                                  bits=bits)
 
     def RemoveLib(self, handler_name):
+        client = self._clients.pop(handler_name, None)
+        if self._client_pool and client:
+            self._client_pool.Release(client)
+            return
         lib_level_mirror = self._lib_level_mirrors[handler_name]
         lib_level_mirror.CleanUp()
 
@@ -123,10 +131,42 @@ class LibMirror(object):
         """
         if bits not in [32, 64]:
             raise error.ComponentLoadingError("Invalid value for bits: %s" % bits)
-        client = vts_tcp_client.VtsTcpClient()
-        client.Connect(command_port=self._host_command_port)
+        if self._client_pool:
+            client = self._client_pool.Acquire()
+        else:
+            client = vts_tcp_client.VtsTcpClient()
+            client.Connect(command_port=self._host_command_port)
         if not handler_name:
             handler_name = target_type
+        try:
+            lib_mirror = self._LaunchDriver(
+                client, target_class, target_type, target_version,
+                target_basepaths, target_package, target_filename,
+                handler_name, bits)
+        except:
+            if self._client_pool:
+                self._client_pool.Release(client, reusable=False)
+            else:
+                client.Disconnect()
+            raise
+        self._clients[handler_name] = client
+        self._lib_level_mirrors[handler_name] = lib_mirror
+
+    def _LaunchDriver(self, client, target_class, target_type, target_version,
+                      target_basepaths, target_package, target_filename,
+                      handler_name, bits):
+        """Launches the driver for a lib and creates its MirrorObject.
+
+        Args:
+            client: VtsTcpClient, the session to launch the driver with.
+            other args: see _CreateMirrorObject.
+
+        Returns:
+            MirrorObject, the top level mirror object of the lib.
+
+        Raises:
+            errors.ComponentLoadingError if the driver cannot be launched.
+        """
         service_name = "vts_driver_%s" % handler_name
 
         # Get all the libs available on the target.
@@ -184,11 +224,10 @@ class LibMirror(object):
         logging.debug("Found %d APIs for %s:\n%s", len(found_api_spec),
                       service_name, found_api_spec)
         if_spec_msg = CompSpecMsg.ComponentSpecificationMessage()
-        text_format.Merge(found_api_spec, if_spec_msg)
+        client.ParsePayload(found_api_spec, if_spec_msg)
 
         # Instantiate a MirrorObject and return it.
-        lib_mirror = mirror_object.MirrorObject(client, if_spec_msg, None)
-        self._lib_level_mirrors[handler_name] = lib_mirror
+        return mirror_object.MirrorObject(client, if_spec_msg, None)
 
     def __getattr__(self, name):
         return self._lib_level_mirrors[name]
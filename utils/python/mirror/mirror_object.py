@@ -20,9 +20,10 @@ import random
 import sys
 
 from vts.utils.python.fuzzer import FuzzerUtils
+from vts.utils.python.mirror import bulk_vector
 from vts.utils.python.mirror import mirror_object_for_types
+from vts.utils.python.mirror import py2pb
 from vts.proto import ComponentSpecificationMessage_pb2 as CompSpecMsg
-from google.protobuf import text_format
 
 # a dict containing the IDs of the registered function pointers.
 _function_pointer_id_dict = {}
@@ -53,6 +54,18 @@ class MirrorObject(object):
         _last_raw_code_coverage_data: NativeCodeCoverageRawDataMessage,
                                       last seen raw code coverage data.
         __caller_uid: string, the caller's UID if not None.
+        __vector_mode: string, bulk_vector.VECTOR_MODE_*, how the returned
+                       vectors and arrays of scalars are converted.
+        _api_index: dict of string to FunctionSpecificationMessage, the APIs
+                    by name. Built by the first lookup.
+        _call_templates: dict of string to FunctionCallMessage, the call
+                         message of each called API without its arguments.
+        _recorder: CallRecorder which records the calls if not None.
+        _recorder_spec_msg: ComponentSpecificationMessage of the interface
+                            the calls are recorded under.
+        _struct_specs: dict of string to VariableSpecificationMessage, the
+                       spec of each predefined struct type converted by
+                       ArgToPb. Kept so py2pb finds its compiled converter.
     """
 
     def __init__(self,
@@ -68,6 +81,12 @@ class MirrorObject(object):
         self._parent_path = parent_path
         self._last_raw_code_coverage_data = None
         self.__caller_uid = None
+        self.__vector_mode = bulk_vector.VECTOR_MODE_LIST
+        self._api_index = None
+        self._call_templates = {}
+        self._recorder = None
+        self._recorder_spec_msg = None
+        self._struct_specs = {}
 
     def GetFunctionPointerID(self, function_pointer):
         """Returns the function pointer ID for the given one."""
@@ -105,8 +124,7 @@ class MirrorObject(object):
             call_msg.api.return_type.scalar_type = "int32_t"
         logging.debug("final msg %s", call_msg)
 
-        result = self._client.CallApi(
-            text_format.MessageToString(call_msg), self.__caller_uid)
+        result = self._client.CallApi(call_msg, self.__caller_uid)
         logging.debug(result)
         return result
 
@@ -118,6 +136,53 @@ class MirrorObject(object):
         """
         self.__caller_uid = uid
 
+    def SetVectorMode(self, vector_mode):
+        """Sets how the vectors and arrays of scalars are returned.
+
+        A large vector, e.g., a vec<uint8_t> of a buffer, is much faster to
+        convert to a single bytes, array.array or numpy.ndarray than to a
+        list of Python values.
+
+        Args:
+            vector_mode: string, bulk_vector.VECTOR_MODE_*.
+
+        Raises:
+            errors.VtsUnsupportedTypeError if the mode is unknown.
+        """
+        bulk_vector.CheckVectorMode(vector_mode)
+        self.__vector_mode = vector_mode
+
+    def SetRecorder(self, recorder, if_spec_msg=None):
+        """Sets the recorder of the API calls.
+
+        The nested interfaces and sub structs obtained afterwards share the
+        recorder, so that the trace of a sequence keeps its order.
+
+        Args:
+            recorder: call_recorder.CallRecorder, or None to stop recording.
+            if_spec_msg: ComponentSpecificationMessage of the interface the
+                         calls are recorded under. None for this mirror's
+                         spec, e.g., a sub struct passes its interface's.
+        """
+        self._recorder = recorder
+        self._recorder_spec_msg = (self._if_spec_msg
+                                   if if_spec_msg is None else if_spec_msg)
+
+    def _RecordCall(self, recorder, call_msg, result):
+        """Records a call, logging rather than raising a recorder error since
+        the call itself succeeded.
+
+        Args:
+            recorder: call_recorder.CallRecorder.
+            call_msg: FunctionCallMessage sent to the agent.
+            result: the return value of the call.
+        """
+        try:
+            recorder.Record(self._recorder_spec_msg, self, call_msg, result)
+        except Exception as e:
+            logging.exception("Failed to record the call of %s: %s",
+                              call_msg.api.name, e)
+
     def GetAttributeValue(self, attribute_name):
         """Retrieves the value of an attribute from a target.
 
@@ -159,8 +224,7 @@ class MirrorObject(object):
             except AttributeError as e:
                 logging.exception("%s" % e)
                 pass
-            result = self._client.GetAttribute(
-                text_format.MessageToString(func_msg))
+            result = self._client.GetAttribute(func_msg)
             logging.debug(result)
             return result
 
@@ -271,15 +335,15 @@ class MirrorObject(object):
             msg.package if package is None else package,
             recursive=True)
 
-        found_api_spec = str(found_api_spec)
         logging.debug("found_api_spec %s", found_api_spec)
 
         if_spec_msg = CompSpecMsg.ComponentSpecificationMessage()
-        text_format.Merge(found_api_spec, if_spec_msg)
+        if_spec_msg.CopyFrom(found_api_spec)
 
         # Instantiate a MirrorObject and return it.
         hal_mirror = MirrorObject(
             self._client, if_spec_msg, None, hal_driver_id=hal_driver_id)
+        hal_mirror.SetRecorder(self._recorder)
         return hal_mirror
 
     def CleanUp(self):
@@ -295,36 +359,56 @@ class MirrorObject(object):
             FunctionSpecificationMessage or StructSpecificationMessage if found,
             None otherwise
         """
-        logging.debug("GetAPI %s for %s", api_name, self._if_spec_msg)
+        api = self._FindApi(api_name)
+        if api is None:
+            return None
+        result = CompSpecMsg.FunctionSpecificationMessage()
+        result.CopyFrom(api)
+        return result
+
+    def _FindApi(self, api_name):
+        """Looks up an API in the index without copying it.
+
+        Args:
+            api_name: string, the name of the target function API.
+
+        Returns:
+            FunctionSpecificationMessage which must not be modified, None if
+            not found.
+        """
         # handle reserved methods first.
         if api_name == "notifySyspropsChanged":
             func_msg = CompSpecMsg.FunctionSpecificationMessage()
             func_msg.name = api_name
             return func_msg
+        if self._api_index is None:
+            self._api_index = self._BuildApiIndex()
+        return self._api_index.get(api_name)
+
+    def _BuildApiIndex(self):
+        """Builds the index of the APIs of the mirrored spec.
+
+        Returns:
+            dict of string to FunctionSpecificationMessage. The first API of
+            a name wins, the same as a linear search.
+        """
+        index = {}
         if isinstance(self._if_spec_msg,
                       CompSpecMsg.ComponentSpecificationMessage):
-            if len(self._if_spec_msg.interface.api) > 0:
-                for api in self._if_spec_msg.interface.api:
-                    if api.name == api_name:
-                        return copy.copy(api)
+            for api in self._if_spec_msg.interface.api:
+                index.setdefault(api.name, api)
         elif isinstance(self._if_spec_msg,
                         CompSpecMsg.StructSpecificationMessage):
-            if len(self._if_spec_msg.api) > 0:
-                for api in self._if_spec_msg.api:
-                    logging.info("api %s", api)
-                    if api.name == api_name:
-                        return copy.copy(api)
-            if len(self._if_spec_msg.sub_struct) > 0:
-                for sub_struct in self._if_spec_msg.sub_struct:
-                    if len(sub_struct.api) > 0:
-                        for api in sub_struct.api:
-                            logging.info("api %s", api)
-                            if api.name == api_name:
-                                return copy.copy(api)
+            for api in self._if_spec_msg.api:
+                index.setdefault(api.name, api)
+            for sub_struct in self._if_spec_msg.sub_struct:
+                for api in sub_struct.api:
+                    index.setdefault(api.name, api)
         else:
             logging.error("unknown spec type %s", type(self._if_spec_msg))
             sys.exit(1)
-        return None
+        logging.debug("Indexed %d APIs", len(index))
+        return index
 
     def GetAttribute(self, attribute_name):
         """Returns the Message.
@@ -454,6 +538,10 @@ class MirrorObject(object):
         """
         if isinstance(value_msg, CompSpecMsg.VariableSpecificationMessage):
             arg_msg.CopyFrom(value_msg)
+        elif ((arg_msg.type == CompSpecMsg.TYPE_VECTOR or
+               arg_msg.type == CompSpecMsg.TYPE_ARRAY) and
+              bulk_vector.CanPyBulk2PbVector(arg_msg, value_msg)):
+            bulk_vector.PyBulk2PbVector(arg_msg, value_msg)
         elif isinstance(value_msg, int):
             arg_msg.type = CompSpecMsg.TYPE_SCALAR
             if not arg_msg.scalar_type:
@@ -487,10 +575,187 @@ class MirrorObject(object):
             else:
                 raise MirrorObjectError(
                     "unsupported arg_msg type %s for list" % arg_msg.type)
+        elif isinstance(value_msg, dict):
+            if arg_msg.type != CompSpecMsg.TYPE_STRUCT:
+                raise MirrorObjectError(
+                    "unsupported arg_msg type %s for dict" % arg_msg.type)
+            struct_spec = arg_msg
+            if not arg_msg.struct_value:
+                struct_spec = self._struct_specs.get(arg_msg.predefined_type)
+                if struct_spec is None:
+                    struct_spec = self.GetCustomAggregateType(
+                        arg_msg.predefined_type)
+                    if not struct_spec:
+                        raise MirrorObjectError("unknown struct type %s" %
+                                                arg_msg.predefined_type)
+                    self._struct_specs[arg_msg.predefined_type] = struct_spec
+            # py2pb compiles the converter once per struct type.
+            struct_msg = py2pb.Convert(struct_spec, value_msg)
+            del arg_msg.struct_value[:]
+            arg_msg.struct_value.extend(struct_msg.struct_value)
         else:
             raise MirrorObjectError("unsupported value type %s" %
                                     type(value_msg))
 
+    def _GetCallTemplate(self, api_name):
+        """Returns the call message of an API without any argument value.
+
+        The template is built once per API, so a call only copies it and
+        fills in the arguments.
+
+        Args:
+            api_name: string, the name of an API function to call.
+
+        Returns:
+            FunctionCallMessage which must not be modified.
+
+        Raises:
+            MirrorObjectError if the API is unknown.
+        """
+        call_msg = self._call_templates.get(api_name)
+        if call_msg is not None:
+            return call_msg
+
+        api = self._FindApi(api_name)
+        if not api:
+            raise MirrorObjectError("api %s unknown" % api_name)
+        call_msg = CompSpecMsg.FunctionCallMessage()
+        func_msg = call_msg.api
+        func_msg.CopyFrom(api)
+        if self._parent_path:
+            func_msg.parent_path = self._parent_path
+
+        if isinstance(self._if_spec_msg,
+                      CompSpecMsg.ComponentSpecificationMessage):
+            if self._if_spec_msg.component_class:
+                logging.info("component_class %s",
+                             self._if_spec_msg.component_class)
+                call_msg.component_class = self._if_spec_msg.component_class
+                if self._if_spec_msg.component_class == CompSpecMsg.HAL_CONVENTIONAL_SUBMODULE:
+                    submodule_name = self._if_spec_msg.original_data_structure_name
+                    if submodule_name.endswith("*"):
+                        submodule_name = submodule_name[:-1]
+                    func_msg.submodule_name = submodule_name
+        if self._hal_driver_id is not None:
+            call_msg.hal_driver_id = self._hal_driver_id
+        self._call_templates[api_name] = call_msg
+        return call_msg
+
+    def _CreateCallMessage(self, api_name, args):
+        """Creates the message to call a remote API.
+
+        Args:
+            api_name: string, the name of an API function to call.
+            args: a list of arguments.
+
+        Returns:
+            FunctionCallMessage.
+
+        Raises:
+            MirrorObjectError if the API is unknown.
+        """
+        call_msg = CompSpecMsg.FunctionCallMessage()
+        call_msg.CopyFrom(self._GetCallTemplate(api_name))
+
+        logging.debug("remote call %s.%s%s", self._parent_path, api_name,
+                      args)
+        if args:
+            for arg_msg, value_msg in zip(call_msg.api.arg, args):
+                if value_msg is not None:
+                    self.ArgToPb(arg_msg, value_msg)
+        else:
+            # TODO: use kwargs
+            for arg in call_msg.api.arg:
+                # TODO: handle other
+                if (arg.type == CompSpecMsg.TYPE_SCALAR and
+                        arg.scalar_type == "pointer"):
+                    arg.scalar_value.pointer = 0
+        # Formatted lazily, i.e., only if DEBUG logging is enabled.
+        logging.debug("final msg %s", call_msg.api)
+        return call_msg
+
+    def _HandleCallResult(self, result):
+        """Converts the result of CALL_API to the return value of a remote call.
+
+        Args:
+            result: the value returned by the client's CallApi.
+
+        Returns:
+            the return value of the remote API.
+        """
+        logging.debug(result)
+        if (isinstance(result, tuple) and len(result) == 2 and
+                isinstance(result[1], dict) and "coverage" in result[1]):
+            self._last_raw_code_coverage_data = result[1]["coverage"]
+            result = result[0]
+
+        if (result and isinstance(
+                result, CompSpecMsg.VariableSpecificationMessage) and
+                result.type == CompSpecMsg.TYPE_HIDL_INTERFACE):
+            if result.hidl_interface_id <= -1:
+                return None
+            hal_driver_id = result.hidl_interface_id
+            nested_interface_name = result.predefined_type.split("::")[-1]
+            logging.debug("Nested interface name: %s",
+                          nested_interface_name)
+            nested_interface = self.GetHidlNestedInterface(
+                nested_interface_name, hal_driver_id)
+            return nested_interface
+        return result
+
+    def Call(self, api_name, *args):
+        """Calls a target component's API.
+
+        Args:
+            api_name: string, the name of an API function to call.
+            *args: a list of arguments.
+
+        Returns:
+            the return value of the remote API.
+
+        Raises:
+            MirrorObjectError if the API is unknown.
+        """
+        call_msg = self._CreateCallMessage(api_name, args)
+        result = self._client.CallApi(call_msg, self.__caller_uid,
+                                      self.__vector_mode)
+        result = self._HandleCallResult(result)
+        if self._recorder:
+            self._RecordCall(self._recorder, call_msg, result)
+        return result
+
+    def RemoteCallAsync(self, api_name, *args):
+        """Calls a target component's API without waiting for the result.
+
+        The calls are pipelined on the TCP session so that a sequence of calls
+        does not wait a round trip per call.
+
+        Args:
+            api_name: string, the name of an API function to call.
+            *args: a list of arguments.
+
+        Returns:
+            VtsTcpPendingResponse whose result() is the remote API's return
+            value.
+        """
+        call_msg = self._CreateCallMessage(api_name, args)
+        handler = self._HandleCallResult
+        if self._recorder:
+            recorder = self._recorder
+
+            def handler(result):
+                # Responses arrive in the order of the calls, so the records
+                # do too.
+                result = self._HandleCallResult(result)
+                self._RecordCall(recorder, call_msg, result)
+                return result
+
+        return self._client.CallApiAsync(
+            call_msg,
+            self.__caller_uid,
+            handler=handler,
+            vector_mode=self.__vector_mode)
+
     # TODO: Guard against calls to this function after self.CleanUp is called.
     def __getattr__(self, api_name, *args, **kwargs):
         """Calls a target component's API.
@@ -503,68 +768,7 @@ class MirrorObject(object):
 
         def RemoteCall(*args, **kwargs):
             """Dynamically calls a remote API and returns the result value."""
-            func_msg = self.GetApi(api_name)
-            if not func_msg:
-                raise MirrorObjectError("api %s unknown", func_msg)
-
-            logging.debug("remote call %s.%s", self._parent_path, api_name)
-            logging.info("remote call %s%s", api_name, args)
-            if args:
-                for arg_msg, value_msg in zip(func_msg.arg, args):
-                    logging.debug("arg msg %s", arg_msg)
-                    logging.debug("value %s", value_msg)
-                    if value_msg is not None:
-                        self.ArgToPb(arg_msg, value_msg)
-
-                logging.debug("final msg %s", func_msg)
-            else:
-                # TODO: use kwargs
-                for arg in func_msg.arg:
-                    # TODO: handle other
-                    if (arg.type == CompSpecMsg.TYPE_SCALAR and
-                            arg.scalar_type == "pointer"):
-                        arg.scalar_value.pointer = 0
-                logging.debug(func_msg)
-
-            if self._parent_path:
-                func_msg.parent_path = self._parent_path
-
-            call_msg = CompSpecMsg.FunctionCallMessage()
-            if isinstance(self._if_spec_msg,
-                          CompSpecMsg.ComponentSpecificationMessage):
-                if self._if_spec_msg.component_class:
-                    logging.info("component_class %s",
-                                 self._if_spec_msg.component_class)
-                    call_msg.component_class = self._if_spec_msg.component_class
-                    if self._if_spec_msg.component_class == CompSpecMsg.HAL_CONVENTIONAL_SUBMODULE:
-                        submodule_name = self._if_spec_msg.original_data_structure_name
-                        if submodule_name.endswith("*"):
-                            submodule_name = submodule_name[:-1]
-                        func_msg.submodule_name = submodule_name
-            if self._hal_driver_id is not None:
-                call_msg.hal_driver_id = self._hal_driver_id
-            call_msg.api.CopyFrom(func_msg)
-            result = self._client.CallApi(
-                text_format.MessageToString(call_msg), self.__caller_uid)
-            logging.debug(result)
-            if (isinstance(result, tuple) and len(result) == 2 and
-                    isinstance(result[1], dict) and "coverage" in result[1]):
-                self._last_raw_code_coverage_data = result[1]["coverage"]
-                result = result[0]
-
-            if (result and isinstance(
-                    result, CompSpecMsg.VariableSpecificationMessage) and
-                    result.type == CompSpecMsg.TYPE_HIDL_INTERFACE):
-                if result.hidl_interface_id <= -1:
-                    return None
-                hal_driver_id = result.hidl_interface_id
-                nested_interface_name = result.predefined_type.split("::")[-1]
-                logging.debug("Nested interface name: %s",
-                              nested_interface_name)
-                nested_interface = self.GetHidlNestedInterface(
-                    nested_interface_name, hal_driver_id)
-                return nested_interface
-            return result
+            return self.Call(api_name, *args)
 
         def MessageGenerator(*args, **kwargs):
             """Dynamically generates a custom message instance."""
@@ -681,9 +885,8 @@ class MirrorObject(object):
             raise MirrorObjectError("const %s not found" % api_name)
 
         # handle APIs.
-        func_msg = self.GetApi(api_name)
-        if func_msg:
-            logging.debug("api %s", func_msg)
+        if self._FindApi(api_name):
+            logging.debug("api %s", api_name)
             return RemoteCall
 
         struct_msg = self.GetSubStruct(api_name)
@@ -693,11 +896,14 @@ class MirrorObject(object):
                 parent_name = "%s.%s" % (self._parent_path, api_name)
             else:
                 parent_name = api_name
-            return MirrorObject(
+            sub_struct_mirror = MirrorObject(
                 self._client,
                 struct_msg,
                 self._callback_server,
                 parent_path=parent_name)
+            sub_struct_mirror.SetRecorder(self._recorder,
+                                          self._recorder_spec_msg)
+            return sub_struct_mirror
 
         # handle attributes.
         fuzz = False
@@ -15,9 +15,10 @@
 #
 
 import logging
-import sys
 
 from vts.proto import ComponentSpecificationMessage_pb2 as CompSpecMsg
+from vts.runners.host import errors
+from vts.utils.python.mirror import bulk_vector
 
 
 def PbEnum2PyValue(var):
@@ -77,16 +78,7 @@ def PbVector2PyList(var):
     Returns:
         A converted list.
     """
-    result = []
-    for curr_value in var.vector_value:
-        if curr_value.type == CompSpecMsg.TYPE_SCALAR:
-            result.append(PbScalar2PyValue(curr_value))
-        elif curr_value.type == CompSpecMsg.TYPE_STRUCT:
-            result.append(PbStruct2PyDict(curr_value))
-        else:
-            logging.error("unsupported type %s", curr_value.type)
-            sys.exit(-1)
-    return result
+    return _CompileVector(var, bulk_vector.VECTOR_MODE_LIST)(var)
 
 
 def PbArray2PyList(var):
@@ -98,16 +90,7 @@ def PbArray2PyList(var):
     Returns:
         A converted list.
     """
-    result = []
-    for curr_value in var.vector_value:
-        if curr_value.type == CompSpecMsg.TYPE_SCALAR:
-            result.append(PbScalar2PyValue(curr_value))
-        elif curr_value.type == CompSpecMsg.TYPE_STRUCT:
-            result.append(PbStruct2PyDict(curr_value))
-        else:
-            logging.error("unsupported type %s", curr_value.type)
-            sys.exit(-1)
-    return result
+    return _CompileVector(var, bulk_vector.VECTOR_MODE_LIST)(var)
 
 
 def PbStruct2PyDict(var):
@@ -119,25 +102,7 @@ def PbStruct2PyDict(var):
     Returns:
         a dict, containing the converted data.
     """
-    result = {}
-    for attr in var.struct_value:
-        if attr.type == CompSpecMsg.TYPE_ENUM:
-            result[attr.name] = PbEnum2PyValue(attr)
-        elif attr.type == CompSpecMsg.TYPE_SCALAR:
-            result[attr.name] = PbScalar2PyValue(attr)
-        elif attr.type == CompSpecMsg.TYPE_STRING:
-            result[attr.name] = PbString2PyString(attr)
-        elif attr.type == CompSpecMsg.TYPE_VECTOR:
-            result[attr.name] = PbVector2PyList(attr)
-        elif attr.type == CompSpecMsg.TYPE_STRUCT:
-            result[attr.name] = PbStruct2PyDict(attr)
-        elif attr.type == CompSpecMsg.TYPE_Array:
-            result[attr.name] = PbArray2PyList(attr)
-        else:
-            logging.error("PyDict2PbStruct: unsupported type %s",
-                          attr.type)
-            sys.exit(-1)
-    return result
+    return _CompileStruct(var, bulk_vector.VECTOR_MODE_LIST)(var)
 
 
 def PbPredefined2PyValue(var):
@@ -152,31 +117,122 @@ def PbPredefined2PyValue(var):
     return var.predefined_type
 
 
-def Convert(var):
+def _CompileScalar(var, vector_mode):
+    """Returns a converter of the scalars of var's scalar type."""
+    scalar_type = var.scalar_type
+
+    def ConvertScalar(value):
+        return getattr(value.scalar_value, scalar_type)
+
+    return ConvertScalar
+
+
+def _CompileVector(var, vector_mode):
+    """Returns a converter of the vectors or arrays shaped like var.
+
+    The elements are homogeneous, so the element converter is compiled from
+    the first element converted and reused for all the others. Scalar
+    elements are converted in bulk unless vector_mode is VECTOR_MODE_LIST,
+    with the element type of var so that an empty vector is converted too.
+    """
+    element_converter = []
+
+    def ConvertVector(value):
+        bulk = bulk_vector.PbVector2PyBulk(value, vector_mode, var)
+        if bulk is not None:
+            return bulk
+        elements = value.vector_value
+        if not elements:
+            return []
+        if not element_converter:
+            element_converter.append(
+                CompileConverter(elements[0], vector_mode))
+        convert = element_converter[0]
+        return [convert(element) for element in elements]
+
+    return ConvertVector
+
+
+def _CompileStruct(var, vector_mode):
+    """Returns a converter of the structs shaped like var.
+
+    A struct whose fields differ from var's is converted field by field.
+    """
+    field_names = [attr.name for attr in var.struct_value]
+    field_converters = [
+        CompileConverter(attr, vector_mode) for attr in var.struct_value
+    ]
+
+    def ConvertStruct(value):
+        fields = value.struct_value
+        if len(fields) == len(field_names):
+            result = {}
+            for attr, name, convert in zip(fields, field_names,
+                                           field_converters):
+                if attr.name != name:
+                    break
+                result[name] = convert(attr)
+            else:
+                return result
+        return dict((attr.name, Convert(attr, vector_mode))
+                    for attr in fields)
+
+    return ConvertStruct
+
+
+_COMPILERS = {
+    CompSpecMsg.TYPE_PREDEFINED: lambda var, mode: PbPredefined2PyValue,
+    CompSpecMsg.TYPE_SCALAR: _CompileScalar,
+    CompSpecMsg.TYPE_ENUM: _CompileScalar,
+    CompSpecMsg.TYPE_MASK: _CompileScalar,
+    CompSpecMsg.TYPE_STRING: lambda var, mode: PbString2PyString,
+    CompSpecMsg.TYPE_VECTOR: _CompileVector,
+    CompSpecMsg.TYPE_ARRAY: _CompileVector,
+    CompSpecMsg.TYPE_STRUCT: _CompileStruct,
+}
+
+
+def CompileConverter(var, vector_mode=bulk_vector.VECTOR_MODE_LIST):
+    """Compiles a converter of the VariableSpecificationMessages shaped like
+    a given one.
+
+    The type dispatch is done once here, so the returned function converts
+    any number of values, e.g., the arguments of every call of a callback,
+    in a single pass.
+
+    Args:
+        var: VariableSpecificationMessage, the template.
+        vector_mode: string, bulk_vector.VECTOR_MODE_*, how the vectors and
+                     arrays of scalars are returned.
+
+    Returns:
+        function which takes a VariableSpecificationMessage of the same type
+        and returns the Python value.
+
+    Raises:
+        errors.VtsUnsupportedTypeError if the type is not supported.
+    """
+    bulk_vector.CheckVectorMode(vector_mode)
+    compiler = _COMPILERS.get(var.type)
+    if compiler is None:
+        logging.error("Got unsupported callback arg type %s", var.type)
+        raise errors.VtsUnsupportedTypeError(
+            "Unsupported VariableSpecificationMessage type %s" % var.type)
+    return compiler(var, vector_mode)
+
+
+def Convert(var, vector_mode=bulk_vector.VECTOR_MODE_LIST):
     """Converts VariableSecificationMessage to Python native data structure.
 
     Args:
         var: VariableSpecificationMessage of a target variable to convert.
+        vector_mode: string, bulk_vector.VECTOR_MODE_*, how the vectors and
+                     arrays of scalars are returned.
 
     Returns:
         A list containing the converted Python values.
+
+    Raises:
+        errors.VtsUnsupportedTypeError if the type is not supported.
     """
-    if var.type == CompSpecMsg.TYPE_PREDEFINED:
-        return PbPredefined2PyValue(var)
-    elif var.type == CompSpecMsg.TYPE_SCALAR:
-        return PbScalar2PyValue(var)
-    elif var.type == CompSpecMsg.TYPE_VECTOR:
-        return PbVector2PyList(var)
-    elif var.type == CompSpecMsg.TYPE_STRUCT:
-        return PbStruct2PyDict(var)
-    elif var.type == CompSpecMsg.TYPE_ENUM:
-        return PbEnum2PyValue(var)
-    elif var.type == CompSpecMsg.TYPE_STRING:
-        return PbString2PyString(var)
-    elif var.type == CompSpecMsg.TYPE_MASK:
-        return PbMask2PyValue(var)
-    else:
-        logging.error("Got unsupported callback arg type %s" % var.type)
-        sys.exit(-1)
-
-    return message
+    return CompileConverter(var, vector_mode)(var)
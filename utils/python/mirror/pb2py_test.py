@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2017 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+
+from vts.proto import ComponentSpecificationMessage_pb2 as CompSpecMsg
+from vts.runners.host import errors
+from vts.utils.python.mirror import pb2py
+
+
+def _Scalar(name, value, scalar_type="int32_t"):
+    """Returns a scalar message."""
+    msg = CompSpecMsg.VariableSpecificationMessage()
+    msg.name = name
+    msg.type = CompSpecMsg.TYPE_SCALAR
+    msg.scalar_type = scalar_type
+    setattr(msg.scalar_value, scalar_type, value)
+    return msg
+
+
+def _Vector(name, elements, vector_type=CompSpecMsg.TYPE_VECTOR):
+    """Returns a vector or array message of the given elements."""
+    msg = CompSpecMsg.VariableSpecificationMessage()
+    msg.name = name
+    msg.type = vector_type
+    for element in elements:
+        msg.vector_value.add().CopyFrom(element)
+    msg.vector_size = len(elements)
+    return msg
+
+
+def _Struct(name, *fields):
+    """Returns a struct message of the given fields."""
+    msg = CompSpecMsg.VariableSpecificationMessage()
+    msg.name = name
+    msg.type = CompSpecMsg.TYPE_STRUCT
+    for field in fields:
+        msg.struct_value.add().CopyFrom(field)
+    return msg
+
+
+class Pb2PyTest(unittest.TestCase):
+    """Tests the conversion of specification messages to Python values."""
+
+    def testScalarAndString(self):
+        """Tests the conversion of a scalar, an enum and a string."""
+        self.assertEqual(pb2py.Convert(_Scalar("x", 3)), 3)
+
+        enum = _Scalar("e", 2, "uint32_t")
+        enum.type = CompSpecMsg.TYPE_ENUM
+        self.assertEqual(pb2py.Convert(enum), 2)
+
+        string = CompSpecMsg.VariableSpecificationMessage()
+        string.type = CompSpecMsg.TYPE_STRING
+        string.string_value.message = "abc"
+        self.assertEqual(pb2py.Convert(string), "abc")
+
+    def testStruct(self):
+        """Tests a nested struct."""
+        msg = _Struct("Line", _Struct("begin", _Scalar("x", 1)),
+                      _Struct("end", _Scalar("x", 2)),
+                      _Vector("tags", [_Scalar("", 5)]))
+        self.assertEqual(
+            pb2py.Convert(msg),
+            {"begin": {"x": 1}, "end": {"x": 2}, "tags": [5]})
+
+    def testCompiledConverter(self):
+        """Tests that a compiled converter takes values of the same type,
+        including the structs whose fields differ from the template."""
+        convert = pb2py.CompileConverter(
+            _Struct("S", _Scalar("x", 1), _Scalar("y", 2)))
+        self.assertEqual(
+            convert(_Struct("S", _Scalar("x", 3), _Scalar("y", 4))),
+            {"x": 3, "y": 4})
+        self.assertEqual(convert(_Struct("S", _Scalar("y", 5))), {"y": 5})
+
+    def testVectorAndArray(self):
+        """Tests vectors and arrays of scalars and of structs."""
+        for vector_type in (CompSpecMsg.TYPE_VECTOR, CompSpecMsg.TYPE_ARRAY):
+            msg = _Vector("v", [_Scalar("", 1), _Scalar("", 2)], vector_type)
+            self.assertEqual(pb2py.Convert(msg), [1, 2])
+            self.assertEqual(pb2py.Convert(_Vector("v", [], vector_type)),
+                             [])
+        msg = _Vector("v", [_Struct("", _Scalar("x", 1)),
+                            _Struct("", _Scalar("x", 2))])
+        self.assertEqual(pb2py.Convert(msg), [{"x": 1}, {"x": 2}])
+
+    def testUnsupportedType(self):
+        """Tests that an unsupported type raises an error."""
+        msg = CompSpecMsg.VariableSpecificationMessage()
+        msg.type = CompSpecMsg.TYPE_HANDLE
+        with self.assertRaises(errors.VtsUnsupportedTypeError):
+            pb2py.Convert(msg)
+        with self.assertRaises(errors.VtsUnsupportedTypeError):
+            pb2py.Convert(_Struct("S", msg))
+
+
+if __name__ == "__main__":
+    unittest.main()
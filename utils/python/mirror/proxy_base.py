@@ -0,0 +1,119 @@
+#
+# Copyright (C) 2017 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Base classes of the proxy modules generated by proxy_generator."""
+
+import threading
+
+from google.protobuf import text_format
+from vts.proto import ComponentSpecificationMessage_pb2 as CompSpecMsg
+from vts.utils.python.mirror import mirror_object
+from vts.utils.python.mirror import py2pb
+
+
+class ProxyBase(object):
+    """Calls the APIs of a HAL through concrete methods.
+
+    A generated subclass has one method per API, which calls the API through
+    the MirrorObject the proxy is bound to.
+
+    Attributes:
+        COMPONENT_NAME: string, the name of the interface, e.g., INfc.
+        API_NAMES: tuple of strings, the APIs the subclass has methods for.
+        _mirror: MirrorObject, the transport of the calls.
+    """
+    COMPONENT_NAME = None
+    API_NAMES = ()
+
+    def __init__(self, mirror):
+        """Binds the proxy to a mirror.
+
+        Args:
+            mirror: MirrorObject of the interface.
+
+        Raises:
+            mirror_object.MirrorObjectError if the interface the mirror was
+            created from lacks any of the proxy's APIs, i.e., the proxy was
+            generated from other specs than the ones on the device.
+        """
+        missing = [name for name in self.API_NAMES if not mirror.GetApi(name)]
+        if missing:
+            raise mirror_object.MirrorObjectError(
+                "%s is missing APIs %s; regenerate the proxy." %
+                (self.COMPONENT_NAME, ", ".join(missing)))
+        self._mirror = mirror
+
+    def GetMirror(self):
+        """Returns the MirrorObject the proxy is bound to."""
+        return self._mirror
+
+
+class StructBuilder(object):
+    """Builds the messages of a struct type from keyword arguments.
+
+    Attributes:
+        type_name: string, the full name of the struct type.
+        _spec_text: string, the VariableSpecificationMessage of the type in
+                    text format.
+        _struct_types: dict of string to string, the name and spec text of
+                       every top-level struct of the module, shared by its
+                       builders. The fields of other struct types are
+                       resolved from it.
+        _converter: function which converts the fields to a message,
+                    compiled when the first message is built.
+        _lock: Lock, guards _converter.
+    """
+
+    def __init__(self, type_name, spec_text, struct_types=None):
+        self.type_name = type_name
+        self._spec_text = spec_text
+        self._struct_types = {} if struct_types is None else struct_types
+        self._struct_types[type_name] = spec_text
+        self._converter = None
+        self._lock = threading.Lock()
+
+    def _GetConverter(self):
+        """Parses the spec and compiles its converter.
+
+        The other top-level structs of the module are added to the spec's
+        sub_struct, after the ones the type defines itself, so that py2pb
+        finds the types its fields refer to.
+        """
+        spec = CompSpecMsg.VariableSpecificationMessage()
+        text_format.Merge(self._spec_text, spec)
+        sub_struct_names = set(sub_struct.name
+                               for sub_struct in spec.sub_struct)
+        for type_name, spec_text in sorted(self._struct_types.items()):
+            if type_name == self.type_name or type_name in sub_struct_names:
+                continue
+            text_format.Merge(spec_text, spec.sub_struct.add())
+        return py2pb.GetConverter(spec)
+
+    def __call__(self, **fields):
+        """Builds a message.
+
+        Args:
+            **fields: the values of the struct's fields by name.
+
+        Returns:
+            VariableSpecificationMessage, which can be passed to an API.
+
+        Raises:
+            errors.VtsUnsupportedTypeError if a field is unknown.
+        """
+        with self._lock:
+            if self._converter is None:
+                self._converter = self._GetConverter()
+        return self._converter(fields)
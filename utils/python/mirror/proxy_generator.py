@@ -0,0 +1,256 @@
+#
+# Copyright (C) 2017 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Generates Python proxy modules from .vts specs.
+
+A proxy module has a class per enum, a constant per const, a StructBuilder
+per struct and, if the spec has an interface, a ProxyBase subclass with a
+method per API. For example:
+
+    python proxy_generator.py <vts data dir> nfc 1.0 <output dir>
+
+writes output_dir/INfc.py, output_dir/types.py and so on. A test then calls
+    proxy = INfc.INfcProxy(self.dut.hal.nfc)
+    proxy.open(callback)
+and a misspelled API fails when the module is loaded by a linter or when the
+proxy is bound, not in the middle of the test.
+"""
+
+import keyword
+import logging
+import os
+import re
+import sys
+
+from google.protobuf import text_format
+from vts.proto import ComponentSpecificationMessage_pb2 as CompSpecMsg
+from vts.utils.python.common import vts_spec_utils
+
+_INDENT = "    "
+
+
+def _PyName(name):
+    """Returns a Python identifier for a HIDL name.
+
+    Args:
+        name: string, e.g., ::android::hardware::nfc::V1_0::NfcEvent.
+
+    Returns:
+        string, e.g., NfcEvent.
+    """
+    name = re.sub(r"\W", "_", name.split("::")[-1])
+    if not name or name[0].isdigit():
+        name = "_" + name
+    if keyword.iskeyword(name):
+        name += "_"
+    return name
+
+
+def _PyLiteral(scalar_value, scalar_type):
+    """Returns the Python literal of a scalar value.
+
+    Args:
+        scalar_value: ScalarDataValueMessage.
+        scalar_type: string, the field of the value.
+
+    Returns:
+        string, e.g., 3, or None if the value is not set.
+    """
+    if not scalar_type:
+        return None
+    value = getattr(scalar_value, scalar_type, None)
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return repr(value)
+    if isinstance(value, float):
+        return repr(value)
+    return "%d" % value
+
+
+def _GenerateEnum(attribute):
+    """Returns the lines of an enum class."""
+    enum_value = attribute.enum_value
+    lines = [
+        "class %s(object):" % _PyName(attribute.name),
+        '%s"""Enum %s."""' % (_INDENT, attribute.name)
+    ]
+    for enumerator, scalar_value in zip(enum_value.enumerator,
+                                        enum_value.scalar_value):
+        literal = _PyLiteral(scalar_value, enum_value.scalar_type)
+        if literal is not None:
+            lines.append("%s%s = %s" % (_INDENT, _PyName(enumerator),
+                                        literal))
+    return lines
+
+
+def _GenerateConst(attribute):
+    """Returns the line of a constant, None if its type is unsupported."""
+    if attribute.type == CompSpecMsg.TYPE_SCALAR:
+        literal = _PyLiteral(attribute.scalar_value, attribute.scalar_type)
+    elif attribute.type == CompSpecMsg.TYPE_STRING:
+        literal = repr(attribute.string_value.message)
+    else:
+        literal = None
+    if literal is None:
+        return None
+    return "%s = %s" % (_PyName(attribute.name), literal)
+
+
+def _GenerateStructBuilder(attribute):
+    """Returns the lines of a StructBuilder."""
+    return [
+        "%s = proxy_base.StructBuilder(" % _PyName(attribute.name),
+        "%s%r," % (_INDENT, attribute.name),
+        "%s%r," % (_INDENT, text_format.MessageToString(attribute)),
+        "%s_STRUCT_TYPES)" % _INDENT,
+    ]
+
+
+def _GetArgTypeName(arg):
+    """Returns the type name of an API argument for the docstring."""
+    if arg.type == CompSpecMsg.TYPE_SCALAR:
+        return arg.scalar_type
+    if arg.predefined_type:
+        return _PyName(arg.predefined_type)
+    return CompSpecMsg.VariableType.Name(arg.type)
+
+
+def _GenerateProxyClass(spec, component_name):
+    """Returns the lines of the proxy class of an interface."""
+    class_name = _PyName(component_name) + "Proxy"
+    api_names = []
+    methods = []
+    for api in spec.interface.api:
+        if api.name in api_names:
+            continue
+        api_names.append(api.name)
+        arg_types = ", ".join(_GetArgTypeName(arg) for arg in api.arg)
+        methods.extend([
+            "",
+            "%sdef %s(self, *args):" % (_INDENT, _PyName(api.name)),
+            '%s"""Calls %s(%s)."""' % (_INDENT * 2, api.name, arg_types),
+            "%sreturn self._mirror.Call(%r, *args)" % (_INDENT * 2,
+                                                       api.name),
+        ])
+    lines = [
+        "class %s(proxy_base.ProxyBase):" % class_name,
+        '%s"""Proxy of %s@%s::%s."""' % (_INDENT, spec.package,
+                                         spec.component_type_version,
+                                         component_name),
+        "",
+        "%sCOMPONENT_NAME = %r" % (_INDENT, component_name),
+        "%sAPI_NAMES = (" % _INDENT,
+    ]
+    lines.extend("%s%r," % (_INDENT * 2, name) for name in api_names)
+    lines.append("%s)" % _INDENT)
+    lines.extend(methods)
+    return lines
+
+
+def GenerateProxyModule(spec, component_name=None):
+    """Generates the source code of a proxy module.
+
+    Only the top-level types of the spec are generated; the types nested in
+    a struct are built as part of it.
+
+    Args:
+        spec: ComponentSpecificationMessage, parsed from a .vts file.
+        component_name: string, the name of the component, e.g., INfc or
+                        types. Defaults to spec.component_name.
+
+    Returns:
+        string, the Python source code.
+    """
+    component_name = component_name or spec.component_name
+    attributes = list(spec.attribute) + list(spec.interface.attribute)
+    lines = [
+        "#",
+        "# Generated by vts.utils.python.mirror.proxy_generator from",
+        "# %s@%s::%s. Do not edit." % (spec.package,
+                                       spec.component_type_version,
+                                       component_name),
+        "#",
+        "",
+        "from vts.utils.python.mirror import proxy_base",
+        "",
+        "PACKAGE = %r" % spec.package,
+        "VERSION = %r" % spec.component_type_version,
+        "COMPONENT_NAME = %r" % component_name,
+    ]
+
+    if any(attribute.type == CompSpecMsg.TYPE_STRUCT and
+           not attribute.is_const for attribute in attributes):
+        # The specs of the module's structs, by name, for the builders to
+        # resolve the struct types of their fields.
+        lines.extend(["", "_STRUCT_TYPES = {}"])
+
+    consts = []
+    for attribute in attributes:
+        if attribute.is_const:
+            line = _GenerateConst(attribute)
+            if line:
+                consts.append(line)
+        elif attribute.type == CompSpecMsg.TYPE_ENUM:
+            lines.extend(["", ""] + _GenerateEnum(attribute))
+        elif attribute.type == CompSpecMsg.TYPE_STRUCT:
+            lines.extend(["", ""] + _GenerateStructBuilder(attribute))
+    if consts:
+        lines.extend([""] + consts)
+
+    if spec.interface.api:
+        lines.extend(["", ""] + _GenerateProxyClass(spec, component_name))
+    return "\n".join(lines) + "\n"
+
+
+def GenerateProxyModules(data_file_path, hal_name, hal_version, output_dir):
+    """Generates a proxy module per .vts spec of a HAL.
+
+    Args:
+        data_file_path: string, the vts data directory, which VtsSpecParser
+                        looks up the specs in.
+        hal_name: string, name of the hal, e.g. 'nfc'.
+        hal_version: string, version of the hal, e.g '1.0'.
+        output_dir: string, the package directory the modules are written
+                    to.
+
+    Returns:
+        list of strings, the paths of the generated modules.
+    """
+    parser = vts_spec_utils.VtsSpecParser(data_file_path)
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    init_path = os.path.join(output_dir, "__init__.py")
+    if not os.path.exists(init_path):
+        open(init_path, "w").close()
+
+    paths = []
+    for vts_spec_name in parser.VtsSpecNames(hal_name, hal_version):
+        spec = parser.VtsSpecProto(hal_name, hal_version, vts_spec_name)
+        component_name = os.path.splitext(vts_spec_name)[0]
+        path = os.path.join(output_dir, "%s.py" % _PyName(component_name))
+        with open(path, "w") as module_file:
+            module_file.write(GenerateProxyModule(spec, component_name))
+        logging.info("Generated %s", path)
+        paths.append(path)
+    return paths
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 5:
+        print("usage: proxy_generator.py <vts data dir> <hal name> "
+              "<hal version> <output dir>")
+    else:
+        GenerateProxyModules(*sys.argv[1:])
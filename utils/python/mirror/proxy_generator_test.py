@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2017 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import unittest
+
+from google.protobuf import text_format
+from vts.proto import ComponentSpecificationMessage_pb2 as CompSpecMsg
+from vts.utils.python.mirror import pb2py
+from vts.utils.python.mirror import proxy_generator
+
+_SPEC_DIR = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "..", "..", "..",
+    "specification")
+
+# A struct which refers to a top-level struct of LightHalV1.vts.
+_LIGHT_SEQUENCE_SPEC = """
+name: "light_sequence_t"
+type: TYPE_STRUCT
+struct_value: {
+  name: "first"
+  type: TYPE_STRUCT
+  predefined_type: "light_state_t"
+}
+struct_value: {
+  name: "steps"
+  type: TYPE_VECTOR
+  vector_value: {
+    type: TYPE_STRUCT
+    predefined_type: "light_state_t"
+  }
+}
+"""
+
+
+def _LoadSpec(*path):
+    """Parses a checked-in .vts file."""
+    spec = CompSpecMsg.ComponentSpecificationMessage()
+    with open(os.path.join(_SPEC_DIR, *path)) as spec_file:
+        text_format.Merge(spec_file.read(), spec)
+    return spec
+
+
+def _LoadModule(spec, component_name):
+    """Generates a proxy module and returns its namespace."""
+    source = proxy_generator.GenerateProxyModule(spec, component_name)
+    namespace = {}
+    exec(compile(source, "%s.py" % component_name, "exec"), namespace)
+    return namespace
+
+
+class ProxyGeneratorTest(unittest.TestCase):
+    """Tests the proxy modules generated from the checked-in specs."""
+
+    def setUp(self):
+        self._light_spec = _LoadSpec("hal", "conventional", "light", "1.0",
+                                     "LightHalV1.vts")
+
+    def testLightHal(self):
+        """Tests the proxy class and struct builder of a HAL."""
+        module = _LoadModule(self._light_spec, "LightHalV1")
+        self.assertEqual(module["COMPONENT_NAME"], "LightHalV1")
+        self.assertIn("set_light", module["LightHalV1Proxy"].API_NAMES)
+
+        msg = module["light_state_t"](color=0xff, flashMode=1)
+        self.assertEqual(msg.type, CompSpecMsg.TYPE_STRUCT)
+        self.assertEqual(pb2py.Convert(msg), {"color": 0xff, "flashMode": 1})
+
+    def testStructReferringToTopLevelStruct(self):
+        """Tests a builder whose fields are another top-level struct."""
+        text_format.Merge(_LIGHT_SEQUENCE_SPEC,
+                          self._light_spec.interface.attribute.add())
+        module = _LoadModule(self._light_spec, "LightHalV1")
+
+        state = {"color": 1, "flashOnMs": 100}
+        value = {"first": state, "steps": [state, {"color": 2}]}
+        msg = module["light_sequence_t"](**value)
+        self.assertEqual(pb2py.Convert(msg), value)
+        self.assertEqual(msg.struct_value[0].name, "first")
+
+    def testLibc(self):
+        """Tests a struct which has an array field."""
+        module = _LoadModule(
+            _LoadSpec("lib", "ndk", "bionic", "1.0", "libcV1.vts"), "libcV1")
+        msg = module["sockaddr"](sa_family=2, sa_data=[1, 2, 3])
+        self.assertEqual(msg.struct_value[1].type, CompSpecMsg.TYPE_ARRAY)
+        self.assertEqual(pb2py.Convert(msg),
+                         {"sa_family": 2, "sa_data": [1, 2, 3]})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -15,9 +15,15 @@
 #
 
 import logging
+import threading
 
 from vts.proto import ComponentSpecificationMessage_pb2 as CompSpecMsg
-import logging
+from vts.runners.host import errors
+
+# The max number of specs whose compiled converters are kept.
+_MAX_CACHED_CONVERTERS = 1024
+_converters = {}
+_converters_lock = threading.Lock()
 
 
 def PyValue2PbEnum(message, pb_spec, py_value):
@@ -33,11 +39,7 @@ def PyValue2PbEnum(message, pb_spec, py_value):
     Returns:
         Converted VariableSpecificationMessage if found, None otherwise
     """
-    if pb_spec.name:
-        message.name = pb_spec.name
-    message.type = CompSpecMsg.TYPE_ENUM
-    # TODO(yim): derive the type by looking up its predefined_type.
-    setattr(message.scalar_value, "int32_t", py_value)
+    _CompileEnum(pb_spec)(message, py_value)
 
 
 def PyValue2PbScalar(message, pb_spec, py_value):
@@ -53,11 +55,7 @@ def PyValue2PbScalar(message, pb_spec, py_value):
     Returns:
         Converted VariableSpecificationMessage if found, None otherwise
     """
-    if pb_spec.name:
-        message.name = pb_spec.name
-    message.type = CompSpecMsg.TYPE_SCALAR
-    message.scalar_type = pb_spec.scalar_type
-    setattr(message.scalar_value, pb_spec.scalar_type, py_value)
+    _CompileScalar(pb_spec)(message, py_value)
 
 
 def PyString2PbString(message, pb_spec, py_value):
@@ -73,11 +71,7 @@ def PyString2PbString(message, pb_spec, py_value):
     Returns:
         Converted VariableSpecificationMessage if found, None otherwise
     """
-    if pb_spec.name:
-        message.name = pb_spec.name
-    message.type = CompSpecMsg.TYPE_STRING
-    message.string_value.message = py_value
-    message.string_value.length = len(py_value)
+    _CompileString(pb_spec)(message, py_value)
 
 
 def PyList2PbVector(message, pb_spec, py_value):
@@ -93,21 +87,7 @@ def PyList2PbVector(message, pb_spec, py_value):
     Returns:
         Converted VariableSpecificationMessage if found, None otherwise
     """
-    if pb_spec.name:
-        message.name = pb_spec.name
-    message.type = CompSpecMsg.TYPE_VECTOR
-    if len(py_value) == 0:
-        return message
-
-    vector_spec = pb_spec.vector_value[0]
-    for curr_value in py_value:
-        new_vector_message = message.vector_value.add()
-        if vector_spec.type == CompSpecMsg.TYPE_SCALAR:
-            PyValue2PbScalar(new_vector_message, vector_spec, curr_value)
-        else:
-            logging.error("unsupported type %s", message.type)
-            sys.exit(-1)
-    message.vector_size = len(py_value)
+    _CompileVector(pb_spec, (pb_spec, ))(message, py_value)
     return message
 
 
@@ -138,43 +118,248 @@ def PyDict2PbStruct(message, pb_spec, py_value):
 
     Returns:
         Converted VariableSpecificationMessage if found, None otherwise
+
+    Raises:
+        errors.VtsUnsupportedTypeError if the dict does not match the spec.
     """
-    if pb_spec.name:
-        message.name = pb_spec.name
-    message.type = CompSpecMsg.TYPE_STRUCT
-    provided_attrs = set(py_value.keys())
-    for attr in pb_spec.struct_value:
-        if attr.name in py_value:
-            provided_attrs.remove(attr.name)
-            curr_value = py_value[attr.name]
-            attr_msg = message.struct_value.add()
-            if attr.type == CompSpecMsg.TYPE_ENUM:
-                PyValue2PbEnum(attr_msg, attr, curr_value)
-            elif attr.type == CompSpecMsg.TYPE_SCALAR:
-                PyValue2PbScalar(attr_msg, attr, curr_value)
-            elif attr.type == CompSpecMsg.TYPE_STRING:
-                PyString2PbString(attr_msg, attr, curr_value)
-            elif attr.type == CompSpecMsg.TYPE_VECTOR:
-                PyList2PbVector(attr_msg, attr, curr_value)
-            elif attr.type == CompSpecMsg.TYPE_STRUCT:
-                sub_attr = FindSubStructType(pb_spec, attr.predefined_type)
-                if sub_attr:
-                    PyDict2PbStruct(attr_msg, sub_attr, curr_value)
-                else:
-                    logging.error("PyDict2PbStruct: substruct not found.")
-                    sys.exit(-1)
-            else:
-                logging.error("PyDict2PbStruct: unsupported type %s",
-                              attr.type)
-                sys.exit(-1)
-    if len(provided_attrs) > 0:
-        logging.error("PyDict2PbStruct: provided dictionary included elements" +
-                      " not part of the type being converted to: %s",
-                      provided_attrs)
-        sys.exit(-1)
+    _CompileStruct(pb_spec)(message, py_value)
     return message
 
 
+def _CompileEnum(pb_spec):
+    """Returns a function which fills a message with an enum value."""
+    name = pb_spec.name
+
+    def FillEnum(message, py_value):
+        if name:
+            message.name = name
+        message.type = CompSpecMsg.TYPE_ENUM
+        # TODO(yim): derive the type by looking up its predefined_type.
+        message.scalar_value.int32_t = py_value
+
+    return FillEnum
+
+
+def _CompileScalar(pb_spec):
+    """Returns a function which fills a message with a scalar value."""
+    name = pb_spec.name
+    scalar_type = pb_spec.scalar_type
+
+    def FillScalar(message, py_value):
+        if name:
+            message.name = name
+        message.type = CompSpecMsg.TYPE_SCALAR
+        message.scalar_type = scalar_type
+        setattr(message.scalar_value, scalar_type, py_value)
+
+    return FillScalar
+
+
+def _CompileString(pb_spec):
+    """Returns a function which fills a message with a string."""
+    name = pb_spec.name
+
+    def FillString(message, py_value):
+        if name:
+            message.name = name
+        message.type = CompSpecMsg.TYPE_STRING
+        message.string_value.message = py_value
+        message.string_value.length = len(py_value)
+
+    return FillString
+
+
+def _CompileVector(pb_spec, scopes):
+    """Returns a function which fills a message with a list.
+
+    Args:
+        pb_spec: VariableSpecificationMessage of the vector or array.
+        scopes: tuple of VariableSpecificationMessages whose sub_structs
+                define the struct elements, innermost first.
+    """
+    name = pb_spec.name
+    vector_type = pb_spec.type
+    if pb_spec.vector_value:
+        fill_element = _CompileLazily(pb_spec.vector_value[0], scopes)
+    else:
+        fill_element = None
+
+    def FillVector(message, py_value):
+        if name:
+            message.name = name
+        message.type = vector_type
+        if len(py_value) == 0:
+            return
+        if fill_element is None:
+            raise errors.VtsUnsupportedTypeError(
+                "The element type of vector %s is unknown." % name)
+        add = message.vector_value.add
+        for curr_value in py_value:
+            fill_element(add(), curr_value)
+        message.vector_size = len(py_value)
+
+    return FillVector
+
+
+def _CompileStruct(pb_spec, name=None, scopes=()):
+    """Returns a function which fills a message with a dict.
+
+    Args:
+        pb_spec: VariableSpecificationMessage of the struct type.
+        name: string, the name of the filled message. Defaults to the
+              name in pb_spec.
+        scopes: tuple of VariableSpecificationMessages enclosing pb_spec,
+                innermost first.
+    """
+    if name is None:
+        name = pb_spec.name
+    field_scopes = (pb_spec, ) + scopes
+    fields = [(attr.name, _CompileLazily(attr, field_scopes))
+              for attr in pb_spec.struct_value]
+    field_names = set(field_name for field_name, _ in fields)
+
+    def FillStruct(message, py_value):
+        if name:
+            message.name = name
+        message.type = CompSpecMsg.TYPE_STRUCT
+        matched = 0
+        add = message.struct_value.add
+        for field_name, fill_field in fields:
+            if field_name in py_value:
+                fill_field(add(), py_value[field_name])
+                matched += 1
+        if matched < len(py_value):
+            provided_attrs = set(py_value.keys()) - field_names
+            logging.error("PyDict2PbStruct: provided dictionary included "
+                          "elements not part of the type being converted "
+                          "to: %s", provided_attrs)
+            raise errors.VtsUnsupportedTypeError(
+                "%s has no fields %s" % (name, provided_attrs))
+
+    return FillStruct
+
+
+def _CompileStructType(pb_spec, scopes):
+    """Returns a function which fills a message with a named struct.
+
+    The type is looked up in the sub_structs of the scopes, innermost first,
+    and its fields in turn resolve types from where it is defined.
+
+    Args:
+        pb_spec: VariableSpecificationMessage whose predefined_type is the
+                 name of the struct.
+        scopes: tuple of VariableSpecificationMessages, innermost first.
+
+    Raises:
+        errors.VtsUnsupportedTypeError if the type is not found.
+    """
+    for index, scope in enumerate(scopes):
+        sub_attr = FindSubStructType(scope, pb_spec.predefined_type)
+        if sub_attr:
+            return _CompileStruct(sub_attr, pb_spec.name, scopes[index:])
+    logging.error("PyDict2PbStruct: substruct not found.")
+    raise errors.VtsUnsupportedTypeError(
+        "substruct %s not found." % pb_spec.predefined_type)
+
+
+def _Compile(pb_spec, scopes=()):
+    """Compiles a function which fills a message with a Python value.
+
+    Args:
+        pb_spec: VariableSpecificationMessage, the spec of the value.
+        scopes: tuple of VariableSpecificationMessages whose sub_structs
+                define the struct types pb_spec may refer to, innermost
+                first.
+
+    Returns:
+        function(message, py_value).
+
+    Raises:
+        errors.VtsUnsupportedTypeError if the type is not supported.
+    """
+    if pb_spec.type == CompSpecMsg.TYPE_ENUM:
+        return _CompileEnum(pb_spec)
+    elif pb_spec.type == CompSpecMsg.TYPE_SCALAR:
+        return _CompileScalar(pb_spec)
+    elif pb_spec.type == CompSpecMsg.TYPE_STRING:
+        return _CompileString(pb_spec)
+    elif (pb_spec.type == CompSpecMsg.TYPE_VECTOR or
+          pb_spec.type == CompSpecMsg.TYPE_ARRAY):
+        return _CompileVector(pb_spec, scopes or (pb_spec, ))
+    elif pb_spec.type == CompSpecMsg.TYPE_STRUCT:
+        if not scopes or pb_spec.struct_value:
+            return _CompileStruct(pb_spec, scopes=scopes)
+        return _CompileStructType(pb_spec, scopes)
+    logging.error("py2pb.Convert: unsupported type %s", pb_spec.type)
+    raise errors.VtsUnsupportedTypeError(
+        "Unsupported VariableSpecificationMessage type %s" % pb_spec.type)
+
+
+def _CompileLazily(pb_spec, scopes):
+    """Returns a function which compiles its filler on the first value.
+
+    A struct field or vector element of a type which cannot be converted
+    fails only when a value is provided for it.
+
+    Args:
+        pb_spec: VariableSpecificationMessage, the spec of the value.
+        scopes: tuple of VariableSpecificationMessages whose sub_structs
+                define the struct types pb_spec may refer to.
+
+    Returns:
+        function(message, py_value).
+    """
+    filler = []
+
+    def Fill(message, py_value):
+        if not filler:
+            filler.append(_Compile(pb_spec, scopes))
+        filler[0](message, py_value)
+
+    return Fill
+
+
+def GetConverter(pb_spec):
+    """Returns the compiled converter of a spec.
+
+    The converters are cached by the identity of the spec, so a type is
+    compiled once however many values of it are converted. Specs are long-lived
+    and must not be modified once converted.
+
+    Args:
+        pb_spec: VariableSpecificationMessage which captures the
+                 specification of a target attribute.
+
+    Returns:
+        function which takes a Python value and returns the converted
+        VariableSpecificationMessage.
+
+    Raises:
+        errors.VtsUnsupportedTypeError if the type is not supported.
+    """
+    key = id(pb_spec)
+    with _converters_lock:
+        # The cached spec keeps its id from being reused by another spec.
+        cached_spec, converter = _converters.get(key, (None, None))
+    if cached_spec is pb_spec:
+        return converter
+
+    name = pb_spec.name
+    fill = _Compile(pb_spec)
+
+    def Converter(py_value):
+        message = CompSpecMsg.VariableSpecificationMessage()
+        message.name = name
+        fill(message, py_value)
+        return message
+
+    with _converters_lock:
+        if len(_converters) >= _MAX_CACHED_CONVERTERS:
+            _converters.clear()
+        _converters[key] = (pb_spec, Converter)
+    return Converter
+
+
 def Convert(pb_spec, py_value):
     """Converts Python native data structure to VTS VariableSecificationMessage.
 
@@ -185,27 +370,12 @@ def Convert(pb_spec, py_value):
 
     Returns:
         Converted VariableSpecificationMessage if found, None otherwise
+
+    Raises:
+        errors.VtsUnsupportedTypeError if the type is not supported.
     """
     if not pb_spec:
-        logging.error("py2pb.Convert: ProtoBuf spec is None", pb_spec)
+        logging.error("py2pb.Convert: ProtoBuf spec is None")
         return None
 
-    message = CompSpecMsg.VariableSpecificationMessage()
-    message.name = pb_spec.name
-
-    if pb_spec.type == CompSpecMsg.TYPE_STRUCT:
-        PyDict2PbStruct(message, pb_spec, py_value)
-    elif pb_spec.type == CompSpecMsg.TYPE_ENUM:
-        PyValue2PbEnum(message, pb_spec, py_value)
-    elif pb_spec.type == CompSpecMsg.TYPE_SCALAR:
-        PyValue2PbScalar(message, pb_spec, py_value)
-    elif pb_spec.type == CompSpecMsg.TYPE_STRING:
-        PyString2PbString(attr_msg, attr, curr_value)
-    elif pb_spec.type == CompSpecMsg.TYPE_VECTOR:
-        PyList2PbVector(message, pb_spec, py_value)
-    else:
-        logging.error("py2pb.Convert: unsupported type %s",
-                      pb_spec.type)
-        sys.exit(-1)
-
-    return message
+    return GetConverter(pb_spec)(py_value)
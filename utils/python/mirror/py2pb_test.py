@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2017 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+
+from vts.proto import ComponentSpecificationMessage_pb2 as CompSpecMsg
+from vts.runners.host import errors
+from vts.utils.python.mirror import pb2py
+from vts.utils.python.mirror import py2pb
+
+
+def _Scalar(name, scalar_type="int32_t"):
+    """Returns the spec of a scalar field."""
+    spec = CompSpecMsg.VariableSpecificationMessage()
+    spec.name = name
+    spec.type = CompSpecMsg.TYPE_SCALAR
+    spec.scalar_type = scalar_type
+    return spec
+
+
+def _Vector(name, element_spec, vector_type=CompSpecMsg.TYPE_VECTOR):
+    """Returns the spec of a vector or array field."""
+    spec = CompSpecMsg.VariableSpecificationMessage()
+    spec.name = name
+    spec.type = vector_type
+    spec.vector_value.add().CopyFrom(element_spec)
+    return spec
+
+
+def _Struct(name, *fields):
+    """Returns the spec of a struct with the given fields."""
+    spec = CompSpecMsg.VariableSpecificationMessage()
+    spec.name = name
+    spec.type = CompSpecMsg.TYPE_STRUCT
+    for field in fields:
+        spec.struct_value.add().CopyFrom(field)
+    return spec
+
+
+def _StructRef(name, predefined_type):
+    """Returns the spec of a field whose type is a named struct."""
+    spec = CompSpecMsg.VariableSpecificationMessage()
+    spec.name = name
+    spec.type = CompSpecMsg.TYPE_STRUCT
+    spec.predefined_type = predefined_type
+    return spec
+
+
+class Py2PbTest(unittest.TestCase):
+    """Tests the conversion of Python values to specification messages."""
+
+    def testScalarAndString(self):
+        """Tests the conversion of a scalar and a string."""
+        msg = py2pb.Convert(_Scalar("x", "uint8_t"), 7)
+        self.assertEqual(msg.type, CompSpecMsg.TYPE_SCALAR)
+        self.assertEqual(msg.scalar_value.uint8_t, 7)
+
+        spec = CompSpecMsg.VariableSpecificationMessage()
+        spec.name = "s"
+        spec.type = CompSpecMsg.TYPE_STRING
+        msg = py2pb.Convert(spec, "abc")
+        self.assertEqual(msg.string_value.message, "abc")
+        self.assertEqual(msg.string_value.length, 3)
+
+    def testStructRoundTrip(self):
+        """Tests that a nested struct converts back to the same dict."""
+        point = _Struct("Point", _Scalar("x"), _Scalar("y"))
+        spec = _Struct("Line", _StructRef("begin", "Point"),
+                       _StructRef("end", "Point"),
+                       _Vector("weights", _Scalar("", "float_t")))
+        spec.sub_struct.add().CopyFrom(point)
+        value = {
+            "begin": {"x": 1, "y": 2},
+            "end": {"x": 3, "y": 4},
+            "weights": [0.5, 0.25],
+        }
+        msg = py2pb.Convert(spec, value)
+        self.assertEqual(msg.type, CompSpecMsg.TYPE_STRUCT)
+        self.assertEqual(pb2py.Convert(msg), value)
+
+    def testVectorAndArray(self):
+        """Tests that vectors and arrays keep their type and elements."""
+        for vector_type in (CompSpecMsg.TYPE_VECTOR, CompSpecMsg.TYPE_ARRAY):
+            spec = _Vector("v", _Scalar(""), vector_type)
+            msg = py2pb.Convert(spec, [1, 2, 3])
+            self.assertEqual(msg.type, vector_type)
+            self.assertEqual(msg.vector_size, 3)
+            self.assertEqual(pb2py.Convert(msg), [1, 2, 3])
+            self.assertEqual(py2pb.Convert(spec, []).vector_size, 0)
+
+    def testVectorOfStructs(self):
+        """Tests a vector whose elements are a named struct."""
+        spec = _Struct("Polygon",
+                       _Vector("points", _StructRef("", "Point")))
+        spec.sub_struct.add().CopyFrom(
+            _Struct("Point", _Scalar("x"), _Scalar("y")))
+        value = {"points": [{"x": 1, "y": 2}, {"x": 3, "y": 4}]}
+        msg = py2pb.Convert(spec, value)
+        self.assertEqual(pb2py.Convert(msg), value)
+
+    def testConverterCache(self):
+        """Tests that converters are cached by the identity of the spec."""
+        spec = _Struct("S", _Scalar("x"))
+        converter = py2pb.GetConverter(spec)
+        self.assertIs(py2pb.GetConverter(spec), converter)
+
+        equal_spec = _Struct("S", _Scalar("x"))
+        self.assertIsNot(py2pb.GetConverter(equal_spec), converter)
+        self.assertEqual(
+            py2pb.GetConverter(equal_spec)({"x": 1}), converter({"x": 1}))
+
+    def testUnsupportedFieldNotProvided(self):
+        """Tests that a field which cannot be converted is allowed if it
+        is not provided."""
+        handle = CompSpecMsg.VariableSpecificationMessage()
+        handle.name = "handle"
+        handle.type = CompSpecMsg.TYPE_HANDLE
+        spec = _Struct("S", _Scalar("x"), handle,
+                       _StructRef("other", "TopLevelStruct"))
+        msg = py2pb.Convert(spec, {"x": 1})
+        self.assertEqual(pb2py.Convert(msg), {"x": 1})
+
+        with self.assertRaises(errors.VtsUnsupportedTypeError):
+            py2pb.Convert(spec, {"x": 1, "handle": 2})
+        with self.assertRaises(errors.VtsUnsupportedTypeError):
+            py2pb.Convert(spec, {"other": {"x": 1}})
+
+    def testErrors(self):
+        """Tests the values which do not match the spec."""
+        spec = _Struct("S", _Scalar("x"))
+        with self.assertRaises(errors.VtsUnsupportedTypeError):
+            py2pb.Convert(spec, {"x": 1, "y": 2})
+
+        untyped = CompSpecMsg.VariableSpecificationMessage()
+        untyped.name = "v"
+        untyped.type = CompSpecMsg.TYPE_VECTOR
+        with self.assertRaises(errors.VtsUnsupportedTypeError):
+            py2pb.Convert(untyped, [1])
+
+        union = CompSpecMsg.VariableSpecificationMessage()
+        union.type = CompSpecMsg.TYPE_UNION
+        with self.assertRaises(errors.VtsUnsupportedTypeError):
+            py2pb.Convert(union, {})
+
+        self.assertIsNone(py2pb.Convert(None, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
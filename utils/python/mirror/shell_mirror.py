@@ -21,6 +21,13 @@ from vts.proto import AndroidSystemControlMessage_pb2 as ASysCtrlMsg
 from vts.runners.host.tcp_client import vts_tcp_client
 from vts.utils.python.mirror import shell_mirror_object
 
+_DEFAULT_POOL_SIZE = 4
+_DEFAULT_POOL_NAME = "_default_pool"
+# The min number of commands which ExecuteInParallel fans out to the default
+# pool. Shorter lists run on the default terminal, where a list costs one
+# round trip, rather than launching the pool's shell drivers.
+_MIN_PARALLEL_COMMANDS = 32
+
 
 class ShellMirror(object):
     """The class that acts as the mirror to an Android device's shell terminal.
@@ -32,16 +39,25 @@ class ShellMirror(object):
         _host_command_port: int, the host-side port for command-response
                             sessions.
         _shell_mirrors: dict, key is instance name, value is mirror object.
+        _clients: dict, key is instance name, value is the VtsTcpClient used
+                  by the mirror object.
+        _client_pool: VtsTcpClientPool, the pool to get clients from. None
+                      to connect a new client per shell instance.
+        _pool_members: dict, key is the instance name of a shell pool, value
+                       is the list of the instance names of its sessions.
         enabled: bool, whether remote shell feature is enabled for the device.
     """
 
-    def __init__(self, host_command_port):
+    def __init__(self, host_command_port, client_pool=None):
         self._shell_mirrors = {}
+        self._clients = {}
         self._host_command_port = host_command_port
+        self._client_pool = client_pool
+        self._pool_members = {}
         self.enabled = True
 
     def __del__(self):
-        for instance_name in self._shell_mirrors:
+        for instance_name in list(self._shell_mirrors):
             self.RemoveShell(instance_name)
         self._shell_mirrors = {}
 
@@ -51,8 +67,18 @@ class ShellMirror(object):
         Args:
             instance_name: string, the shell terminal instance name.
         """
-        shell_mirror = self._shell_mirrors[instance_name]
-        shell_mirror.CleanUp()
+        if instance_name in self._pool_members:
+            for member_name in self._pool_members.pop(instance_name):
+                self.RemoveShell(member_name)
+            self._shell_mirrors.pop(instance_name, None)
+            return
+        shell_mirror = self._shell_mirrors.pop(instance_name, None)
+        client = self._clients.pop(instance_name, None)
+        if self._client_pool and client:
+            self._client_pool.Release(client)
+            return
+        if shell_mirror:
+            shell_mirror.CleanUp()
 
     def InvokeTerminal(self, instance_name, bits=32):
         """Initiates a handler for a particular conventional HAL.
@@ -71,22 +97,65 @@ class ShellMirror(object):
             raise error.ComponentLoadingError(
                 "Invalid value for bits: %s" % bits)
 
-        client = vts_tcp_client.VtsTcpClient()
-        client.Connect(command_port=self._host_command_port)
+        if self._client_pool:
+            client = self._client_pool.Acquire()
+        else:
+            client = vts_tcp_client.VtsTcpClient()
+            client.Connect(command_port=self._host_command_port)
 
         logging.info("Init the driver service for shell, %s", instance_name)
-        launched = client.LaunchDriverService(
-            driver_type=ASysCtrlMsg.VTS_DRIVER_TYPE_SHELL,
-            service_name="shell_" + instance_name,
-            bits=bits)
-
-        if not launched:
-            raise errors.ComponentLoadingError(
-                "Failed to launch shell driver service %s" % instance_name)
-
+        try:
+            launched = client.LaunchDriverService(
+                driver_type=ASysCtrlMsg.VTS_DRIVER_TYPE_SHELL,
+                service_name="shell_" + instance_name,
+                bits=bits)
+            if not launched:
+                raise errors.ComponentLoadingError(
+                    "Failed to launch shell driver service %s" % instance_name)
+        except:
+            if self._client_pool:
+                self._client_pool.Release(client, reusable=False)
+            else:
+                client.Disconnect()
+            raise
+
+        self._clients[instance_name] = client
         mirror_object = shell_mirror_object.ShellMirrorObject(client)
         self._shell_mirrors[instance_name] = mirror_object
 
+    def InvokeTerminalPool(self,
+                           instance_name,
+                           size=_DEFAULT_POOL_SIZE,
+                           bits=32):
+        """Initiates a pool of shell sessions which run commands in parallel.
+
+        The pool is registered under instance_name and its Execute fans the
+        commands of a list out across the sessions. It is for independent
+        commands only, e.g., cleaning up unrelated files.
+
+        Args:
+            instance_name: string, the shell pool instance name.
+            size: integer, the number of shell sessions to launch.
+            bits: integer, processor architecture indicator: 32 or 64.
+        """
+        if size < 1:
+            raise errors.ComponentLoadingError(
+                "Invalid shell pool size: %s" % size)
+        member_names = []
+        try:
+            for index in range(size):
+                member_name = "%s_%d" % (instance_name, index)
+                self.InvokeTerminal(member_name, bits)
+                member_names.append(member_name)
+        except:
+            for member_name in member_names:
+                self.RemoveShell(member_name)
+            raise
+        self._pool_members[instance_name] = member_names
+        self._shell_mirrors[instance_name] = (
+            shell_mirror_object.ShellMirrorObjectPool(
+                [self._shell_mirrors[name] for name in member_names]))
+
     def __getattr__(self, name):
         """Get shell sessions through attribute.
 
@@ -119,3 +188,31 @@ class ShellMirror(object):
     def Execute(self, command, no_except=False):
         """Execute a shell command with default shell terminal"""
         return self.default.Execute(command, no_except)
+
+    def ExecuteInParallel(self, command, no_except=False):
+        """Execute independent shell commands with the default shell pool.
+
+        The pool is launched on first use. Fewer than _MIN_PARALLEL_COMMANDS
+        commands run on the default terminal instead.
+
+        Args:
+            command: string or a list of string, the commands, which may run
+                     in any order.
+            no_except: bool, if set to True, no exception will be thrown and
+                       error code will be -1 with error message on stderr.
+
+        Returns:
+            A dictionary containing shell command execution results in the
+            order of the commands.
+        """
+        if (not isinstance(command, list) or
+                len(command) < _MIN_PARALLEL_COMMANDS):
+            return self.Execute(command, no_except)
+        if _DEFAULT_POOL_NAME not in self._shell_mirrors:
+            self.InvokeTerminalPool(_DEFAULT_POOL_NAME)
+        return getattr(self, _DEFAULT_POOL_NAME).Execute(command, no_except)
+
+    def RemoveDefaultPool(self):
+        """Removes the shell pool launched by ExecuteInParallel, if any."""
+        if _DEFAULT_POOL_NAME in self._shell_mirrors:
+            self.RemoveShell(_DEFAULT_POOL_NAME)
@@ -14,7 +14,10 @@
 # limitations under the License.
 #
 
+import logging
+
 from vts.runners.host import const
+from vts.runners.host import errors
 
 
 class ShellMirrorObject(object):
@@ -51,5 +54,138 @@ class ShellMirrorObject(object):
             }
         return self._client.ExecuteShellCommand(command, no_except)
 
+    def ExecuteStreaming(self,
+                         command,
+                         output_file_path=None,
+                         callback=None,
+                         timeout=None,
+                         no_except=False):
+        '''Execute remote shell commands on device without buffering output.
+
+        The output is written to a host file and/or passed to a callback as
+        it arrives, so long running commands need not fit in memory.
+
+        Args:
+            command: string or a list of string, shell commands to execute on
+                     device.
+            output_file_path: string, path of a host file to append the
+                              stdout and stderr of the commands to.
+            callback: function(index, stdout, stderr), called with each chunk
+                      of output of the index-th command. It may raise an
+                      exception to skip the remaining commands.
+            timeout: int, seconds after which each command is killed on
+                     device with exit code 124. None for no limit.
+            no_except: bool, if set to True, no exception will be thrown and
+                       error code will be -1 with error message on stderr.
+
+        Returns:
+            A dictionary containing shell command execution results, where
+            stdout and stderr are empty strings.
+        '''
+        commands = command if isinstance(command, list) else [command]
+        if not self.enabled:
+            return self.Execute(commands, no_except)
+
+        output_file = open(output_file_path, "ab") if output_file_path else None
+
+        def HandleOutput(index, stdout, stderr):
+            if output_file:
+                output_file.write(stdout)
+                output_file.write(stderr)
+                output_file.flush()
+            if callback:
+                callback(index, stdout, stderr)
+
+        try:
+            return self._client.ExecuteShellCommandStreaming(
+                commands, HandleOutput, timeout)
+        except Exception as e:
+            if not no_except:
+                raise
+            logging.exception(e)
+            return self._client.GetShellCommandErrorResult(commands, e)
+        finally:
+            if output_file:
+                output_file.close()
+
     def CleanUp(self):
         self._client.Disconnect()
+
+
+class ShellMirrorObjectPool(ShellMirrorObject):
+    '''Executes independent shell commands on many shell sessions at once.
+
+    Each session has its own shell driver on the device, which executes the
+    commands sent to it one by one. The commands of a list are pipelined to
+    the sessions in turn so the sessions run them in parallel.
+
+    Attributes:
+        _mirrors: list of ShellMirrorObject, the sessions.
+    '''
+
+    def __init__(self, mirrors):
+        super(ShellMirrorObjectPool, self).__init__(mirrors[0]._client)
+        self._mirrors = mirrors
+
+    def Execute(self, command, no_except=False):
+        '''Execute remote shell commands on device in parallel.
+
+        The commands must not depend on each other as they may run in any
+        order.
+
+        Args:
+            command: string or a list of string, shell commands to execute on
+                     device.
+            no_except: bool, if set to True, no exception will be thrown and
+                       error code will be -1 with error message on stderr.
+
+        Returns:
+            A dictionary containing shell command execution results in the
+            order of the commands.
+
+        Raises:
+            errors.VtsTcpCommunicationError if a command fails to execute
+            and no_except is False.
+        '''
+        if not self.enabled or not isinstance(command, list):
+            return super(ShellMirrorObjectPool, self).Execute(
+                command, no_except)
+
+        pendings = []
+        for index, cmd in enumerate(command):
+            client = self._mirrors[index % len(self._mirrors)]._client
+            try:
+                pendings.append(client.ExecuteShellCommandAsync(cmd))
+            except Exception as e:
+                pendings.append(e)
+
+        results = {const.STDOUT: [], const.STDERR: [], const.EXIT_CODE: []}
+        first_error = None
+        for cmd, pending in zip(command, pendings):
+            try:
+                if isinstance(pending, Exception):
+                    raise pending
+                result = pending.result()
+                if result[const.EXIT_CODE] is None:
+                    raise errors.VtsTcpCommunicationError(
+                        "Failed to execute shell command: %s" % cmd)
+                for key in results:
+                    results[key].append(result[key][0])
+            except Exception as e:
+                # Keeps receiving the other responses so that the sessions
+                # stay usable.
+                first_error = first_error or e
+                results[const.STDOUT].append("")
+                results[const.STDERR].append(str(e))
+                results[const.EXIT_CODE].append(-1)
+
+        if first_error is not None:
+            if not no_except:
+                raise first_error
+            logging.error("Failed to execute shell commands: %s",
+                          first_error)
+        return results
+
+    def CleanUp(self):
+        for mirror in self._mirrors:
+            mirror.CleanUp()
@@ -0,0 +1,82 @@
+#
+# Copyright (C) 2017 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+
+from vts.runners.host import const
+from vts.runners.host import errors
+from vts.runners.host.tcp_client import vts_tcp_client_pool
+from vts.runners.host.tcp_server import fake_agent
+from vts.utils.python.mirror import shell_mirror
+
+
+class _FailingShellMirror(shell_mirror.ShellMirror):
+    """A ShellMirror which fails to launch the shell named fail_name."""
+
+    fail_name = None
+
+    def InvokeTerminal(self, instance_name, bits=32):
+        if instance_name == self.fail_name:
+            raise errors.ComponentLoadingError(
+                "Failed to launch shell driver service %s" % instance_name)
+        super(_FailingShellMirror, self).InvokeTerminal(instance_name, bits)
+
+
+class ShellMirrorTest(unittest.TestCase):
+    """Tests ShellMirror against FakeAgent.
+
+    Attributes:
+        _agent: FakeAgent, started for each test.
+        _pool: VtsTcpClientPool, the pool the shells get sessions from.
+    """
+
+    def setUp(self):
+        self._agent = fake_agent.FakeAgent()
+        self._agent.Start()
+        self._pool = vts_tcp_client_pool.VtsTcpClientPool(self._agent.port)
+
+    def tearDown(self):
+        self._pool.Clear()
+        self._agent.Stop()
+
+    def testInvokeTerminalPool(self):
+        """Tests that a shell pool runs the commands of a list in order."""
+        mirror = shell_mirror.ShellMirror(self._agent.port, self._pool)
+        mirror.InvokeTerminalPool("pool", size=2)
+        commands = ["echo %d" % index for index in range(5)]
+        results = mirror.pool.Execute(commands)
+        self.assertEqual(results[const.EXIT_CODE], [0] * 5)
+        mirror.RemoveShell("pool")
+        self.assertEqual(self._pool.created_count, 2)
+
+    def testInvokeTerminalPoolLaunchFailure(self):
+        """Tests that a failed shell pool releases the sessions it started."""
+        mirror = _FailingShellMirror(self._agent.port, self._pool)
+        mirror.fail_name = "pool_2"
+        self.assertRaises(errors.ComponentLoadingError,
+                          mirror.InvokeTerminalPool, "pool", 4)
+        self.assertEqual(mirror._shell_mirrors, {})
+        self.assertEqual(mirror._clients, {})
+        self.assertEqual(mirror._pool_members, {})
+
+        mirror.InvokeTerminal("shell")
+        mirror.InvokeTerminal("other_shell")
+        self.assertEqual(self._pool.created_count, 2)
+        self.assertEqual(self._pool.reused_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -19,11 +19,9 @@ import os
 from google.protobuf import text_format
 from vts.proto import VtsProfilingMessage_pb2 as VtsProfilingMsg
 from vts.proto import VtsReportMessage_pb2 as ReportMsg
-from vts.runners.host import asserts
 from vts.runners.host import const
 from vts.runners.host import keys
 from vts.utils.python.common import cmd_utils
-from vts.utils.python.os import path_utils
 from vts.utils.python.web import feature_utils
 
 LOCAL_PROFILING_TRACE_PATH = "/tmp/vts-test-trace"
@@ -118,32 +116,37 @@ class ProfilingFeature(feature_utils.Feature):
         if not host_profiling_trace_path:
             host_profiling_trace_path = LOCAL_PROFILING_TRACE_PATH
 
-        dut.shell.InvokeTerminal("profiling_shell")
-        target_trace_file = path_utils.JoinTargetPath(
-            TARGET_PROFILING_TRACE_PATH, "*.vts.trace")
-        results = dut.shell.profiling_shell.Execute("ls " + target_trace_file)
-        asserts.assertTrue(results, "failed to find trace file")
-        stdout_lines = results[const.STDOUT][0].split("\n")
-        logging.info("stdout: %s", stdout_lines)
         trace_files = []
-        for line in stdout_lines:
-            if line:
-                temp_file_name = os.path.join(LOCAL_PROFILING_TRACE_PATH,
-                                              os.path.basename(line.strip()))
-                dut.adb.pull("%s %s" % (line, temp_file_name))
-                trace_file_name = os.path.join(host_profiling_trace_path,
-                                               os.path.basename(line.strip()))
-                logging.info("Saving profiling traces: %s" % trace_file_name)
-                if temp_file_name != trace_file_name:
-                    file_cmd = ""
-                    if trace_file_tool:
-                        file_cmd += trace_file_tool
-                    file_cmd += " cp " + temp_file_name + " " + trace_file_name
+
+        def _SaveTraceFile(line, content):
+            temp_file_name = os.path.join(LOCAL_PROFILING_TRACE_PATH,
+                                          os.path.basename(line))
+            with open(temp_file_name, "wb") as trace_file:
+                trace_file.write(content)
+            trace_file_name = os.path.join(host_profiling_trace_path,
+                                           os.path.basename(line))
+            logging.info("Saving profiling traces: %s" % trace_file_name)
+            if temp_file_name != trace_file_name:
+                if trace_file_tool:
+                    file_cmd = (trace_file_tool + " cp " + temp_file_name +
+                                " " + trace_file_name)
                     results = cmd_utils.ExecuteShellCommand(file_cmd)
                     if results[const.EXIT_CODE][0] != 0:
                         logging.error(results[const.STDERR][0])
                         logging.error("Fail to execute command: %s" % file_cmd)
-                trace_files.append(temp_file_name)
+                else:
+                    with open(trace_file_name, "wb") as trace_file:
+                        trace_file.write(content)
+            trace_files.append(temp_file_name)
+
+        # All trace files are streamed in one adb session.
+        dut.pullFiles([TARGET_PROFILING_TRACE_PATH],
+                      name_pattern="*.vts.trace",
+                      max_depth=1,
+                      handler=_SaveTraceFile)
+        if not trace_files:
+            logging.warning("No trace file found in %s",
+                            TARGET_PROFILING_TRACE_PATH)
         return trace_files
 
     def EnableVTSProfiling(self, shell, hal_instrumentation_lib_path=None):